@@ -1,14 +1,38 @@
-from flask import Flask, request, jsonify, send_file, render_template
+from flask import Flask, Response, g, request, jsonify, send_file, render_template, stream_with_context
 from flask_cors import CORS
-from openpyxl import load_workbook
+from werkzeug.utils import secure_filename
+from collections import Counter
 from datetime import datetime, timedelta
 import os
 import json
-import shutil
+import hashlib
+import io
+import logging
 import sys
+import threading
 import time
 from pathlib import Path
 
+from batch import normalize_row, read_upload_rows, stream_csv, stream_xlsx, stream_zip
+from counters import DailyCounter
+from events import AsyncEventStream, EventHub, KEEPALIVE_FRAME, RESET_FRAME, sse_frame
+from idempotency import IdempotencyStore, payload_key
+from jobs import JobQueue, QueueFull
+from log_config import configure_logging, mask_name, new_request_id, redact, request_id_var
+from metrics import MetricsRegistry, RequestProfiler
+from ratelimit import QuotaExceeded, RateLimited, RateLimiter, parse_quota
+from retention import RetentionSweeper
+from storage import create_storage
+from registry import DocumentRegistry, decode_cursor, encode_cursor
+from reports import BookingReports, parse_date
+from search import DocumentSearch
+from template_engine import read_cell_values
+from render_offload import RenderOffload
+from template_registry import TemplateRegistry
+
+# LOG_LEVEL=DEBUG 时输出每个请求的详细信息（日志在 create_app() 中配置）
+logger = logging.getLogger('visa_booking')
+
 app = Flask(__name__)
 CORS(app)
 
@@ -19,14 +43,84 @@ BASE_DIR = Path(__file__).parent.absolute()
 UPLOAD_FOLDER = BASE_DIR / 'uploads'
 GENERATED_FOLDER = BASE_DIR / 'generated_documents'
 TEMPLATE_PATH = BASE_DIR / 'visa_booking_template.xlsx'
+# 模板映射文件所在的目录，每个 *.json 描述一个模板（见 template_registry.py）
+TEMPLATES_DIR = Path(os.environ.get('TEMPLATES_DIR', str(BASE_DIR / 'document_templates')))
 COUNTER_FILE = BASE_DIR / 'daily_counters.json'
+DATABASE_PATH = BASE_DIR / 'visa_booking.db'
+# 每日计数器保留的天数
+COUNTER_KEEP_DAYS = 30
+
+# 渲染方式: 'xml' 直接修改模板压缩包中的工作表 XML，'openpyxl' 为原来的方式
+RENDERER_MODE = os.environ.get('RENDERER_MODE', 'xml')
+# 单个文档的 xml / PDF 渲染使用的子进程数；0 为在处理请求的线程中渲染。
+# asgi.py 默认使用 CPU 数，渲染不阻塞同一进程中的其它请求
+RENDER_PROCESSES = int(os.environ.get('RENDER_PROCESSES', '0'))
+
+XLSX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+# 文档存储: 'disk' 每个文档一个文件（原来的方式），'memory' 只保存在进程内存中，
+# 'archive' 每天一个 zip 压缩包；不在存储中的文档按登记表中的预订记录重新生成
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'disk')
+STORAGE_MEMORY_MB = float(os.environ.get('STORAGE_MEMORY_MB', '256'))
+
+REQUIRED_FIELDS = ['guestName', 'email', 'company', 'arrivalDate', 'departureDate']
+# 登记表中保存的预订字段，足以重新生成同样的文档
+BOOKING_FIELDS = REQUIRED_FIELDS + ['quantity', 'roomType', 'remark', 'purpose', 'templateId']
+
+# 异步生成：是否允许异步模式、每个进程的渲染线程数、排队任务上限
+ASYNC_ENABLED = os.environ.get('ASYNC_ENABLED', '1') == '1'
+ASYNC_WORKERS = int(os.environ.get('ASYNC_WORKERS', '2'))
+ASYNC_QUEUE_LIMIT = int(os.environ.get('ASYNC_QUEUE_LIMIT', '50'))
+
+# 文档保留：保留时长、每批清理的文档数、后台定时清理间隔（0 为不自动清理）
+RETENTION_HOURS = float(os.environ.get('RETENTION_HOURS', '48'))
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', '500'))
+RETENTION_INTERVAL_MINUTES = float(os.environ.get('RETENTION_INTERVAL_MINUTES', '0'))
+
+# 幂等生成：相同请求在这段时间内返回之前的文档（0 为关闭）
+IDEMPOTENCY_WINDOW_SECONDS = float(os.environ.get('IDEMPOTENCY_WINDOW_SECONDS', '900'))
+# 下载的文档内容不会改变，浏览器和代理可以缓存
+DOWNLOAD_CACHE_SECONDS = int(os.environ.get('DOWNLOAD_CACHE_SECONDS', str(48 * 3600)))
+
+# 慢请求分析：处理时间超过这个毫秒数的请求保存 cProfile 数据到 PROFILE_DIR（0 为关闭）
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', '0'))
+PROFILE_DIR = Path(os.environ.get('PROFILE_DIR', str(BASE_DIR / 'profiles')))
+
+# 批量生成：每个请求最多的行数，以及每次渲染并登记的行数
+BATCH_MAX_ROWS = 10000
+BATCH_CHUNK_SIZE = 500
 
-# 调试信息
-print(f"PythonAnywhere 部署检测")
-print(f"当前工作目录: {os.getcwd()}")
-print(f"BASE_DIR: {BASE_DIR}")
-print(f"模板路径: {TEMPLATE_PATH}")
-print(f"生成文件夹: {GENERATED_FOLDER}")
+# 管理页面的实时更新（/documents/stream）：
+# 每个进程读取事件表的间隔（秒）；本进程生成或清理文档后立即读取
+SSE_POLL_SECONDS = float(os.environ.get('SSE_POLL_SECONDS', '1'))
+# 每个进程同时打开的事件流上限；线程池 WSGI 服务器中每个流占用一个线程，上限为 SSE_THREAD_STREAMS
+SSE_MAX_STREAMS = int(os.environ.get('SSE_MAX_STREAMS', '1000'))
+SSE_THREAD_STREAMS = int(os.environ.get('SSE_THREAD_STREAMS', '4'))
+# WSGI 下一个流保持的秒数，之后浏览器自动重连并从 Last-Event-ID 继续
+SSE_STREAM_SECONDS = float(os.environ.get('SSE_STREAM_SECONDS', '300'))
+# 没有事件时发送注释行的间隔，避免代理关闭空闲连接
+SSE_KEEPALIVE_SECONDS = 15
+# asgi.py 在 WSGI environ 中放入事件循环的键；有这个键时事件流在事件循环中发送
+EVENT_LOOP_ENVIRON = 'visa.event_loop'
+
+# /generate-document 限流：每个 IP / 邮箱 / 公司的令牌桶配额，格式为 <突发请求数>/<秒数>，
+# 按这个速度补充；空或 0 为不限制。桶保存在 DATABASE_PATH 中，所有 worker 共享
+RATE_LIMIT_IP = os.environ.get('RATE_LIMIT_IP', '30/60')
+RATE_LIMIT_EMAIL = os.environ.get('RATE_LIMIT_EMAIL', '20/3600')
+RATE_LIMIT_COMPANY = os.environ.get('RATE_LIMIT_COMPANY', '300/3600')
+# 应用前面的反向代理层数；大于 0 时客户端 IP 取 X-Forwarded-For 中最后一个代理添加的地址
+TRUSTED_PROXIES = int(os.environ.get('TRUSTED_PROXIES', '0'))
+
+# 搜索：默认和最多返回的结果数
+SEARCH_DEFAULT_LIMIT = 20
+SEARCH_MAX_LIMIT = 100
+
+# 报表：排名类报表默认和最多返回的行数
+REPORT_DEFAULT_LIMIT = 20
+REPORT_MAX_LIMIT = 1000
+
+# 模板在 create_app() 中预先编译；0 时在第一次使用时才解析（测试、命令行工具）
+PRELOAD_TEMPLATES = os.environ.get('PRELOAD_TEMPLATES', '1') == '1'
 
 # 创建目录 - 确保有写权限
 def create_directories():
@@ -35,23 +129,17 @@ def create_directories():
     for directory in directories:
         try:
             directory.mkdir(exist_ok=True)
-            print(f"✓ 目录已创建/存在: {directory}")
+            logger.debug(f"✓ 目录已创建/存在: {directory}")
         except Exception as e:
-            print(f"✗ 创建目录失败 {directory}: {e}")
+            logger.error(f"✗ 创建目录失败 {directory}: {e}")
             # 尝试设置权限
             try:
                 os.makedirs(str(directory), exist_ok=True, mode=0o755)
             except:
                 pass
 
-# 初始化时创建目录
-create_directories()
-
-# Store for generated documents
-documents_store = []
-
 def load_daily_counters():
-    """加载每日计数器"""
+    """加载旧版 daily_counters.json 中的每日计数器（仅用于迁移）"""
     try:
         if COUNTER_FILE.exists():
             with open(COUNTER_FILE, 'r', encoding='utf-8') as f:
@@ -62,43 +150,598 @@ def load_daily_counters():
                         counters[date] = int(counters[date])
                 return counters
     except Exception as e:
-        print(f"加载计数器失败: {e}")
+        logger.warning(f"加载计数器失败: {e}")
         return {}
     return {}
 
-def save_daily_counters(counters):
-    """保存每日计数器"""
-    try:
-        with open(COUNTER_FILE, 'w', encoding='utf-8') as f:
-            json.dump(counters, f, ensure_ascii=False)
-        print(f"计数器已保存: {counters}")
-    except Exception as e:
-        print(f"保存计数器失败: {e}")
+# 生成流程各阶段的耗时和请求结果统计，由 /metrics 输出
+metrics = MetricsRegistry()
+stage_seconds = metrics.histogram(
+    'visa_generation_stage_seconds', 'Time spent in each stage of document generation', ['stage'])
+generate_requests = metrics.counter(
+    'visa_generate_requests_total', 'Outcome of /generate-document requests', ['outcome'])
+documents_generated = metrics.counter(
+    'visa_documents_generated_total', 'Documents rendered and registered', ['mode'])
+pdf_requests = metrics.counter(
+    'visa_pdf_requests_total', 'PDF downloads served from the cache or rendered', ['cache'])
+request_seconds = metrics.histogram(
+    'visa_http_request_seconds', 'Request handling time by endpoint', ['endpoint'])
+server_errors = metrics.counter(
+    'visa_http_server_errors_total', 'Responses with a 5xx status by endpoint', ['endpoint'])
+metrics.gauge('visa_job_queue_pending', 'Async generation jobs queued or running in this process',
+              lambda: job_queue.pending)
+metrics.gauge('visa_sse_subscribers', 'Open /documents/stream connections in this process',
+              lambda: document_events.subscriber_count if document_events is not None else 0)
+request_profiler = RequestProfiler(PROFILE_SLOW_MS, PROFILE_DIR)
+
+# 下面的服务在 create_app() 中创建；导入本模块不写任何文件
+document_templates = None
+render_offload = None
+document_registry = None
+document_storage = None
+retention_sweeper = None
+idempotency_store = None
+job_queue = None
+daily_counter = None
+document_events = None
+booking_reports = None
+rate_limiter = None
+document_search = None
+_started = False
+_start_lock = threading.Lock()
+
+def init_services():
+    """创建目录、编译模板、打开数据库并启动后台任务"""
+    global document_templates, render_offload, document_registry, document_storage
+    global retention_sweeper, idempotency_store, job_queue, daily_counter, document_events, booking_reports
+    global rate_limiter, document_search
+
+    # 调试信息
+    logger.debug("PythonAnywhere 部署检测")
+    logger.debug(f"当前工作目录: {os.getcwd()}")
+    logger.debug(f"BASE_DIR: {BASE_DIR}")
+    logger.debug(f"模板路径: {TEMPLATE_PATH}")
+    logger.debug(f"生成文件夹: {GENERATED_FOLDER}")
+
+    create_directories()
+
+    # 模板和单元格映射在启动时编译；每个模板只解析一次，文件修改后自动重新加载。
+    # PDF 版式也在启动时编译，第一个 PDF 请求不需要解析模板
+    document_templates = TemplateRegistry(TEMPLATES_DIR)
+    document_templates.load()
+    if PRELOAD_TEMPLATES:
+        for document_template in document_templates:
+            if document_template.template_path.exists():
+                document_template.preload(RENDERER_MODE)
+    render_offload = RenderOffload(RENDER_PROCESSES) if RENDER_PROCESSES > 0 else None
+
+    # Store for generated documents - SQLite 登记表，所有 worker 共享，重启后保留
+    document_registry = DocumentRegistry(DATABASE_PATH)
+    document_storage = create_storage(STORAGE_BACKEND, GENERATED_FOLDER, int(STORAGE_MEMORY_MB * 1024 * 1024))
+    if STORAGE_BACKEND == 'disk' and document_registry.count() == 0 and GENERATED_FOLDER.exists():
+        rebuilt = document_registry.rebuild_from_folder(GENERATED_FOLDER)
+        if rebuilt:
+            logger.info(f"登记表为空，已从生成文件夹恢复 {rebuilt} 个文档")
+
+    # 报表查询读取登记表中由触发器维护的汇总表，搜索使用同一个数据库中的全文索引
+    booking_reports = BookingReports(document_registry)
+    document_search = DocumentSearch(document_registry)
+
+    # 文档增删事件，推送给 /documents/stream
+    document_events = EventHub(document_registry, encode_document_event, poll_interval=SSE_POLL_SECONDS,
+                               max_queue=SSE_MAX_STREAMS)
+
+    # 过期文档清理
+    retention_sweeper = RetentionSweeper(document_registry, document_storage, ttl_hours=RETENTION_HOURS,
+                                         batch_size=RETENTION_BATCH_SIZE,
+                                         lock_path=BASE_DIR / '.retention.lock',
+                                         companion_suffixes=['.pdf'])
+
+    # 幂等请求记录
+    idempotency_store = IdempotencyStore(DATABASE_PATH, window_seconds=IDEMPOTENCY_WINDOW_SECONDS)
+
+    # 生成请求限流，配额有误时启动失败
+    rate_limiter = RateLimiter(DATABASE_PATH, {
+        'ip': parse_quota(RATE_LIMIT_IP),
+        'email': parse_quota(RATE_LIMIT_EMAIL),
+        'company': parse_quota(RATE_LIMIT_COMPANY),
+    })
+
+    # 异步生成任务队列
+    job_queue = JobQueue(DATABASE_PATH, max_workers=ASYNC_WORKERS, max_pending=ASYNC_QUEUE_LIMIT)
+
+    # 确认号计数器（SQLite，跨 worker 共享），首次启动时导入旧的 JSON 计数器
+    daily_counter = DailyCounter(DATABASE_PATH, keep_days=COUNTER_KEEP_DAYS)
+    if COUNTER_FILE.exists():
+        legacy_counters = load_daily_counters()
+        if legacy_counters:
+            daily_counter.seed(legacy_counters)
+        try:
+            COUNTER_FILE.rename(COUNTER_FILE.with_suffix('.json.migrated'))
+            logger.info(f"已迁移旧计数器: {COUNTER_FILE}")
+        except OSError:
+            pass  # 另一个 worker 已经完成迁移
+
+def create_app(**settings):
+    """Initialize the services once per process and return the Flask app
+
+    导入 app.py 只定义路由和配置，不创建目录、不打开数据库、不解析模板；
+    这些在第一次调用 create_app() 时进行。gunicorn 用 preload_app 在主进程中
+    调用一次（见 gunicorn.conf.py），编译好的模板由 fork 出的 worker 以
+    写时复制的方式共享。settings 覆盖同名的配置常量，例如测试使用临时目录:
+
+        create_app(GENERATED_FOLDER=tmp / 'docs', DATABASE_PATH=tmp / 'test.db')
+
+    传入 settings 时按新的配置重新初始化。
+    """
+    global _started
+    unknown = [name for name in settings if not name.isupper() or name not in globals()]
+    if unknown:
+        raise TypeError(f"Unknown settings: {', '.join(unknown)}")
+    with _start_lock:
+        if settings or not _started:
+            globals().update(settings)
+            configure_logging()
+            init_services()
+            _started = True
+    return app
+
+def start_background_tasks():
+    """Start the threads that must run in the serving process (the periodic retention sweep)
+
+    create_app() 可能在 gunicorn 的主进程中运行（preload_app），主进程中启动的
+    线程不会带到 fork 出的 worker 里，清理会在不处理请求的主进程中进行。这里
+    由各个入口在处理请求的进程中调用：gunicorn 的 post_worker_init、asgi.py
+    的 lifespan 启动、直接运行 app.py。每个 worker 都会启动定时清理，文件锁
+    保证同一时间只有一个在执行。
+    """
+    if RETENTION_INTERVAL_MINUTES > 0:
+        retention_sweeper.start_scheduler(RETENTION_INTERVAL_MINUTES * 60)
 
 def generate_confirmation_number():
-    """Generate a unique confirmation number: YYMMDDXXXX"""
+    """Generate a unique confirmation number: YYYYMMDDXXXX"""
     today = datetime.now().strftime('%Y%m%d')
-    counters = load_daily_counters()
+    sequence = daily_counter.next(today)
     
-    print(f"当前计数器状态: {counters}")
-    print(f"今天日期: {today}")
+    # 生成确认号
+    confirmation_number = f"{today}{str(sequence).zfill(4)}"
+    logger.debug(f"生成的确认号: {confirmation_number}")
     
-    # 检查今天是否已有计数器
-    if today in counters:
-        # 递增计数器
-        counters[today] += 1
+    return confirmation_number
+
+def allocate_confirmation_numbers(count):
+    """一次事务中分配 count 个连续的确认号"""
+    today = datetime.now().strftime('%Y%m%d')
+    return [f"{today}{str(sequence).zfill(4)}" for sequence in daily_counter.allocate(count, today)]
+
+def render_with_openpyxl(template, cell_values):
+    """用 openpyxl 渲染：从缓存的模板快照获取工作簿副本并写入数据，返回 xlsx 字节"""
+    with stage_seconds.time(stage='template_copy'):
+        wb = template.cache.new_workbook()
+    ws = wb.active
+    
+    # 只取消需要写入的合并区域
+    merge_started = time.perf_counter()
+    merges_to_remove = []
+    for merge_range in list(ws.merged_cells.ranges):
+        for cell_addr in template.merged_cells:
+            cell = ws[cell_addr]
+            if merge_range.min_row <= cell.row <= merge_range.max_row and \
+               merge_range.min_col <= cell.column <= merge_range.max_col:
+                merges_to_remove.append(merge_range)
+                break
+    
+    for merge_range in merges_to_remove:
+        ws.unmerge_cells(str(merge_range))
+    merge_seconds = time.perf_counter() - merge_started
+    
+    with stage_seconds.time(stage='cell_writes'):
+        for cell_addr, value in cell_values.items():
+            ws[cell_addr] = value
+    
+    # 重新合并我们取消的区域
+    merge_started = time.perf_counter()
+    for merge_range in merges_to_remove:
+        try:
+            ws.merge_cells(str(merge_range))
+        except Exception as e:
+            logger.warning(f"重新合并失败 {merge_range}: {e}")
+    stage_seconds.observe(merge_seconds + time.perf_counter() - merge_started, stage='merge_handling')
+    
+    buffer = io.BytesIO()
+    with stage_seconds.time(stage='serialize'):
+        wb.save(buffer)
+    return buffer.getvalue()
+
+def render_document(template, cell_values):
+    """按 RENDERER_MODE 渲染文档并返回 xlsx 字节，模板不兼容时退回 openpyxl"""
+    if RENDERER_MODE == 'xml':
+        try:
+            with stage_seconds.time(stage='render_xml'):
+                if render_offload is not None:
+                    return render_offload.render_xlsx(template, cell_values)
+                return template.xlsx_renderer.render_bytes(cell_values)
+        except ValueError as e:
+            logger.warning(f"XML 渲染不可用，改用 openpyxl: {e}")
+    return render_with_openpyxl(template, cell_values)
+
+def render_and_store(cell_values, document_info, mode='sync'):
+    """渲染文档、写入存储并登记，返回 xlsx 字节"""
+    content = render_document(document_templates.get(document_info['template_id']), cell_values)
+    with stage_seconds.time(stage='save'):
+        document_storage.save(document_info, content)
+    document_info['size'] = len(content)
+    with stage_seconds.time(stage='registry_write'):
+        document_registry.add(document_info)
+    documents_generated.inc(mode=mode)
+    document_events.notify()
+    return content
+
+def store_document(cell_values, document_info, mode='sync'):
+    """渲染文档并登记，异步任务的执行函数"""
+    render_and_store(cell_values, document_info, mode)
+    return {
+        'document_id': document_info['id'],
+        'filename': document_info['filename'],
+        'download_url': document_info['download_url']
+    }
+
+def document_response(document_info):
+    """/generate-document 成功时返回的文档信息"""
+    return {
+        'id': document_info['id'],
+        'filename': document_info['filename'],
+        'company': document_info['company'],
+        'email': document_info['email'],
+        'guest_name': document_info['guest_name'],
+        'nights': document_info['nights'],
+        'total_amount': document_info['total_amount'],
+        'download_url': document_info['download_url'],
+        'pdf_url': f"/download/{document_info['id']}.pdf",
+        'view_url': f"/documents/{document_info['id']}"
+    }
+
+def request_idempotency_key(data):
+    """Idempotency-Key 请求头，没有时使用请求内容的哈希；关闭幂等时返回 None"""
+    if IDEMPOTENCY_WINDOW_SECONDS <= 0:
+        return None
+    header = request.headers.get('Idempotency-Key', '').strip()
+    if header:
+        return 'key:' + header[:200]
+    return payload_key(data)
+
+def release_idempotency_key(key):
+    if key:
+        idempotency_store.release(key)
+
+def idempotency_pending_response():
+    response = jsonify({
+        'success': False,
+        'message': 'The same request is still being processed, please retry later'
+    })
+    response.headers['Retry-After'] = '1'
+    return response, 409
+
+def replay_idempotent_request(key, payload, inline=False):
+    """有效期内重复的请求返回之前的结果；需要重新生成时返回 None
+
+    ``payload`` 为请求内容的哈希（payload_key），同一个 Idempotency-Key 用于
+    不同的预订时返回 422。
+    """
+    status, entry = idempotency_store.claim(key, payload)
+    if status == 'new':
+        return None
+    if status == 'pending':
+        return idempotency_pending_response()
+    if status == 'conflict':
+        return jsonify({
+            'success': False,
+            'message': 'Idempotency-Key was already used for a different booking'
+        }), 422
+    
+    doc = document_registry.get(entry['document_id']) if entry['document_id'] else None
+    if doc is not None and document_available(doc):
+        logger.info(f"重复请求，返回已生成的文档: {doc['id']}")
+        if inline:
+            content = document_content(doc)
+            if content is not None:
+                return inline_response(doc, content, replayed=True)
+        response = jsonify({
+            'success': True,
+            'message': 'Visa booking document generated successfully!',
+            'document': document_response(doc)
+        })
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response
+    
+    job = job_queue.get(entry['job_id']) if entry['job_id'] else None
+    if job is not None and job['status'] in ('queued', 'running'):
+        response = jsonify({
+            'success': True,
+            'message': 'Visa booking document queued for generation',
+            'job': {
+                'id': job['id'],
+                'status': job['status'],
+                'status_url': f"/jobs/{job['id']}"
+            }
+        })
+        response.headers['Location'] = f"/jobs/{job['id']}"
+        response.headers['Idempotent-Replayed'] = 'true'
+        return response, 202
+    
+    # 之前的文档已被清理或生成失败：重新生成；同时到达的重试只有一个重新生成
+    if not idempotency_store.reclaim(key, entry, payload):
+        return idempotency_pending_response()
+    return None
+
+def rate_limited_response(error):
+    """429 with Retry-After for a RateLimited error
+
+    QuotaExceeded（一次批量超过配额的容量）重试也不会通过，不带 Retry-After，
+    返回这个配额允许的最大批量。
+    """
+    if isinstance(error, QuotaExceeded):
+        logger.warning(f"批量超过 {error.scope} 限流的容量", extra={'cost': error.cost, 'capacity': error.capacity})
+        return jsonify({
+            'success': False,
+            'message': f'Batch exceeds the {error.scope} rate limit of {error.capacity} documents, '
+                       f'split it into smaller batches',
+            'max_batch_size': error.capacity
+        }), 429
+    logger.warning(f"请求过于频繁，按 {error.scope} 限流", extra={'retry_after': error.retry_after})
+    response = jsonify({
+        'success': False,
+        'message': 'Too many requests, please retry later',
+        'retry_after': error.retry_after
+    })
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response, 429
+
+def document_template(doc):
+    """生成文档时使用的模板；没有 templateId 的记录使用默认模板。模板已不存在时为 KeyError"""
+    booking = json.loads(doc['booking']) if doc.get('booking') else {}
+    return document_templates.get(booking.get('templateId'))
+
+def save_rebuilt(doc, content, suffix=None):
+    """Save a regenerated file unless the document has been removed from the registry
+
+    清理任务删除的文档可能还在其它 worker 的请求中，这时保存的文件没有登记
+    记录指向它，清理任务永远不会删除。保存后再检查一次，期间被删除时删掉
+    刚保存的文件（按天归档的存储不能删除单个文档，它随这一天的压缩包删除）。
+    """
+    if not document_registry.exists(doc['id']):
+        return False
+    document_storage.save(doc, content, suffix)
+    if not document_registry.exists(doc['id']):
+        if document_storage.deletes_documents:
+            document_storage.delete(doc, suffix)
+        return False
+    return True
+
+def document_content(doc):
+    """文档的 xlsx 字节：从存储读取，不在存储中时按登记表中的预订记录重新生成
+
+    旧记录没有预订数据、使用的模板已被移除、或者文档已被删除时无法重新生成，
+    返回 None。
+    """
+    content = document_storage.load(doc)
+    if content is not None or not doc.get('booking'):
+        return content
+    if not document_registry.exists(doc['id']):
+        return None
+    booking = json.loads(doc['booking'])
+    room_rate = booking.pop('roomRate', None)
+    generated = datetime.strptime(doc['generated_date'], '%Y-%m-%d %H:%M:%S')
+    try:
+        cell_values, document_info = prepare_booking(booking, doc['id'], now=generated, room_rate=room_rate)
+    except KeyError:
+        logger.warning(f"无法重新生成 {doc['id']}: 模板 {booking.get('templateId')} 不存在")
+        return None
+    with stage_seconds.time(stage='regenerate'):
+        content = render_document(document_templates.get(document_info['template_id']), cell_values)
+    if not save_rebuilt(doc, content):
+        return None
+    documents_generated.inc(mode='regenerated')
+    logger.info(f"文档不在存储中，已按预订记录重新生成: {doc['id']}", extra={'document_id': doc['id']})
+    return content
+
+def document_available(doc):
+    """文档在存储中，或者可以重新生成"""
+    return document_storage.size(doc) is not None or bool(doc.get('booking'))
+
+def send_document(doc, source, download_name, mimetype):
+    """下载响应；source 为磁盘上的路径或内存中的字节"""
+    if isinstance(source, bytes):
+        # 内存中的内容没有文件的修改时间，ETag 取内容的哈希
+        response = send_file(
+            io.BytesIO(source),
+            as_attachment=True,
+            download_name=download_name,
+            mimetype=mimetype,
+            conditional=True,
+            etag=hashlib.sha1(source).hexdigest(),
+            last_modified=datetime.strptime(doc['generated_date'], '%Y-%m-%d %H:%M:%S'),
+            max_age=DOWNLOAD_CACHE_SECONDS
+        )
     else:
-        # 新的一天，从1开始
-        counters[today] = 1
+        # conditional=True 处理 If-None-Match / If-Modified-Since 和 Range 请求
+        response = send_file(
+            str(source),
+            as_attachment=True,
+            download_name=download_name,
+            mimetype=mimetype,
+            conditional=True,
+            etag=True,
+            max_age=DOWNLOAD_CACHE_SECONDS
+        )
+    response.cache_control.immutable = True
+    return response
+
+def inline_response(doc, content, replayed=False):
+    """inline=true 时直接在 /generate-document 的响应中返回 xlsx"""
+    response = send_document(doc, content, doc['filename'], XLSX_MIMETYPE)
+    response.headers['X-Document-Id'] = doc['id']
+    response.headers['Location'] = f"/documents/{doc['id']}"
+    if replayed:
+        response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def client_ip():
+    """Address of the client, seen through TRUSTED_PROXIES reverse proxies"""
+    if TRUSTED_PROXIES > 0:
+        # 客户端可以自己伪造 X-Forwarded-For 的前几项，只信任代理追加的最后几项
+        forwarded = [ip.strip() for ip in request.headers.get('X-Forwarded-For', '').split(',') if ip.strip()]
+        if len(forwarded) >= TRUSTED_PROXIES:
+            return forwarded[-TRUSTED_PROXIES]
+    return request.remote_addr or ''
+
+def wants_inline(data):
+    """客户端通过 ?inline=true 或 JSON 中的 "inline": true 要求在响应中直接返回文件"""
+    if request.args.get('inline', '').lower() in ('1', 'true', 'yes'):
+        return True
+    return isinstance(data, dict) and data.get('inline') is True
+
+def wants_async(data):
+    """客户端通过 ?async=true、JSON 中的 "async": true 或 Prefer: respond-async 请求异步生成"""
+    if request.args.get('async', '').lower() in ('1', 'true', 'yes'):
+        return True
+    if 'respond-async' in request.headers.get('Prefer', ''):
+        return True
+    return isinstance(data, dict) and data.get('async') is True
+
+def validate_booking(data):
+    """检查必填字段，返回错误信息；没有问题时返回 None"""
+    if not isinstance(data, dict):
+        return 'Booking must be a JSON object'
+    for field in REQUIRED_FIELDS:
+        if not data.get(field):
+            return f'Missing required field: {field}'
+    try:
+        document_templates.get(data.get('templateId'))
+    except KeyError:
+        if data.get('templateId'):
+            return f"Unknown templateId: {data['templateId']}"
+        return 'No document template is configured'
+    return None
+
+def prepare_booking(data, confirmation_number, now=None, room_rate=None):
+    """计算入住天数和金额，按模板的单元格映射返回要写入的单元格和文档信息
+
+    data 中的 templateId 选择模板（默认模板）；房价按模板中 roomType 的价格。
+    重新生成已有文档时传入原来的生成时间和房价，结果与第一次生成时相同。
+    """
+    template = document_templates.get(data.get('templateId'))
     
-    # 保存计数器
-    save_daily_counters(counters)
+    # Calculate nights
+    arrival_date = datetime.strptime(data['arrivalDate'], '%Y-%m-%d')
+    departure_date = datetime.strptime(data['departureDate'], '%Y-%m-%d')
+    nights = (departure_date - arrival_date).days
+    if nights < 1:
+        nights = 1
     
-    # 生成确认号
-    confirmation_number = f"{today}{str(counters[today]).zfill(4)}"
-    print(f"生成的确认号: {confirmation_number}")
+    # Calculate total amount
+    room_type = data.get('roomType', template.default_room_type)
+    if room_rate is None:
+        room_rate = template.rate(room_type)
+    quantity = data.get('quantity', 1)
+    total_amount = nights * room_rate * quantity
     
-    return confirmation_number
+    now = now or datetime.now()
+    remark = data.get('remark', '')
+    if data.get('purpose') == 'VISA_APPLICATION_ONLY':
+        remark = "FOR VISA APPLICATION PURPOSES ONLY - NOT AN ACTUAL BOOKING. " + remark
+    cell_values = template.cell_values({
+        'guestName': data['guestName'],
+        'email': data['email'],
+        'company': data['company'],
+        'arrivalDate': arrival_date,
+        'departureDate': departure_date,
+        'bookingDate': now,
+        'generatedAt': now,
+        'confirmationNumber': confirmation_number,
+        'remark': remark,
+        'roomType': room_type,
+        'quantity': quantity,
+        'nights': nights,
+        'roomRate': room_rate,
+        'totalAmount': total_amount,
+    })
+    
+    # Generate filename
+    safe_company = "".join(c for c in data['company'] if c.isalnum() or c in (' ', '-', '_')).strip()
+    safe_company = safe_company.replace(' ', '_')[:30]
+    filename = f"Visa_Booking_{confirmation_number}_{safe_company}.xlsx"
+    filepath = GENERATED_FOLDER / filename
+    
+    document_info = {
+        'id': confirmation_number,
+        'filename': filename,
+        'company': data['company'],
+        'email': data['email'],
+        'guest_name': data['guestName'],
+        'arrival_date': data['arrivalDate'],
+        'departure_date': data['departureDate'],
+        'nights': nights,
+        'total_amount': total_amount,
+        'generated_date': now.strftime('%Y-%m-%d %H:%M:%S'),
+        'filepath': str(filepath),
+        'purpose': 'VISA_APPLICATION_ONLY',
+        'booking': json.dumps({**{field: data[field] for field in BOOKING_FIELDS if field in data},
+                               'templateId': template.id, 'roomRate': room_rate}, ensure_ascii=False),
+        'template_id': template.id,
+        'download_url': f'/download/{confirmation_number}',
+        'pdf_url': f'/download/{confirmation_number}.pdf',
+        'print_url': f'/print/{confirmation_number}'
+    }
+    return cell_values, document_info
+
+# 不在 INFO 级别记录访问日志的路径
+QUIET_PATHS = {'/healthz', '/metrics'}
+
+@app.before_request
+def ensure_started():
+    """直接以 app:app 运行（没有调用 create_app）时，在第一个请求前初始化"""
+    if not _started:
+        create_app()
+        start_background_tasks()
+
+@app.before_request
+def start_request_log():
+    """为每个请求分配关联 id（沿用客户端的 X-Request-ID），本次请求的日志都带上它"""
+    g.request_id = new_request_id(request.headers.get('X-Request-ID'))
+    g.request_id_token = request_id_var.set(g.request_id)
+    g.request_started = time.perf_counter()
+    g.profiler = request_profiler.start()
+
+@app.after_request
+def finish_request_log(response):
+    request_id = getattr(g, 'request_id', None)
+    if request_id:
+        elapsed = time.perf_counter() - g.request_started
+        # 用路由规则而不是实际路径作为标签，避免每个文档 id 一个时间序列
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        request_seconds.observe(elapsed, endpoint=endpoint)
+        if response.status_code >= 500:
+            server_errors.inc(endpoint=endpoint)
+        profile_path = request_profiler.finish(g.pop('profiler', None), elapsed, f'{request.method}_{endpoint}')
+        if profile_path:
+            logger.info(f"慢请求分析已保存: {profile_path}")
+        response.headers['X-Request-ID'] = request_id
+        # 健康检查和指标抓取很频繁，只在 DEBUG 时记录
+        level = logging.DEBUG if request.path in QUIET_PATHS else logging.INFO
+        logger.log(level, f"{request.method} {request.path} {response.status_code}", extra={
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 2)
+        })
+    return response
+
+@app.teardown_request
+def reset_request_id(exc=None):
+    token = g.pop('request_id_token', None)
+    if token is not None:
+        request_id_var.reset(token)
 
 @app.route('/')
 def index():
@@ -111,280 +754,594 @@ def admin_panel():
 
 @app.route('/generate-document', methods=['POST'])
 def generate_document():
+    idempotency_key = None
     try:
         data = request.json
         
-        # 调试：打印接收到的数据
-        print("\n" + "="*60)
-        print("收到生成文档请求:")
-        print(f"数据: {data}")
+        # 调试：记录接收到的数据（已脱敏）
+        logger.debug("收到生成文档请求: %s", redact(data))
         
         # Validate required fields
-        required_fields = ['guestName', 'email', 'company', 'arrivalDate', 'departureDate']
-        for field in required_fields:
-            if not data.get(field):
-                print(f"缺失必填字段: {field}")
-                return jsonify({
-                    'success': False,
-                    'message': f'Missing required field: {field}'
-                }), 400
-        
-        # Generate unique confirmation number
-        confirmation_number = generate_confirmation_number()
-        print(f"生成的确认号: {confirmation_number}")
-        
-        # Calculate nights
-        arrival_date = datetime.strptime(data['arrivalDate'], '%Y-%m-%d')
-        departure_date = datetime.strptime(data['departureDate'], '%Y-%m-%d')
-        nights = (departure_date - arrival_date).days
-        if nights < 1:
-            nights = 1
-        
-        # Calculate total amount
-        room_rate = 98000
-        quantity = data.get('quantity', 1)
-        total_amount = nights * room_rate * quantity
-        
-        print(f"入住天数: {nights}, 总金额: {total_amount}")
-        
-        # Check if template exists
-        if not TEMPLATE_PATH.exists():
-            print("模板文件不存在，尝试创建...")
-            create_template_file()
-            if not TEMPLATE_PATH.exists():
-                return jsonify({
-                    'success': False,
-                    'message': f'Template file not found at: {TEMPLATE_PATH}'
-                }), 404
-        
-        print(f"模板文件存在: {TEMPLATE_PATH}")
-        
-        # Load the template - 创建副本避免修改原文件
-        temp_template = BASE_DIR / 'visa_booking_template_temp.xlsx'
-        try:
-            shutil.copy2(str(TEMPLATE_PATH), str(temp_template))
-            print(f"模板副本创建成功: {temp_template}")
-        except Exception as e:
-            print(f"复制模板失败: {e}")
+        with stage_seconds.time(stage='validation'):
+            error = validate_booking(data)
+        if error:
+            logger.info(f"请求数据无效: {error}")
+            generate_requests.inc(outcome='validation_error')
             return jsonify({
                 'success': False,
-                'message': f'无法复制模板文件: {str(e)}'
-            }), 500
+                'message': error
+            }), 400
         
-        # 尝试打开工作簿
-        try:
-            wb = load_workbook(str(temp_template))
-            ws = wb.active
-            print("工作簿加载成功")
-        except Exception as e:
-            print(f"加载工作簿失败: {e}")
-            return jsonify({
-                'success': False,
-                'message': f'无法打开Excel模板: {str(e)}'
-            }), 500
+        # 幂等：重试的请求直接返回之前生成的文档，不再分配新的确认号
+        inline = wants_inline(data)
+        idempotency_key = request_idempotency_key(data)
+        if idempotency_key:
+            with stage_seconds.time(stage='idempotency'):
+                replay = replay_idempotent_request(idempotency_key, payload_key(data), inline)
+            if replay is not None:
+                generate_requests.inc(outcome='replayed')
+                return replay
         
-        # 记录原始合并区域
-        original_merges = list(ws.merged_cells.ranges)
-        print(f"找到 {len(original_merges)} 个合并区域")
-        
-        # 只取消需要写入的合并区域
-        data_cells = ['J5', 'J19', 'D22', 'B7', 'H22', 'K22', 'J8', 'J17', 'J9', 'J10']
-        merges_to_remove = []
-        
-        for merge_range in original_merges:
-            should_remove = False
-            for cell_addr in data_cells:
-                cell = ws[cell_addr]
-                if merge_range.min_row <= cell.row <= merge_range.max_row and \
-                   merge_range.min_col <= cell.column <= merge_range.max_col:
-                    should_remove = True
-                    break
-            if should_remove:
-                merges_to_remove.append(merge_range)
-        
-        # 取消特定的合并区域
-        for merge_range in merges_to_remove:
-            ws.unmerge_cells(str(merge_range))
+        # 限流：在分配确认号和渲染之前检查；重放之前的结果不计入
+        if rate_limiter.enabled:
+            try:
+                with stage_seconds.time(stage='rate_limit'):
+                    rate_limiter.check({
+                        'ip': client_ip(),
+                        'email': data.get('email'),
+                        'company': data.get('company'),
+                    })
+            except RateLimited as e:
+                release_idempotency_key(idempotency_key)
+                generate_requests.inc(outcome='rate_limited')
+                return rate_limited_response(e)
         
-        print(f"取消了 {len(merges_to_remove)} 个合并区域")
+        # 异步模式：先占用队列位置，队列已满时不分配确认号；inline 需要同步生成
+        run_async = ASYNC_ENABLED and wants_async(data) and not inline
+        if run_async:
+            try:
+                job_queue.reserve()
+            except QueueFull as e:
+                logger.warning(f"任务队列已满: {job_queue.pending} 个任务排队中")
+                release_idempotency_key(idempotency_key)
+                response = jsonify({
+                    'success': False,
+                    'message': 'Too many documents are being generated, please retry later',
+                    'retry_after': e.retry_after
+                })
+                response.headers['Retry-After'] = str(e.retry_after)
+                generate_requests.inc(outcome='queue_full')
+                return response, 429
         
-        # 写入数据
         try:
-            # Guest Information
-            ws['J5'] = data['guestName']    # Guest Name in contact
-            ws['J19'] = data['guestName']   # Guest Name in reservation
-            ws['D22'] = data['guestName']   # Guest Name in table
-            
-            # Company Information
-            ws['B7'] = data['company']
-            
-            # Dates
-            ws['H22'] = arrival_date.strftime('%Y-%m-%d')    # Arrival Date
-            ws['K22'] = departure_date.strftime('%Y-%m-%d')  # Departure Date
-            ws['J8'] = datetime.now().strftime('%Y-%m-%d')   # Booking Date
-            
-            # Confirmation Number
-            ws['J17'] = confirmation_number
+            # Generate unique confirmation number
+            with stage_seconds.time(stage='confirmation_number'):
+                confirmation_number = generate_confirmation_number()
             
-            # Email and Remarks
-            ws['J9'] = data['email']
-            remark = data.get('remark', '')
-            if data.get('purpose') == 'VISA_APPLICATION_ONLY':
-                remark = "FOR VISA APPLICATION PURPOSES ONLY - NOT AN ACTUAL BOOKING. " + remark
-            ws['J10'] = remark
-            
-            # Room Information
-            ws['M22'] = data.get('roomType', 'Classic Queen')  # Room Type
-            ws['Q22'] = quantity  # Quantity
-            ws['T22'] = nights  # Nights
-            ws['V22'] = room_rate  # Room Rate
-            
-            print("数据写入成功")
-        except Exception as e:
-            print(f"写入数据失败: {e}")
-            return jsonify({
-                'success': False,
-                'message': f'无法写入数据到Excel: {str(e)}'
-            }), 500
+            with stage_seconds.time(stage='prepare'):
+                cell_values, document_info = prepare_booking(data, confirmation_number)
+            if run_async:
+                job_id = job_queue.submit(store_document, cell_values, document_info, 'async',
+                                          document_id=confirmation_number)
+                if idempotency_key:
+                    idempotency_store.complete(idempotency_key, confirmation_number, job_id)
+        except Exception:
+            if run_async:
+                job_queue.release()
+            raise
         
-        # 重新合并我们取消的区域
-        for merge_range in merges_to_remove:
-            try:
-                ws.merge_cells(str(merge_range))
-            except Exception as e:
-                print(f"重新合并失败 {merge_range}: {e}")
+        if run_async:
+            logger.info(f"已加入任务队列: {job_id} ({confirmation_number})",
+                        extra={'document_id': confirmation_number, 'job_id': job_id})
+            response = jsonify({
+                'success': True,
+                'message': 'Visa booking document queued for generation',
+                'job': {
+                    'id': job_id,
+                    'status': 'queued',
+                    'status_url': f'/jobs/{job_id}'
+                },
+                'document': document_response(document_info)
+            })
+            response.headers['Location'] = f'/jobs/{job_id}'
+            generate_requests.inc(outcome='queued')
+            return response, 202
         
-        # Add metadata
-        ws['AA1'] = f"Company: {data['company']}"
-        ws['AA2'] = f"Email: {data['email']}"
-        ws['AA3'] = f"Generated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
-        ws['AA4'] = f"Document ID: {confirmation_number}"
+        nights = document_info['nights']
+        total_amount = document_info['total_amount']
+        filename = document_info['filename']
         
-        # Generate filename
-        safe_company = "".join(c for c in data['company'] if c.isalnum() or c in (' ', '-', '_')).strip()
-        safe_company = safe_company.replace(' ', '_')[:30]
-        filename = f"Visa_Booking_{confirmation_number}_{safe_company}.xlsx"
-        filepath = GENERATED_FOLDER / filename
+        logger.debug(f"入住天数: {nights}, 总金额: {total_amount}")
         
-        # 确保生成目录存在
-        GENERATED_FOLDER.mkdir(exist_ok=True)
+        # Check if template exists
+        template_path = document_templates.get(document_info['template_id']).template_path
+        if not template_path.exists():
+            logger.warning("模板文件不存在，尝试创建...")
+            if template_path == TEMPLATE_PATH:
+                create_template_file()
+            if not template_path.exists():
+                release_idempotency_key(idempotency_key)
+                generate_requests.inc(outcome='error')
+                return jsonify({
+                    'success': False,
+                    'message': f'Template file not found at: {template_path}'
+                }), 404
         
-        # Save the workbook
+        # Save the workbook and store document information
         try:
-            wb.save(str(filepath))
-            print(f"文件保存成功: {filepath}")
-            print(f"文件大小: {os.path.getsize(filepath)} bytes")
+            content = render_and_store(cell_values, document_info)
+            logger.debug(f"文件保存成功: {filename} ({document_info['size']} bytes)")
         except Exception as e:
-            print(f"保存文件失败: {e}")
+            logger.exception(f"保存文件失败: {e}")
+            release_idempotency_key(idempotency_key)
+            generate_requests.inc(outcome='error')
             return jsonify({
                 'success': False,
                 'message': f'无法保存Excel文件: {str(e)}'
             }), 500
         
-        # Clean up temp file
-        try:
-            if temp_template.exists():
-                os.remove(str(temp_template))
-                print("临时文件已清理")
-        except Exception as e:
-            print(f"清理临时文件失败: {e}")
-        
-        # Store document information
-        document_info = {
-            'id': confirmation_number,
-            'filename': filename,
-            'company': data['company'],
-            'email': data['email'],
-            'guest_name': data['guestName'],
-            'arrival_date': data['arrivalDate'],
-            'departure_date': data['departureDate'],
-            'nights': nights,
-            'total_amount': total_amount,
-            'generated_date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
-            'filepath': str(filepath),
-            'purpose': 'VISA_APPLICATION_ONLY',
-            'download_url': f'/download/{confirmation_number}',
-            'print_url': f'/print/{confirmation_number}'
-        }
-        
-        documents_store.append(document_info)
+        if idempotency_key:
+            idempotency_store.complete(idempotency_key, confirmation_number)
         
-        # Print to console
-        print("\n" + "="*60)
-        print("✅ VISA BOOKING DOCUMENT GENERATED SUCCESSFULLY")
-        print("="*60)
-        print(f"Company: {data['company']}")
-        print(f"Email: {data['email']}")
-        print(f"Guest: {data['guestName']}")
-        print(f"Dates: {data['arrivalDate']} to {data['departureDate']}")
-        print(f"Nights: {nights}")
-        print(f"Total: {total_amount:,} CFA")
-        print(f"Document ID: {confirmation_number}")
-        print(f"File: {filename}")
-        print(f"Saved to: {filepath}")
-        print("="*60 + "\n")
+        logger.info(f"✅ Visa booking document generated: {confirmation_number}",
+                    extra={'document_id': confirmation_number, 'nights': nights,
+                           'total_amount': total_amount})
+        logger.debug(
+            f"Company: {data['company']}, Email: {data['email']}, "
+            f"Guest: {mask_name(data['guestName'])}, "
+            f"Dates: {data['arrivalDate']} to {data['departureDate']}, "
+            f"Total: {total_amount:,} CFA, File: {filename}"
+        )
         
-        return jsonify({
-            'success': True,
-            'message': 'Visa booking document generated successfully!',
-            'document': {
-                'id': confirmation_number,
-                'filename': filename,
-                'company': data['company'],
-                'email': data['email'],
-                'guest_name': data['guestName'],
-                'nights': nights,
-                'total_amount': total_amount,
-                'download_url': f'/download/{confirmation_number}',
-                'view_url': f'/documents/{confirmation_number}'
-            }
-        })
+        generate_requests.inc(outcome='success')
+        with stage_seconds.time(stage='response'):
+            if inline:
+                return inline_response(document_info, content)
+            return jsonify({
+                'success': True,
+                'message': 'Visa booking document generated successfully!',
+                'document': document_response(document_info)
+            })
         
     except Exception as e:
-        print(f"❌ Error generating document: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        release_idempotency_key(idempotency_key)
+        logger.exception(f"❌ Error generating document: {str(e)}")
+        generate_requests.inc(outcome='error')
         
         return jsonify({
             'success': False,
             'message': f'Error generating document: {str(e)}'
         }), 500
 
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """异步生成任务的状态；完成后包含 download_url"""
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify({
+            'success': False,
+            'message': 'Job not found'
+        }), 404
+    
+    info = {
+        'id': job['id'],
+        'status': job['status'],
+        'document_id': job['document_id'],
+        'created_at': job['created_at'],
+        'updated_at': job['updated_at']
+    }
+    if job['status'] == 'done':
+        info.update(job['result'])
+    elif job['status'] == 'failed':
+        info['error'] = job['error']
+    return jsonify({
+        'success': True,
+        'job': info
+    })
+
+def read_batch_request():
+    """批量请求的预订数据：JSON 数组，或上传到 UPLOAD_FOLDER 的 CSV/XLSX 文件"""
+    upload = request.files.get('file')
+    if upload is not None and upload.filename:
+        UPLOAD_FOLDER.mkdir(exist_ok=True)
+        upload_path = UPLOAD_FOLDER / f"batch_{datetime.now().strftime('%Y%m%d%H%M%S%f')}_{secure_filename(upload.filename)}"
+        upload.save(str(upload_path))
+        logger.debug(f"批量文件已上传: {upload_path}")
+        return read_upload_rows(upload_path)
+    
+    data = request.get_json(silent=True)
+    if isinstance(data, dict):
+        data = data.get('bookings')
+    if not isinstance(data, list):
+        raise ValueError('Expected a JSON array of bookings or an uploaded CSV/XLSX file')
+    return data
+
+def render_batch(prepared):
+    """渲染并保存一批文档，按顺序返回 (document_info, xlsx 字节)"""
+    if RENDERER_MODE == 'xml':
+        # 每个模板有自己的进程池：按模板分组渲染，再按原来的顺序返回
+        groups = {}
+        for index, (_, document_info) in enumerate(prepared):
+            groups.setdefault(document_info['template_id'], []).append(index)
+        rendered = [None] * len(prepared)
+        for template_id, indexes in groups.items():
+            pool = document_templates.get(template_id).render_pool
+            for index, content in zip(indexes, pool.render_many([prepared[i][0] for i in indexes])):
+                rendered[index] = content
+    else:
+        rendered = (render_document(document_templates.get(document_info['template_id']), cell_values)
+                    for cell_values, document_info in prepared)
+    for (_, document_info), content in zip(prepared, rendered):
+        document_storage.save(document_info, content)
+        document_info['size'] = len(content)
+        yield document_info, content
+
+@app.route('/generate-documents/batch', methods=['POST'])
+def generate_documents_batch():
+    """Generate one document per booking
+
+    Accepts a JSON array (or {"bookings": [...]}) or a CSV/XLSX upload in the
+    ``file`` form field whose header row uses the /generate-document field
+    names. Returns a streamed ZIP with every document plus results.json, or
+    just the per-row results with ``?format=json``. Every valid row counts
+    against the same rate limits as /generate-document (429 with Retry-After).
+    A batch larger than a limit's burst size can never pass and gets a 429
+    with ``max_batch_size`` instead.
+    """
+    try:
+        rows = read_batch_request()
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    if len(rows) > BATCH_MAX_ROWS:
+        return jsonify({
+            'success': False,
+            'message': f'Too many bookings: {len(rows)} (max {BATCH_MAX_ROWS})'
+        }), 413
+    
+    # 先校验所有行，再为有效的行一次性分配连续的确认号
+    results = []
+    valid = []
+    for index, row in enumerate(rows):
+        try:
+            booking = normalize_row(row)
+            error = validate_booking(booking)
+        except ValueError as e:
+            error = str(e)
+        if error:
+            results.append({'row': index, 'success': False, 'message': error})
+        else:
+            results.append(None)
+            valid.append((index, booking))
+    
+    # 限流：与 /generate-document 使用同一组桶，每个有效的行消耗一个令牌；
+    # 超过某个桶容量的批量等多久都不会通过，直接拒绝
+    if rate_limiter.enabled and valid:
+        costs = Counter({('ip', client_ip()): len(valid)})
+        for _, booking in valid:
+            costs['email', booking.get('email')] += 1
+            costs['company', booking.get('company')] += 1
+        try:
+            with stage_seconds.time(stage='rate_limit'):
+                rate_limiter.check_many(costs)
+        except RateLimited as e:
+            return rate_limited_response(e)
+    
+    numbers = allocate_confirmation_numbers(len(valid)) if valid else []
+    prepared = []
+    for (index, booking), confirmation_number in zip(valid, numbers):
+        cell_values, document_info = prepare_booking(booking, confirmation_number)
+        prepared.append((cell_values, document_info))
+        results[index] = {
+            'row': index,
+            'success': True,
+            'id': confirmation_number,
+            'filename': document_info['filename'],
+            'download_url': document_info['download_url']
+        }
+    
+    logger.info(f"批量生成: {len(rows)} 行, 有效 {len(valid)} 行")
+    summary = {
+        'success': True,
+        'total': len(rows),
+        'generated': len(valid),
+        'failed': len(rows) - len(valid),
+        'results': results
+    }
+    
+    def generated_documents():
+        # 分块渲染并登记，避免一次把所有文档都放进内存
+        for start in range(0, len(prepared), BATCH_CHUNK_SIZE):
+            chunk = prepared[start:start + BATCH_CHUNK_SIZE]
+            rendered = list(render_batch(chunk))
+            with stage_seconds.time(stage='registry_write'):
+                document_registry.add_many([document_info for document_info, _ in rendered])
+            documents_generated.inc(len(rendered), mode='batch')
+            document_events.notify()
+            for document_info, content in rendered:
+                yield document_info['filename'], content
+    
+    if request.args.get('format') == 'json':
+        for _ in generated_documents():
+            pass
+        return jsonify(summary)
+    
+    def entries():
+        yield from generated_documents()
+        yield 'results.json', json.dumps(summary, ensure_ascii=False, indent=2).encode('utf-8')
+    
+    response = Response(stream_with_context(stream_zip(entries())), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename=Visa_Bookings_{datetime.now().strftime('%Y%m%d%H%M%S')}.zip"
+    response.headers['X-Batch-Generated'] = str(summary['generated'])
+    response.headers['X-Batch-Failed'] = str(summary['failed'])
+    return response
+
+def document_summary(doc):
+    """/documents 列表中每个文档的字段"""
+    return {
+        'id': doc['id'],
+        'filename': doc['filename'],
+        'company': doc['company'],
+        'email': doc['email'],
+        'guest_name': doc['guest_name'],
+        'dates': f"{doc['arrival_date']} to {doc['departure_date']}",
+        'nights': doc['nights'],
+        'total_amount': doc['total_amount'],
+        'generated_date': doc['generated_date'],
+        'download_url': doc['download_url'],
+        'pdf_url': doc['pdf_url'],
+        'print_url': doc['print_url']
+    }
+
+LISTING_FIELDS = ['id', 'filename', 'company', 'email', 'guest_name', 'dates', 'nights',
+                  'total_amount', 'generated_date', 'download_url', 'pdf_url', 'print_url']
+
+# 分页时每页最多返回的文档数
+MAX_PAGE_SIZE = 1000
+
+def stream_documents(documents, fields, tail):
+    """逐个编码文档的 JSON 流，导出大量文档时不需要在内存中拼出整个响应
+
+    ``tail`` 为写在文档列表之后的其它字段（next_since 等）。
+    """
+    yield '{"success": true, "documents": ['
+    count = 0
+    for doc in documents:
+        summary = document_summary(doc)
+        if fields:
+            summary = {field: summary[field] for field in fields}
+        yield (',' if count else '') + json.dumps(summary)
+        count += 1
+    yield f'], "count": {count}, ' + json.dumps(tail)[1:]
+
 @app.route('/documents', methods=['GET'])
 def list_documents():
-    """View all generated documents"""
-    print(f"请求文档列表，当前有 {len(documents_store)} 个文档")
+    """View generated documents
+
+    Query parameters (all optional):
+      company, email      exact match
+      guest               guest name prefix
+      from, to            generated date range (YYYY-MM-DD)
+      since               only documents added after this ``next_since`` value
+      removed_after       also list the ids of documents removed after this ``next_event``
+                          value in ``removed``; ``resync`` is true when that is no longer
+                          known and the client should load the whole list again
+      sort                column to sort by, prefix with '-' for descending
+      fields              comma separated list of fields to return
+      limit, cursor       page size and the ``next_cursor`` of the previous page
+
+    Without ``limit`` every matching document is streamed.
+    """
+    args = request.args
+    try:
+        sort = args.get('sort', 'seq')
+        descending = sort.startswith('-')
+        sort = sort.lstrip('-')
+        fields = [f for f in args.get('fields', '').split(',') if f]
+        unknown = [f for f in fields if f not in LISTING_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown field: {', '.join(unknown)}")
+        limit = args.get('limit', type=int)
+        if limit is not None and not 1 <= limit <= MAX_PAGE_SIZE:
+            raise ValueError(f'limit must be between 1 and {MAX_PAGE_SIZE}')
+        since = args.get('since', type=int)
+        removed_after = args.get('removed_after', type=int)
+        after = decode_cursor(args['cursor']) if args.get('cursor') else None
+        query = dict(
+            company=args.get('company'),
+            email=args.get('email'),
+            guest_prefix=args.get('guest'),
+            date_from=args.get('from'),
+            date_to=args.get('to'),
+            since=since,
+            sort=sort,
+            descending=descending,
+            after=after,
+        )
+        # 查询之前记下最新的 seq 和事件 id，客户端下次用 since= / removed_after=
+        # 只取之后新增和删除的文档
+        next_since = document_registry.max_seq()
+        next_event = document_registry.event_range()[1]
+        # 版本号只在增删文档时变化，没有变化时直接返回 304
+        etag = f'"{document_registry.version()}-{hashlib.md5(request.query_string).hexdigest()[:12]}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers={'ETag': etag})
+        
+        tail = {'next_since': next_since, 'next_event': next_event}
+        if removed_after is not None:
+            removed = document_registry.removed_after(removed_after)
+            tail['removed'] = removed or []
+            tail['resync'] = removed is None
+        
+        if limit is None:
+            documents = document_registry.query(**query)
+            response = Response(
+                stream_with_context(stream_documents(documents, fields, tail)),
+                mimetype='application/json'
+            )
+            response.headers['ETag'] = etag
+            return response
+        
+        page = list(document_registry.query(limit=limit + 1, **query))
+        has_more = len(page) > limit
+        page = page[:limit]
+        summaries = [document_summary(doc) for doc in page]
+        if fields:
+            summaries = [{field: summary[field] for field in fields} for summary in summaries]
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    response = jsonify({
+        'success': True,
+        'count': len(summaries),
+        'documents': summaries,
+        'next_cursor': encode_cursor(page[-1][sort], page[-1]['seq']) if has_more else None,
+        **tail
+    })
+    response.headers['ETag'] = etag
+    return response
+
+@app.route('/documents/search', methods=['GET'])
+def search_documents():
+    """Find documents by confirmation number, guest name, company, email or remark
+
+    Query parameters:
+      q        words to look for; every word must match, as a prefix or with one typo
+      limit    number of results (default 20, at most 100)
+
+    Results are in the /documents format plus ``score`` (higher is better) and
+    ``match`` ('exact', 'prefix' or 'fuzzy'); whole-word matches come first,
+    then prefix matches, then matches with a typo.
+    """
+    query = request.args.get('q', '').strip()
+    limit = request.args.get('limit', SEARCH_DEFAULT_LIMIT, type=int)
+    if not query:
+        return jsonify({
+            'success': False,
+            'message': 'Missing search query (q)'
+        }), 400
+    if not 1 <= limit <= SEARCH_MAX_LIMIT:
+        return jsonify({
+            'success': False,
+            'message': f'limit must be between 1 and {SEARCH_MAX_LIMIT}'
+        }), 400
+    
+    with stage_seconds.time(stage='search'):
+        results = document_search.search(query, limit)
+    documents = [{**document_summary(doc), 'score': doc['score'], 'match': doc['match']} for doc in results]
     return jsonify({
         'success': True,
-        'count': len(documents_store),
-        'documents': [
-            {
-                'id': doc['id'],
-                'filename': doc['filename'],
-                'company': doc['company'],
-                'email': doc['email'],
-                'guest_name': doc['guest_name'],
-                'dates': f"{doc['arrival_date']} to {doc['departure_date']}",
-                'nights': doc['nights'],
-                'total_amount': doc['total_amount'],
-                'generated_date': doc['generated_date'],
-                'download_url': doc['download_url'],
-                'print_url': doc['print_url']
-            }
-            for doc in documents_store
-        ]
+        'query': query,
+        'count': len(documents),
+        'documents': documents
+    })
+
+def encode_document_event(event):
+    """SSE frame for a registry document event, None for documents already removed again"""
+    if event['kind'] == 'removed':
+        return sse_frame('document_removed', {'id': event['document_id']}, event['event_id'])
+    if event['document'] is None:
+        return None
+    return sse_frame('document_added', document_summary(event['document']), event['event_id'])
+
+def open_document_stream(last_event_id=None, since=None, loop=None):
+    """Subscribe to document events for one /documents/stream connection
+
+    重连时浏览器带上 Last-Event-ID，从那之后的事件继续；第一次连接时
+    since（/documents 返回的 next_since）之后新增的文档先作为 document_added
+    发送，加载列表和打开事件流之间生成的文档不会漏掉。文档太多时发送 reset。
+    """
+    initial = []
+    if last_event_id is None:
+        last_event_id = document_events.position()
+        if since is not None:
+            documents = list(document_registry.query(since=since, limit=document_events.max_queue + 1))
+            if len(documents) > document_events.max_queue:
+                initial = [RESET_FRAME]
+            else:
+                initial = [sse_frame('document_added', document_summary(doc)) for doc in documents]
+    return document_events.subscribe(last_event_id, initial, loop=loop)
+
+def stream_request_position(last_event_id, since):
+    """(last_event_id, since) of a /documents/stream request as integers"""
+    last_event_id = last_event_id.strip() if last_event_id else ''
+    since = since.strip() if since else ''
+    return (int(last_event_id) if last_event_id.isdigit() else None,
+            int(since) if since.isdigit() else None)
+
+def stream_unavailable(message):
+    """503 for a /documents/stream request; the admin page falls back to polling"""
+    response = jsonify({
+        'success': False,
+        'message': message
     })
+    response.status_code = 503
+    response.headers['Retry-After'] = '30'
+    return response
+
+@app.route('/documents/stream', methods=['GET'])
+def stream_document_events():
+    """Server-sent events for documents as they are generated and cleaned up
+
+    Events:
+      document_added    the document in the same format as /documents
+      document_removed  {"id": ...}
+      reset             too many changes to replay, reload the list
+
+    Query parameters (optional):
+      since             the ``next_since`` of the /documents response the page was loaded from
+
+    ASGI 模式（asgi.py）下请求同样经过这里的钩子，响应体为 AsyncEventStream，
+    由事件循环发送，不占用线程，每个进程最多 SSE_MAX_STREAMS 个流。WSGI 下每个流
+    占用一个线程：sync worker 返回 503（页面改为 /documents?since= 轮询），
+    线程池服务器最多 SSE_THREAD_STREAMS 个流，每个流 SSE_STREAM_SECONDS 秒后
+    结束，浏览器自动重连。
+    """
+    loop = request.environ.get(EVENT_LOOP_ENVIRON) if request.method == 'GET' else None
+    if loop is None and not request.environ.get('wsgi.multithread'):
+        return stream_unavailable('Live updates are not available on this server, poll /documents?since=')
+    max_streams = SSE_MAX_STREAMS if loop is not None else min(SSE_MAX_STREAMS, SSE_THREAD_STREAMS)
+    if document_events.subscriber_count >= max_streams:
+        return stream_unavailable('Too many open streams')
+    last_event_id, since = stream_request_position(
+        request.headers.get('Last-Event-ID'), request.args.get('since'))
+    subscription = open_document_stream(last_event_id, since, loop=loop)
+    
+    def generate():
+        try:
+            yield b'retry: 5000\n\n'
+            deadline = time.monotonic() + SSE_STREAM_SECONDS
+            while not subscription.closed and time.monotonic() < deadline:
+                frames = subscription.get(SSE_KEEPALIVE_SECONDS)
+                yield b''.join(frames) if frames else KEEPALIVE_FRAME
+        finally:
+            subscription.close()
+    
+    if loop is not None:
+        response = Response(AsyncEventStream(subscription, SSE_KEEPALIVE_SECONDS, b'retry: 5000\n\n'),
+                            mimetype='text/event-stream', direct_passthrough=True)
+    else:
+        response = Response(generate(), mimetype='text/event-stream')
+    response.headers['Cache-Control'] = 'no-cache'
+    response.headers['X-Accel-Buffering'] = 'no'
+    return response
 
 @app.route('/documents/<document_id>', methods=['GET'])
 def get_document(document_id):
     """Get specific document information"""
-    print(f"查找文档: {document_id}")
-    for doc in documents_store:
-        if doc['id'] == document_id:
-            return jsonify({
-                'success': True,
-                'document': doc
-            })
+    logger.debug(f"查找文档: {document_id}")
+    doc = document_registry.get(document_id)
+    if doc is not None:
+        return jsonify({
+            'success': True,
+            'document': doc
+        })
     
     return jsonify({
         'success': False,
@@ -393,91 +1350,256 @@ def get_document(document_id):
 
 @app.route('/download/<document_id>', methods=['GET'])
 def download_document(document_id):
-    """Download the Excel file"""
-    print(f"下载文档请求: {document_id}")
-    for doc in documents_store:
-        if doc['id'] == document_id:
-            filepath = Path(doc['filepath'])
-            print(f"查找文件: {filepath}")
-            if filepath.exists():
-                print(f"文件存在，准备下载: {filepath}")
-                return send_file(
-                    str(filepath),
-                    as_attachment=True,
-                    download_name=doc['filename'],
-                    mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
-                )
-            else:
-                print(f"文件不存在: {filepath}")
+    """Download the Excel file
+
+    磁盘存储直接发送文件；其它存储从内存或压缩包读取，文档不在存储中
+    （被淘汰或文件丢失）时按预订记录重新生成。
+    """
+    logger.debug(f"下载文档请求: {document_id}")
+    doc = document_registry.get(document_id)
+    if doc is not None:
+        source = document_storage.local_path(doc) or document_content(doc)
+        if source is not None:
+            return send_document(doc, source, doc['filename'], XLSX_MIMETYPE)
+        logger.warning(f"文件不存在: {doc['filename']}")
     
     return jsonify({
         'success': False,
         'message': 'File not found'
     }), 404
 
+@app.route('/download/<document_id>.pdf', methods=['GET'])
+def download_document_pdf(document_id):
+    """Download the booking as a PDF rendered from the stored Excel file's cell data"""
+    doc = document_registry.get(document_id)
+    # 渲染好的 PDF 和 xlsx 存在同一个存储中
+    source = None
+    if doc is not None:
+        source = document_storage.local_path(doc, '.pdf') or document_storage.load(doc, '.pdf')
+    if source is not None:
+        pdf_requests.inc(cache='hit')
+    elif doc is not None:
+        content = document_content(doc)
+        try:
+            template = document_template(doc)
+        except KeyError:
+            content = None
+        if content is not None:
+            with stage_seconds.time(stage='pdf_render'):
+                values = read_cell_values(io.BytesIO(content), template.pdf_renderer.cells)
+                title = f"Reservation Confirmation {doc['id']}"
+                if render_offload is not None:
+                    source = render_offload.render_pdf(template, values, title=title)
+                else:
+                    source = template.pdf_renderer.render_bytes(values, title=title)
+            if save_rebuilt(doc, source, '.pdf'):
+                pdf_requests.inc(cache='miss')
+            else:
+                source = None
+    if source is None:
+        return jsonify({
+            'success': False,
+            'message': 'File not found'
+        }), 404
+    return send_document(doc, source, str(Path(doc['filename']).with_suffix('.pdf')), 'application/pdf')
+
 @app.route('/print/<document_id>', methods=['GET'])
 def print_document(document_id):
     """打印文档信息到控制台"""
-    print(f"打印文档请求: {document_id}")
-    for doc in documents_store:
-        if doc['id'] == document_id:
-            print("\n" + "="*60)
-            print("DOCUMENT PRINT REQUEST")
-            print("="*60)
-            print(f"Company: {doc['company']}")
-            print(f"Email: {doc['email']}")
-            print(f"Guest: {doc['guest_name']}")
-            print(f"Dates: {doc['arrival_date']} to {doc['departure_date']}")
-            print(f"Nights: {doc['nights']}")
-            print(f"Total: {doc['total_amount']:,} CFA")
-            print(f"Document ID: {doc['id']}")
-            print(f"Generated: {doc['generated_date']}")
-            print(f"File: {doc['filename']}")
-            print(f"Path: {doc['filepath']}")
-            print("="*60 + "\n")
-            
-            return jsonify({
-                'success': True,
-                'message': 'Document information printed to console',
-                'document': {
-                    'id': doc['id'],
-                    'company': doc['company'],
-                    'email': doc['email'],
-                    'guest_name': doc['guest_name'],
-                    'dates': f"{doc['arrival_date']} to {doc['departure_date']}",
-                    'nights': doc['nights'],
-                    'total_amount': doc['total_amount'],
-                    'filename': doc['filename']
-                }
-            })
+    logger.debug(f"打印文档请求: {document_id}")
+    doc = document_registry.get(document_id)
+    if doc is not None:
+        logger.info(f"DOCUMENT PRINT REQUEST: {doc['id']}", extra={'document': redact(doc)})
+        
+        return jsonify({
+            'success': True,
+            'message': 'Document information printed to console',
+            'document': {
+                'id': doc['id'],
+                'company': doc['company'],
+                'email': doc['email'],
+                'guest_name': doc['guest_name'],
+                'dates': f"{doc['arrival_date']} to {doc['departure_date']}",
+                'nights': doc['nights'],
+                'total_amount': doc['total_amount'],
+                'filename': doc['filename'],
+                'pdf_url': doc['pdf_url']
+            }
+        })
     
     return jsonify({
         'success': False,
         'message': 'Document not found'
     }), 404
 
+# 每种报表导出的列
+REPORT_COLUMNS = {
+    'summary': ['from', 'to', 'company', 'documents', 'nights', 'total_amount', 'companies'],
+    'daily': ['period', 'documents', 'nights', 'total_amount'],
+    'companies': ['company', 'documents', 'nights', 'total_amount'],
+    'guests': ['guest_name', 'email', 'documents', 'nights', 'total_amount'],
+    'arrivals': ['period', 'documents', 'nights', 'total_amount'],
+    'bookings': ['id', 'company', 'email', 'guest_name', 'arrival_date', 'departure_date', 'nights',
+                 'total_amount', 'generated_date', 'purpose'],
+}
+
+def report_rows(report, args):
+    """Rows of ``report`` for the request's query parameters; raises ValueError for bad parameters"""
+    date_from = parse_date(args.get('from'), 'from')
+    date_to = parse_date(args.get('to'), 'to')
+    company = args.get('company') or None
+    bucket = args.get('bucket', 'day')
+    sort = args.get('sort', 'total_amount')
+    limit = args.get('limit', REPORT_DEFAULT_LIMIT, type=int)
+    if not 1 <= limit <= REPORT_MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {REPORT_MAX_LIMIT}')
+    if report == 'summary':
+        return [booking_reports.summary(date_from, date_to, company)]
+    if report == 'daily':
+        return booking_reports.by_period(bucket, date_from, date_to, company)
+    if report == 'companies':
+        return booking_reports.companies(date_from, date_to, sort, limit)
+    if report == 'guests':
+        if date_from or date_to or company:
+            raise ValueError('The guests report covers all documents and takes no from, to or company')
+        return booking_reports.guests(sort, limit)
+    if report == 'arrivals':
+        if company:
+            raise ValueError('The arrivals report takes no company filter')
+        return booking_reports.arrivals(bucket, date_from, date_to)
+    # bookings: 逐个文档导出，走文档表的 generated_date / company 索引
+    documents = document_registry.query(
+        company=company,
+        date_from=date_from.isoformat() if date_from else None,
+        date_to=date_to.isoformat() if date_to else None)
+    return ({column: doc[column] for column in REPORT_COLUMNS['bookings']} for doc in documents)
+
+@app.route('/reports', methods=['GET'])
+@app.route('/reports/<report>', methods=['GET'])
+def booking_report(report='summary'):
+    """Booking aggregates for finance
+
+    Reports:
+      summary     documents, nights, total_amount and number of companies
+      daily       totals per generated day (bucket=month for months)
+      companies   totals per company, largest first (sort, limit)
+      guests      top guests by total_amount or documents (sort, limit)
+      arrivals    histogram of arrival dates (bucket=day|month, from/to filter the arrival date)
+      bookings    one row per document still in the registry, export only
+
+    The aggregates include documents removed by the retention sweep.
+
+    Query parameters (all optional):
+      from, to    generated date range (YYYY-MM-DD)
+      company     exact match (summary, daily, bookings)
+      format      json (default), csv or xlsx; csv and xlsx are streamed as attachments
+    """
+    if report not in REPORT_COLUMNS:
+        return jsonify({
+            'success': False,
+            'message': f"Unknown report: {report} (available: {', '.join(REPORT_COLUMNS)})"
+        }), 404
+    export = request.args.get('format', 'json')
+    try:
+        if export not in ('json', 'csv', 'xlsx'):
+            raise ValueError(f'Unknown format: {export} (use json, csv or xlsx)')
+        if report == 'bookings' and export == 'json':
+            raise ValueError('The bookings report is export only (format=csv or xlsx), use /documents for JSON')
+        # 汇总表和文档表一起变化，登记表版本号没变时直接返回 304
+        etag = f'"{document_registry.version()}-{hashlib.md5(request.full_path.encode()).hexdigest()[:12]}"'
+        if etag in request.headers.get('If-None-Match', ''):
+            return Response(status=304, headers={'ETag': etag})
+        rows = report_rows(report, request.args)
+        
+        if export == 'json':
+            rows = list(rows)
+            body = {'success': True, 'report': report}
+            if report == 'summary':
+                body['summary'] = rows[0]
+            else:
+                body['count'] = len(rows)
+                body['rows'] = rows
+            response = jsonify(body)
+            response.headers['ETag'] = etag
+            return response
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 400
+    
+    columns = REPORT_COLUMNS[report]
+    values = ([row[column] for column in columns] for row in rows)
+    if export == 'csv':
+        chunks, mimetype = stream_csv(columns, values), 'text/csv'
+    else:
+        chunks, mimetype = stream_xlsx(columns, values, sheet_name=report), XLSX_MIMETYPE
+    response = Response(stream_with_context(chunks), mimetype=mimetype)
+    response.headers['Content-Disposition'] = (
+        f"attachment; filename=Visa_Report_{report}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{export}")
+    response.headers['ETag'] = etag
+    return response
+
 @app.route('/cleanup', methods=['POST'])
 def cleanup_documents():
-    """手动清理超过48小时的文档"""
+    """手动清理超过保留期限（默认48小时）的文档
+
+    JSON body or query parameters (all optional):
+      dry_run      report what would be deleted without deleting it
+      ttl_hours    override RETENTION_HOURS for this run
+      max_batches  stop after this many batches of RETENTION_BATCH_SIZE documents
+    """
+    try:
+        options = request.get_json(silent=True) or {}
+        options = {**request.args.to_dict(), **options}
+        dry_run = str(options.get('dry_run', '')).lower() in ('1', 'true', 'yes')
+        ttl_hours = float(options['ttl_hours']) if options.get('ttl_hours') not in (None, '') else None
+        max_batches = int(options['max_batches']) if options.get('max_batches') not in (None, '') else None
+    except (TypeError, ValueError) as e:
+        return jsonify({
+            'success': False,
+            'message': f'Invalid cleanup options: {str(e)}'
+        }), 400
+    
     try:
-        print("执行文档清理...")
-        # 这里可以添加实际的清理逻辑
+        logger.debug("执行文档清理...")
+        stats = retention_sweeper.sweep(dry_run=dry_run, ttl_hours=ttl_hours, max_batches=max_batches)
+        document_events.notify()
+        logger.info("清理完成", extra={'stats': stats})
         return jsonify({
             'success': True,
-            'message': 'Cleanup completed successfully',
-            'remaining_documents': len(documents_store)
+            'message': 'Cleanup dry run completed' if dry_run else 'Cleanup completed successfully',
+            'remaining_documents': document_registry.count(),
+            'stats': stats
         })
     except Exception as e:
-        print(f"清理失败: {e}")
+        logger.exception(f"清理失败: {e}")
         return jsonify({
             'success': False,
             'message': f'Cleanup failed: {str(e)}'
         }), 500
 
+@app.route('/metrics', methods=['GET'])
+def prometheus_metrics():
+    """本进程的耗时直方图和计数器，Prometheus 文本格式"""
+    return Response(metrics.render(), content_type=MetricsRegistry.CONTENT_TYPE)
+
+@app.route('/cleanup/metrics', methods=['GET'])
+def cleanup_metrics():
+    """本进程累计的清理统计"""
+    return jsonify({
+        'success': True,
+        'ttl_hours': retention_sweeper.ttl_hours,
+        'scheduler_interval_minutes': RETENTION_INTERVAL_MINUTES,
+        'metrics': retention_sweeper.metrics
+    })
+
 def create_template_file():
     """Create a basic template if not exists"""
-    print("Creating template file...")
+    logger.info("Creating template file...")
     try:
+        from openpyxl import load_workbook
+
         wb = load_workbook()
         ws = wb.active
         ws.title = "ipms_master_bill"
@@ -492,33 +1614,38 @@ def create_template_file():
         
         # Save template
         wb.save(str(TEMPLATE_PATH))
-        print(f"✅ Template created: {TEMPLATE_PATH}")
+        logger.info(f"✅ Template created: {TEMPLATE_PATH}")
         return True
     except Exception as e:
-        print(f"❌ Failed to create template: {e}")
+        logger.error(f"❌ Failed to create template: {e}")
         return False
 
 @app.route('/check-template', methods=['GET'])
 def check_template():
-    """Check if template exists and its structure"""
-    if TEMPLATE_PATH.exists():
+    """Check if template exists and its structure (?templateId=, default template otherwise)"""
+    try:
+        template = document_templates.get(request.args.get('templateId'))
+    except KeyError:
+        return jsonify({
+            'success': False,
+            'message': f"Unknown templateId: {request.args.get('templateId')}"
+        }), 404
+    if template.template_path.exists():
         try:
-            wb = load_workbook(str(TEMPLATE_PATH))
-            ws = wb.active
-            sheet_name = ws.title
-            
-            # Check some key cells
-            key_cells = {
-                'C3': ws['C3'].value,
-                'B5': ws['B5'].value,
-                'sheet_name': sheet_name
-            }
+            # 元数据在模板文件变化时才重新读取
+            metadata = template.metadata.get()
+            key_cells = dict(metadata['key_cells'], sheet_name=metadata['sheet_name'])
             
             return jsonify({
                 'success': True,
                 'message': 'Template found and loaded successfully',
-                'sheet_name': sheet_name,
-                'key_cells': key_cells
+                'template_id': template.id,
+                'sheet_name': metadata['sheet_name'],
+                'key_cells': key_cells,
+                'merged_ranges': metadata['merged_ranges'],
+                'checksum': metadata['checksum'],
+                'size': metadata['size'],
+                'modified': metadata['modified']
             })
         except Exception as e:
             return jsonify({
@@ -528,44 +1655,81 @@ def check_template():
     else:
         return jsonify({
             'success': False,
-            'message': f'Template file not found at: {TEMPLATE_PATH}'
+            'message': f'Template file not found at: {template.template_path}'
         }), 404
 
+@app.route('/templates', methods=['GET'])
+def list_templates():
+    """可用的文档模板（templateId）及房价；映射文件有误的模板列在 errors 中"""
+    return jsonify({
+        'success': True,
+        'default': document_templates.default_id,
+        'templates': [template.describe() for template in document_templates],
+        'errors': document_templates.errors
+    })
+
 @app.route('/debug', methods=['GET'])
 def debug_info():
-    """调试信息页面"""
+    """调试信息页面
+
+    文档数量和大小来自登记表中随增删维护的统计，不扫描生成文件夹。
+    """
+    stats = document_registry.stats()
     info = {
         'python_version': sys.version,
         'current_directory': os.getcwd(),
         'base_dir': str(BASE_DIR),
+        'renderer_mode': RENDERER_MODE,
         'template_exists': TEMPLATE_PATH.exists(),
+        'templates': [template.id for template in document_templates],
         'generated_folder_exists': GENERATED_FOLDER.exists(),
         'generated_folder': str(GENERATED_FOLDER),
-        'generated_files': list(GENERATED_FOLDER.glob('*.xlsx')) if GENERATED_FOLDER.exists() else [],
-        'documents_count': len(documents_store),
+        'storage': document_storage.stats(),
+        'documents_count': stats['count'],
+        'documents_bytes': stats['bytes'],
+        'oldest_document': stats['oldest'],
+        'newest_document': stats['newest'],
+        'registry_version': document_registry.version(),
+        'pending_jobs': job_queue.pending,
+        'rate_limits': {scope: f'{capacity}/{period:g}' for scope, (capacity, period) in rate_limiter.quotas.items()},
         'uploads_folder_exists': UPLOAD_FOLDER.exists(),
     }
     return jsonify(info)
 
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """给负载均衡器的健康检查：只检查模板文件和数据库是否可用"""
+    checks = {}
+    try:
+        checks['template'] = document_templates.default.template_path.stat().st_size > 0
+    except (KeyError, OSError):
+        checks['template'] = False
+    try:
+        document_registry.version()
+        checks['database'] = True
+    except Exception:
+        checks['database'] = False
+    healthy = all(checks.values())
+    return jsonify({
+        'status': 'ok' if healthy else 'unavailable',
+        'checks': checks
+    }), 200 if healthy else 503
+
 if __name__ == '__main__':
-    print("="*60)
-    print("Starting Visa Booking Document Generator")
-    print("="*60)
-    
-    # 检查目录和文件
-    create_directories()
+    create_app()
+    start_background_tasks()
+    logger.info("Starting Visa Booking Document Generator")
     
     # Check template
     if not TEMPLATE_PATH.exists():
-        print("Template not found, creating basic template...")
+        logger.warning("Template not found, creating basic template...")
         create_template_file()
     else:
-        print(f"✅ Template found: {TEMPLATE_PATH}")
+        logger.info(f"✅ Template found: {TEMPLATE_PATH}")
     
-    print(f"📁 Generated folder: {GENERATED_FOLDER}")
-    print(f"📁 Uploads folder: {UPLOAD_FOLDER}")
-    print(f"📋 Documents in memory: {len(documents_store)}")
-    print("\n🚀 Application ready!")
-    print("="*60)
+    logger.info(f"📁 Generated folder: {GENERATED_FOLDER}")
+    logger.info(f"📁 Uploads folder: {UPLOAD_FOLDER}")
+    logger.info(f"📋 Documents registered: {document_registry.count()}")
+    logger.info("🚀 Application ready!")
     
     app.run(debug=True)
@@ -0,0 +1,184 @@
+"""ASGI 入口 - 一个进程同时保持大量连接，渲染在进程池中进行
+
+    uvicorn asgi:app --host 0.0.0.0 --port $PORT
+
+gunicorn 的 sync worker 一个请求占用整个进程，慢客户端下载文件、管理页面
+轮询都会占住 worker。这里用事件循环接收连接，路由仍然是 app.py 中的 Flask
+应用：
+
+- 请求体在事件循环中读完后，Flask 视图在有上限（ASGI_THREADS）的线程池中
+  执行，空闲的 keep-alive 连接和等待写出的连接不占用线程
+- 响应体在执行视图的同一个线程中迭代（流式导出使用的 SQLite 游标不能跨
+  线程），每一块交给事件循环写出；客户端读得慢时按事件循环的流量控制等待
+- 管理页面的事件流 /documents/stream 与其它请求一样经过 Flask（CORS、
+  X-Request-ID、访问日志、指标），视图返回的 AsyncEventStream 响应体在
+  事件循环中发送（见 events.py），每个连接只是一个协程，不占用线程
+- xml / PDF 渲染交给 RENDER_PROCESSES 个子进程（默认 CPU 数，见
+  render_offload.py），渲染不持有这个进程的 GIL
+
+每个请求在复制的 contextvars 上下文中执行，日志的 request_id 与 WSGI 下相同。
+"""
+import asyncio
+import contextvars
+import io
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault('RENDER_PROCESSES', str(os.cpu_count() or 1))
+
+import app as visa_app  # noqa: E402  RENDER_PROCESSES 必须在导入前设置
+from events import AsyncEventStream  # noqa: E402
+
+# 执行 Flask 视图和读取响应体的线程数
+ASGI_THREADS = int(os.environ.get('ASGI_THREADS', '32'))
+
+
+class WsgiBridge:
+    """Serve a WSGI application over ASGI without blocking the event loop"""
+
+    def __init__(self, wsgi_app, max_threads):
+        self.wsgi_app = wsgi_app
+        self.executor = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='asgi')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] == 'lifespan':
+            await self._lifespan(receive, send)
+        elif scope['type'] == 'http':
+            await self._http(scope, receive, send)
+        else:
+            # 没有 websocket 路由
+            await send({'type': 'websocket.close', 'code': 1000})
+
+    async def _lifespan(self, receive, send):
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                visa_app.start_background_tasks()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                loop = asyncio.get_running_loop()
+                if visa_app.render_offload is not None:
+                    await loop.run_in_executor(None, visa_app.render_offload.shutdown)
+                self.executor.shutdown(wait=False)
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    @staticmethod
+    async def _read_body(receive):
+        chunks = []
+        while True:
+            message = await receive()
+            if message['type'] == 'http.disconnect':
+                return None
+            chunks.append(message.get('body', b''))
+            if not message.get('more_body'):
+                return b''.join(chunks)
+
+    @staticmethod
+    def _environ(scope, body):
+        server = scope.get('server') or ('localhost', 80)
+        client = scope.get('client') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': scope['method'],
+            'SCRIPT_NAME': scope.get('root_path', '').encode('utf-8').decode('latin-1'),
+            'PATH_INFO': scope['path'].encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': scope['query_string'].decode('latin-1'),
+            'SERVER_NAME': server[0],
+            'SERVER_PORT': str(server[1]),
+            'SERVER_PROTOCOL': f"HTTP/{scope['http_version']}",
+            'REMOTE_ADDR': client[0],
+            'REMOTE_PORT': str(client[1]),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': scope.get('scheme', 'http'),
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': True,
+            'wsgi.run_once': False,
+        }
+        for name, value in scope['headers']:
+            name = name.decode('latin-1').upper().replace('-', '_')
+            value = value.decode('latin-1')
+            if name == 'CONTENT_TYPE':
+                environ['CONTENT_TYPE'] = value
+            elif name != 'CONTENT_LENGTH':
+                key = f'HTTP_{name}'
+                if key in environ:
+                    # 重复的请求头用逗号合并，Cookie 的分隔符是分号
+                    separator = '; ' if key == 'HTTP_COOKIE' else ','
+                    value = f'{environ[key]}{separator}{value}'
+                environ[key] = value
+        return environ
+
+    @staticmethod
+    async def _send_stream(receive, send, status, headers, body):
+        """Send an AsyncEventStream body from the event loop until it ends or the client leaves"""
+        # 请求体已经读完，下一个消息只会是 http.disconnect
+        disconnected = asyncio.ensure_future(receive())
+        try:
+            await send({'type': 'http.response.start', 'status': status, 'headers': headers})
+            while True:
+                chunk = asyncio.ensure_future(body.next_chunk())
+                await asyncio.wait({chunk, disconnected}, return_when=asyncio.FIRST_COMPLETED)
+                if disconnected.done():
+                    chunk.cancel()
+                    return
+                if chunk.result() is None:
+                    break
+                await send({'type': 'http.response.body', 'body': chunk.result(), 'more_body': True})
+            await send({'type': 'http.response.body', 'body': b''})
+        finally:
+            disconnected.cancel()
+            body.close()
+
+    async def _http(self, scope, receive, send):
+        body = await self._read_body(receive)
+        if body is None:
+            return
+        loop = asyncio.get_running_loop()
+        environ = self._environ(scope, body)
+        environ[visa_app.EVENT_LOOP_ENVIRON] = loop
+
+        def send_now(message):
+            asyncio.run_coroutine_threadsafe(send(message), loop).result()
+
+        def respond():
+            started = {}
+
+            def start_response(status, headers, exc_info=None):
+                started['status'] = int(status.split(' ', 1)[0])
+                started['headers'] = [(name.lower().encode('latin-1'), value.encode('latin-1'))
+                                      for name, value in headers]
+                return write
+
+            def write(chunk):
+                if 'sent' not in started:
+                    started['sent'] = True
+                    send_now({'type': 'http.response.start', 'status': started['status'],
+                              'headers': started['headers']})
+                if chunk:
+                    send_now({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+            iterable = self.wsgi_app(environ, start_response)
+            if isinstance(iterable, AsyncEventStream):
+                # 钩子已经执行完，响应体交给事件循环发送
+                return started, iterable
+            try:
+                # start_response 可能在第一次迭代时才调用（生成器视图）
+                for chunk in iterable:
+                    write(chunk)
+                write(b'')
+                send_now({'type': 'http.response.body', 'body': b''})
+            finally:
+                if hasattr(iterable, 'close'):
+                    iterable.close()
+
+        stream = await loop.run_in_executor(self.executor, contextvars.copy_context().run, respond)
+        if stream is not None:
+            started, stream_body = stream
+            await self._send_stream(receive, send, started['status'], started['headers'], stream_body)
+
+
+app = WsgiBridge(visa_app.create_app(), ASGI_THREADS)
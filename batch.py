@@ -0,0 +1,211 @@
+"""批量生成 - 解析批量预订数据并把生成的文档流式打包成 ZIP，以及流式写出 xlsx 表格"""
+import csv
+import io
+import itertools
+import re
+import zipfile
+from datetime import date, datetime
+
+
+# 批量数据中可以出现的字段，与 /generate-document 的 JSON 字段一致
+BOOKING_FIELDS = ['guestName', 'email', 'company', 'arrivalDate', 'departureDate',
+                  'quantity', 'roomType', 'remark', 'purpose', 'templateId']
+
+# stream_xlsx 每积累这么多字节的行数据写出一次
+XLSX_CHUNK_BYTES = 256 * 1024
+
+# XML 中不允许出现的控制字符
+_XML_ILLEGAL = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+_XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '</Types>'),
+    '_rels/.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+        'Target="xl/workbook.xml"/></Relationships>'),
+    'xl/_rels/workbook.xml.rels': (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" '
+        'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        'Target="worksheets/sheet1.xml"/></Relationships>'),
+}
+
+
+def normalize_row(row):
+    """Clean up one booking row from JSON, CSV or XLSX
+
+    去掉空值和多余空格，把表格里的日期转换成 YYYY-MM-DD，数量转换成整数。
+    数据有误时抛出 ValueError。
+    """
+    if not isinstance(row, dict):
+        raise ValueError('Booking must be an object')
+    booking = {}
+    for field in BOOKING_FIELDS:
+        value = row.get(field)
+        if isinstance(value, (datetime, date)):
+            value = value.strftime('%Y-%m-%d')
+        elif isinstance(value, str):
+            value = value.strip()
+        if value is None or value == '':
+            continue
+        booking[field] = value
+    for field in ('arrivalDate', 'departureDate'):
+        if field in booking:
+            try:
+                datetime.strptime(str(booking[field]), '%Y-%m-%d')
+            except ValueError:
+                raise ValueError(f'Invalid {field}: {booking[field]} (expected YYYY-MM-DD)')
+    if 'quantity' in booking:
+        try:
+            booking['quantity'] = int(booking['quantity'])
+        except (TypeError, ValueError):
+            raise ValueError(f"Invalid quantity: {booking['quantity']}")
+        if booking['quantity'] < 1:
+            raise ValueError('quantity must be at least 1')
+    return booking
+
+
+def read_csv_rows(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        return list(csv.DictReader(f))
+
+
+def read_xlsx_rows(path):
+    """Rows of the first sheet, using the first row as field names"""
+    from openpyxl import load_workbook  # 只有上传 xlsx 时才需要，启动时不导入
+
+    wb = load_workbook(str(path), read_only=True, data_only=True)
+    try:
+        rows = wb.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if not header:
+            return []
+        names = [str(name).strip() if name is not None else '' for name in header]
+        return [dict(zip(names, values)) for values in rows
+                if any(value not in (None, '') for value in values)]
+    finally:
+        wb.close()
+
+
+def read_upload_rows(path):
+    suffix = path.suffix.lower()
+    if suffix == '.csv':
+        return read_csv_rows(path)
+    if suffix in ('.xlsx', '.xlsm'):
+        return read_xlsx_rows(path)
+    raise ValueError(f'Unsupported file type: {suffix} (use .csv or .xlsx)')
+
+
+class _ChunkBuffer:
+    """Write-only, non-seekable sink that hands written bytes back in chunks"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def stream_zip(entries):
+    """Yield a ZIP archive chunk by chunk from (name, bytes) pairs
+
+    xlsx 本身已经是压缩过的，所以 ZIP 中直接存储，不再压缩。
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as zf:
+        for name, data in entries:
+            zf.writestr(name, data)
+            chunk = buffer.pop()
+            if chunk:
+                yield chunk
+    chunk = buffer.pop()
+    if chunk:
+        yield chunk
+
+
+def stream_csv(header, rows, chunk_rows=500):
+    """Yield a UTF-8 CSV (with BOM, so Excel detects the encoding) in chunks of ``chunk_rows`` rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    buffer.write('\ufeff')
+    writer.writerow(header)
+    for count, row in enumerate(rows, 1):
+        writer.writerow(row)
+        if count % chunk_rows == 0:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+def _xml_text(value):
+    text = _XML_ILLEGAL.sub('', str(value))
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;').replace('"', '&quot;')
+
+
+def _xlsx_cell(value):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return f'<c><v>{value}</v></c>'
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{_xml_text(value)}</t></is></c>'
+
+
+def stream_xlsx(header, rows, sheet_name='Sheet1'):
+    """Yield a one-sheet xlsx workbook chunk by chunk
+
+    openpyxl 要在保存时才写出整个文件；这里直接把每一行写成工作表 XML
+    （字符串使用 inlineStr，不需要共享字符串表），边生成边压缩输出，
+    导出几百万行也只占用一个块的内存。
+    """
+    buffer = _ChunkBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zf:
+        for name, content in _XLSX_PARTS.items():
+            zf.writestr(name, content)
+        zf.writestr('xl/workbook.xml', (
+            '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+            '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+            f'<sheets><sheet name="{_xml_text(sheet_name)}" sheetId="1" r:id="rId1"/></sheets></workbook>'))
+        with zf.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            pending = [
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+            ]
+            size = 0
+            for row in itertools.chain([header], rows):
+                text = '<row>' + ''.join(_xlsx_cell(value) for value in row) + '</row>'
+                pending.append(text)
+                size += len(text)
+                if size >= XLSX_CHUNK_BYTES:
+                    sheet.write(''.join(pending).encode('utf-8'))
+                    pending, size = [], 0
+                    chunk = buffer.pop()
+                    if chunk:
+                        yield chunk
+            pending.append('</sheetData></worksheet>')
+            sheet.write(''.join(pending).encode('utf-8'))
+    chunk = buffer.pop()
+    if chunk:
+        yield chunk
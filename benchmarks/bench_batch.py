@@ -0,0 +1,60 @@
+"""Throughput of POST /generate-documents/batch for 1, 100 and 10,000 rows
+
+用法: python benchmarks/bench_batch.py [行数 ...]
+
+生成的文件和数据库都放在临时目录中，不会写入项目目录。限流关闭，
+否则批量生成会按每个文档消耗令牌。
+"""
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+import app as visa_app  # noqa: E402
+from load_test import UNLIMITED  # noqa: E402
+
+
+def booking(i):
+    return {
+        'guestName': f'Guest {i}',
+        'email': f'guest{i}@example.com',
+        'company': 'ACME Travel',
+        'arrivalDate': '2026-11-01',
+        'departureDate': '2026-11-05',
+        'quantity': 1,
+    }
+
+
+def run(client, rows):
+    payload = [booking(i) for i in range(rows)]
+    start = time.perf_counter()
+    response = client.post('/generate-documents/batch', json=payload)
+    size = sum(len(chunk) for chunk in response.response)
+    elapsed = time.perf_counter() - start
+    assert response.status_code == 200, response.status_code
+    return f"{rows:>6} rows  {elapsed:8.3f}s  {rows / elapsed:9.1f} docs/s  zip {size / 1024:,.0f} KiB"
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1, 100, 10000]
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        flask_app = visa_app.create_app(GENERATED_FOLDER=tmp / 'generated', UPLOAD_FOLDER=tmp / 'uploads',
+                                        DATABASE_PATH=tmp / 'bench.db', **UNLIMITED)
+        client = flask_app.test_client()
+        run(client, 1)  # 预热
+        render_pool = visa_app.document_templates.get().render_pool
+        print(f"render pool: {render_pool.max_workers} workers, "
+              f"used for batches of {render_pool.min_batch}+ rows")
+        for rows in sizes:
+            print(run(client, rows))
+        render_pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,179 @@
+"""/reports query times on a large registry
+
+用法: python benchmarks/bench_reports.py [--documents N] [--companies N] [--days N] [--repeat N] [--max-ms MS]
+
+在临时目录中生成 --documents 个文档记录（分布在 --days 天、--companies 个
+公司），每次 add_many 写入 BATCH_SIZE 个，汇总表由触发器随写入维护；然后
+对每个报表查询重复 --repeat 次取中位数，最后测量 bookings CSV 导出的速度。
+写入速度同时与没有汇总表的登记表对比，给出触发器的写入开销。
+
+任何报表查询的中位数超过 --max-ms 时以状态 1 退出。按公司排名的报表读取
+公司数 ×（月数 + 首尾不满一个月的天数）行，目标只针对整月的范围；不按
+整月的一年范围只输出耗时（标记为 *）。
+
+最后用 RetentionSweeper 清理 SWEEP_BATCHES 批过期文档，汇总表只增不减，
+清理前后的报表必须相同，否则同样以状态 1 退出。
+"""
+import argparse
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import registry  # noqa: E402
+from batch import stream_csv  # noqa: E402
+from registry import DocumentRegistry  # noqa: E402
+from reports import BookingReports  # noqa: E402
+from retention import RetentionSweeper  # noqa: E402
+from storage import DiskStorage  # noqa: E402
+
+BATCH_SIZE = 5000
+DEFAULT_MAX_MS = 10
+# 清理检查删除的批数（每批 500 个文档）
+SWEEP_BATCHES = 20
+START = date(2025, 1, 1)
+
+
+def documents(count, companies, days, seed=1):
+    rng = random.Random(seed)
+    for i in range(count):
+        generated = datetime.combine(START, datetime.min.time()) + timedelta(
+            days=rng.randrange(days), seconds=rng.randrange(86400))
+        arrival = generated.date() + timedelta(days=rng.randrange(1, 60))
+        nights = rng.randint(1, 14)
+        guest = rng.randrange(count // 20 + 1)
+        yield {
+            'id': f'B{i:09d}',
+            'filename': f'Visa_Booking_B{i:09d}.xlsx',
+            'company': f'Company {rng.randrange(companies)}',
+            'email': f'guest{guest}@example.com',
+            'guest_name': f'Guest {guest}',
+            'arrival_date': arrival.isoformat(),
+            'departure_date': (arrival + timedelta(days=nights)).isoformat(),
+            'nights': nights,
+            'total_amount': nights * 98000,
+            'generated_date': generated.strftime('%Y-%m-%d %H:%M:%S'),
+            'filepath': '',
+            'purpose': 'VISA_APPLICATION_ONLY',
+        }
+
+
+def fill(doc_registry, docs):
+    """Documents written per second"""
+    started = time.perf_counter()
+    batch = []
+    count = 0
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == BATCH_SIZE:
+            doc_registry.add_many(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        doc_registry.add_many(batch)
+        count += len(batch)
+    return count / (time.perf_counter() - started)
+
+
+def timed(call, repeat):
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = call()
+        if not isinstance(result, (dict, list)):
+            result = list(result)
+        times.append((time.perf_counter() - started) * 1000)
+    return statistics.median(times), max(times)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=1000000)
+    parser.add_argument('--companies', type=int, default=500)
+    parser.add_argument('--days', type=int, default=730)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--max-ms', type=float, default=DEFAULT_MAX_MS)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        sample = min(options.documents, 100000)
+        plain_schema = [statement for statement in registry.SCHEMA if statement is not registry._create_rollups]
+        plain = DocumentRegistry(Path(tmp) / 'plain.db')
+        plain.db.schema = plain_schema
+        plain_rate = fill(plain, documents(sample, options.companies, options.days))
+
+        doc_registry = DocumentRegistry(Path(tmp) / 'reports.db')
+        print(f"writing {options.documents} documents ...")
+        rate = fill(doc_registry, documents(options.documents, options.companies, options.days))
+        print(f"add_many: {rate:,.0f} documents/s with rollups, {plain_rate:,.0f} documents/s without "
+              f"({sample} documents)")
+        doc_registry.db.get().execute('ANALYZE')
+
+        reports = BookingReports(doc_registry)
+        year_from, year_to = date(2025, 3, 15), date(2026, 3, 14)
+        calendar_from, calendar_to = date(2025, 4, 1), date(2026, 3, 31)
+        month_from, month_to = date(2025, 6, 1), date(2025, 6, 30)
+        queries = [
+            ('summary, all time', lambda: reports.summary()),
+            ('summary, one year', lambda: reports.summary(year_from, year_to)),
+            ('summary, one company, year', lambda: reports.summary(year_from, year_to, 'Company 7')),
+            ('daily, one month', lambda: reports.by_period('day', month_from, month_to)),
+            ('daily, one company, year', lambda: reports.by_period('day', year_from, year_to, 'Company 7')),
+            ('monthly, one year', lambda: reports.by_period('month', year_from, year_to)),
+            ('companies top 20, all time', lambda: reports.companies(limit=20)),
+            ('companies top 20, one month', lambda: reports.companies(month_from, month_to, limit=20)),
+            ('companies top 20, 12 months', lambda: reports.companies(calendar_from, calendar_to, limit=20)),
+            ('companies top 20, one year *', lambda: reports.companies(year_from, year_to, limit=20)),
+            ('guests top 20', lambda: reports.guests(limit=20)),
+            ('arrivals by month', lambda: reports.arrivals('month')),
+        ]
+        print()
+        print(f"{'report':<30} {'median ms':>10} {'max ms':>8}")
+        failed = []
+        for name, call in queries:
+            median, worst = timed(call, options.repeat)
+            print(f"{name:<30} {median:>10.2f} {worst:>8.2f}")
+            if median > options.max_ms and not name.endswith('*'):
+                failed.append(f'{name} {median:.1f} ms')
+
+        columns = ['id', 'company', 'email', 'guest_name', 'arrival_date', 'departure_date', 'nights',
+                   'total_amount', 'generated_date', 'purpose']
+        rows = 0
+        size = 0
+        started = time.perf_counter()
+        for chunk in stream_csv(columns, ([doc[column] for column in columns] for doc in
+                                          doc_registry.query(date_from='2025-01-01', date_to='2025-03-31'))):
+            size += len(chunk)
+            rows += chunk.count(b'\n')
+        rows -= 1  # 表头
+        elapsed = time.perf_counter() - started
+        print()
+        print(f"bookings CSV export, one quarter: {rows} rows, {size / 1e6:.1f} MB in {elapsed:.2f} s")
+
+        def snapshot():
+            return [reports.summary(), reports.summary(year_from, year_to, 'Company 7'),
+                    list(reports.by_period('month')), list(reports.companies(limit=20)),
+                    list(reports.guests(limit=20)), list(reports.arrivals('month'))]
+
+        before = snapshot()
+        sweeper = RetentionSweeper(doc_registry, DiskStorage(Path(tmp) / 'files'), ttl_hours=0)
+        stats = sweeper.sweep(max_batches=SWEEP_BATCHES)
+        unchanged = snapshot() == before
+        print(f"retention sweep: {stats['records_removed']} documents removed, "
+              f"report totals {'unchanged' if unchanged else 'CHANGED'}")
+        if not stats['records_removed'] or not unchanged:
+            failed.append('retention sweep changed the report totals' if stats['records_removed']
+                          else 'retention sweep removed no documents')
+
+    print()
+    print('target missed: ' + '; '.join(failed) if failed else f'targets met: every report <= {options.max_ms:.0f} ms')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
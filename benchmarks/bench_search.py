@@ -0,0 +1,142 @@
+"""/documents/search latency on a large registry
+
+用法: python benchmarks/bench_search.py [--documents N] [--repeat N] [--max-ms MS]
+
+在临时目录中生成 --documents 个文档记录（由常见的名、姓、公司名组合而成，
+每个客人有自己的邮箱，部分文档带备注），全文索引和拼写容错词表随写入由
+触发器和 add_many 维护；然后对每种查询重复 --repeat 次取中位数和 p95。
+
+任何查询的中位数超过 --max-ms 时以状态 1 退出。
+"""
+import argparse
+import json
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from registry import DocumentRegistry  # noqa: E402
+from search import DocumentSearch  # noqa: E402
+
+BATCH_SIZE = 5000
+DEFAULT_MAX_MS = 20
+
+FIRST_NAMES = ['John', 'Maria', 'José', 'Ahmed', 'Wei', 'Fatima', 'Pierre', 'Anna', 'Carlos', 'Olga',
+               'Samuel', 'Grace', 'Hiroshi', 'Amina', 'Luca', 'Sofia', 'David', 'Chen', 'Ivan', 'Nadia',
+               'Michael', 'Elena', 'Kwame', 'Ines', 'Rafael', 'Yuki', 'Omar', 'Clara', 'Pedro', 'Leila']
+LAST_NAMES = ['Smith', 'Garcia', 'Ndong', 'Obiang', 'Nguema', 'Mba', 'Müller', 'Rossi', 'Dubois', 'Wang',
+              'Kowalski', 'Ivanova', 'Silva', 'Okafor', 'Tanaka', 'Haddad', 'Johansson', 'Martin', 'Lopez',
+              'Esono', 'Mangue', 'Ondo', 'Bindang', 'Nsue', 'Edu', 'Asumu', 'Owono', 'Ela', 'Mayé', 'Abeso']
+COMPANY_WORDS = ['Petro', 'Guinea', 'Ecuatorial', 'Energy', 'Marine', 'Logistics', 'Construcciones', 'Global',
+                 'Atlantic', 'Bioko', 'Services', 'Holdings', 'Telecom', 'Mining', 'Consulting', 'Gas',
+                 'Offshore', 'Engineering', 'Trading', 'Africa']
+REMARKS = ['late arrival', 'needs invoice', 'VIP guest', 'airport pickup', 'extra bed', 'sea view',
+           'early check-in', 'quiet room']
+
+
+def documents(count, seed=1):
+    rng = random.Random(seed)
+    guests = max(1, count // 5)
+    companies = [' '.join(rng.sample(COMPANY_WORDS, 2)) for _ in range(2000)]
+    start = datetime(2025, 1, 1)
+    for i in range(count):
+        guest = rng.randrange(guests)
+        guest_rng = random.Random(guest)
+        first, last = guest_rng.choice(FIRST_NAMES), guest_rng.choice(LAST_NAMES)
+        company = companies[guest % len(companies)]
+        generated = start + timedelta(seconds=i * 30)
+        remark = rng.choice(REMARKS) if rng.random() < 0.2 else ''
+        yield {
+            'id': f"{generated.strftime('%Y%m%d')}{i % 10000:04d}{i // 10000:03d}",
+            'filename': f'Visa_Booking_{i}.xlsx',
+            'company': company,
+            'email': f"{first.lower()}.{last.lower()}{guest}@{company.split()[0].lower()}.gq",
+            'guest_name': f'{first} {last}',
+            'arrival_date': '2026-11-01',
+            'departure_date': '2026-11-05',
+            'nights': 4,
+            'total_amount': 392000,
+            'generated_date': generated.strftime('%Y-%m-%d %H:%M:%S'),
+            'filepath': '',
+            'purpose': 'VISA_APPLICATION_ONLY',
+            'booking': json.dumps({'remark': remark}) if remark else '',
+        }
+
+
+def fill(doc_registry, docs):
+    started = time.perf_counter()
+    batch = []
+    count = 0
+    for doc in docs:
+        batch.append(doc)
+        if len(batch) == BATCH_SIZE:
+            doc_registry.add_many(batch)
+            count += len(batch)
+            batch = []
+    if batch:
+        doc_registry.add_many(batch)
+        count += len(batch)
+    return count, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--documents', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--max-ms', type=float, default=DEFAULT_MAX_MS)
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        doc_registry = DocumentRegistry(Path(tmp) / 'search.db')
+        print(f"writing {options.documents} documents ...")
+        count, elapsed = fill(doc_registry, documents(options.documents))
+        print(f"add_many: {count / elapsed:,.0f} documents/s including the search index")
+        conn = doc_registry.db.get()
+        conn.execute("INSERT INTO documents_search (documents_search) VALUES ('optimize')")
+        terms = conn.execute('SELECT COUNT(*) FROM search_terms').fetchone()[0]
+        print(f"typo-tolerant vocabulary: {terms} words")
+
+        search = DocumentSearch(doc_registry)
+        sample = doc_registry.get_by_seq([options.documents // 2])[options.documents // 2]
+        queries = [
+            ('full name', 'Amina Okafor'),
+            ('name prefix', 'ami oka'),
+            ('name with typo', 'Amnia Okafr'),
+            ('accents dropped', 'jose muller'),
+            ('surname only (common)', 'Ndong'),
+            ('company', 'Bioko Offshore'),
+            ('company with typo', 'Offshroe'),
+            ('email', sample['email']),
+            ('confirmation number', sample['id']),
+            ('confirmation prefix', sample['id'][:8]),
+            ('remark', 'airport pickup'),
+            ('no match', 'zzzzqqq'),
+        ]
+        print()
+        print(f"{'query':<24} {'results':>7} {'median ms':>10} {'p95 ms':>8}")
+        failed = []
+        for name, query in queries:
+            times = []
+            for _ in range(options.repeat):
+                started = time.perf_counter()
+                results = search.search(query, 20)
+                times.append((time.perf_counter() - started) * 1000)
+            times.sort()
+            median = statistics.median(times)
+            p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+            print(f"{name:<24} {len(results):>7} {median:>10.2f} {p95:>8.2f}")
+            if median > options.max_ms:
+                failed.append(f'{name} {median:.1f} ms')
+
+    print()
+    print('target missed: ' + '; '.join(failed) if failed else f'targets met: every query <= {options.max_ms:.0f} ms')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+"""Startup time: import app, create_app(), first requests, and gunicorn boot with and without preload
+
+用法: python benchmarks/bench_startup.py [--repeat N] [--workers N] [--max-import-ms MS] [--max-boot-ms MS]
+
+每次测量都在新的解释器中进行（取中位数），代码复制到临时目录，不写入项目
+目录。import 为 `import app` 的耗时，boot 为 import + create_app()（编译模板、
+打开数据库），之后是第一个生成请求和第一个 PDF 请求的耗时。
+
+gunicorn 部分分别用 gunicorn.conf.py（preload_app，主进程中 create_app()）和
+不预加载（`-c /dev/null app:app`，每个 worker 各自初始化）启动 --workers 个
+worker，测量从启动到每个 worker 都处理过请求的时间，以及所有进程的 PSS 之和
+（Linux，写时复制共享的页面按进程数分摊）。
+
+import 或 boot 的中位数超过目标时以状态 1 退出。
+"""
+import argparse
+import http.client
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from load_test import UNLIMITED, booking, prepare_tree  # noqa: E402
+
+# 目标（毫秒）：这台 1 核开发机上 import 约 250 ms（其中 Flask 约 200 ms），boot 约 600 ms
+DEFAULT_MAX_IMPORT_MS = 400
+DEFAULT_MAX_BOOT_MS = 900
+
+PROBE = '''
+import json, sys, time
+from pathlib import Path
+started = time.perf_counter()
+import app
+imported = time.perf_counter()
+openpyxl_imported = 'openpyxl' in sys.modules
+tmp = Path(sys.argv[1])
+flask_app = app.create_app(GENERATED_FOLDER=tmp / 'docs', UPLOAD_FOLDER=tmp / 'uploads',
+                           DATABASE_PATH=tmp / 'bench.db')
+booted = time.perf_counter()
+client = flask_app.test_client()
+response = client.post('/generate-document', json=json.loads(sys.argv[2]))
+generated = time.perf_counter()
+pdf = client.get(response.get_json()['document']['pdf_url'])
+pdf_done = time.perf_counter()
+assert response.status_code == 200 and pdf.status_code == 200
+print('RESULT ' + json.dumps({
+    'import_ms': (imported - started) * 1000,
+    'boot_ms': (booted - started) * 1000,
+    'first_generate_ms': (generated - booted) * 1000,
+    'first_pdf_ms': (pdf_done - generated) * 1000,
+    'openpyxl_imported': openpyxl_imported,
+}))
+'''
+
+
+def probe_once(tree):
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, LOG_LEVEL='WARNING', **UNLIMITED)
+        child = subprocess.run([sys.executable, '-c', PROBE, tmp, json.dumps(booking(1))],
+                               cwd=str(tree), env=env, capture_output=True, text=True)
+    if child.returncode != 0:
+        raise RuntimeError(child.stderr.strip().splitlines()[-1])
+    line = [line for line in child.stdout.splitlines() if line.startswith('RESULT ')][-1]
+    return json.loads(line[len('RESULT '):])
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def _request(port, method, path, body=None):
+    conn = http.client.HTTPConnection('127.0.0.1', port, timeout=60)
+    try:
+        headers = {'Content-Type': 'application/json'} if body is not None else {}
+        conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        return response.status
+    finally:
+        conn.close()
+
+
+def _children(pid):
+    pids = []
+    for entry in Path('/proc').iterdir():
+        if entry.name.isdigit():
+            try:
+                stat = (entry / 'stat').read_text()
+            except OSError:
+                continue
+            if int(stat.rsplit(')', 1)[1].split()[1]) == pid:
+                pids.append(int(entry.name))
+    return pids
+
+
+def _pss_mb(pids):
+    total = 0
+    for pid in pids:
+        try:
+            for line in Path(f'/proc/{pid}/smaps_rollup').read_text().splitlines():
+                if line.startswith('Pss:'):
+                    total += int(line.split()[1])
+        except OSError:
+            return None
+    return round(total / 1024, 1)
+
+
+def gunicorn_boot(tree, workers, preload):
+    """Seconds until every worker has served a request, and the PSS of all processes"""
+    port = _free_port()
+    config = [] if preload else ['-c', os.devnull, 'app:app']
+    env = dict(os.environ, LOG_LEVEL='WARNING', **UNLIMITED)
+    started = time.perf_counter()
+    with open(tree / 'gunicorn-startup.log', 'w') as log:
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind', f'127.0.0.1:{port}'] + config,
+            cwd=str(tree), env=env, stdout=log, stderr=subprocess.STDOUT)
+    try:
+        deadline = started + 60
+        while True:
+            try:
+                if _request(port, 'GET', '/healthz') == 200:
+                    break
+            except OSError:
+                pass
+            if process.poll() is not None or time.perf_counter() > deadline:
+                raise RuntimeError(f'gunicorn did not start, see {tree / "gunicorn-startup.log"}')
+            time.sleep(0.01)
+        first_response = time.perf_counter() - started
+        # sync worker 轮流接受连接；每个 worker 都处理过请求后才算全部就绪
+        for i in range(workers * 4):
+            _request(port, 'POST', '/generate-document', booking(100 + i))
+        all_ready = time.perf_counter() - started
+        return {
+            'preload': preload,
+            'first_response_ms': round(first_response * 1000, 1),
+            'warm_ms': round(all_ready * 1000, 1),
+            'pss_mb': _pss_mb([process.pid] + _children(process.pid)),
+        }
+    finally:
+        process.terminate()
+        process.wait(10)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--max-import-ms', type=float, default=DEFAULT_MAX_IMPORT_MS)
+    parser.add_argument('--max-boot-ms', type=float, default=DEFAULT_MAX_BOOT_MS)
+    parser.add_argument('--skip-gunicorn', action='store_true')
+    options = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = Path(tmp) / 'tree'
+        prepare_tree('.', tree)
+        runs = [probe_once(tree) for _ in range(options.repeat)]
+        medians = {key: statistics.median(run[key] for run in runs)
+                   for key in ('import_ms', 'boot_ms', 'first_generate_ms', 'first_pdf_ms')}
+        print(f"{'measure':<20} {'median ms':>10} {'min ms':>8} {'max ms':>8}")
+        for key, median in medians.items():
+            values = [run[key] for run in runs]
+            print(f"{key:<20} {median:>10.1f} {min(values):>8.1f} {max(values):>8.1f}")
+        print(f"openpyxl imported by `import app`: {any(run['openpyxl_imported'] for run in runs)}")
+
+        if not options.skip_gunicorn:
+            print()
+            print(f"gunicorn, {options.workers} workers")
+            print(f"{'mode':<12} {'first response ms':>18} {'all workers ms':>15} {'PSS MB':>8}")
+            for preload in (True, False):
+                result = gunicorn_boot(tree, options.workers, preload)
+                print(f"{'preload' if preload else 'no preload':<12} {result['first_response_ms']:>18.1f} "
+                      f"{result['warm_ms']:>15.1f} {result['pss_mb'] or 0:>8.1f}")
+
+    failed = []
+    if medians['import_ms'] > options.max_import_ms:
+        failed.append(f"import {medians['import_ms']:.0f} ms > {options.max_import_ms:.0f} ms")
+    if medians['boot_ms'] > options.max_boot_ms:
+        failed.append(f"boot {medians['boot_ms']:.0f} ms > {options.max_boot_ms:.0f} ms")
+    print()
+    print('target missed: ' + '; '.join(failed) if failed else
+          f'targets met: import <= {options.max_import_ms:.0f} ms, boot <= {options.max_boot_ms:.0f} ms')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
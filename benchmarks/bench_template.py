@@ -0,0 +1,76 @@
+"""Documents/second: copy + load_workbook per request vs. the cached template renderers
+
+用法: python benchmarks/bench_template.py [次数]
+"""
+import shutil
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from openpyxl import load_workbook
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from template_engine import TemplateCache, XlsxPatchRenderer  # noqa: E402
+
+TEMPLATE_PATH = ROOT / 'visa_booking_template.xlsx'
+CELLS = {
+    'J5': 'Zhang San', 'J19': 'Zhang San', 'D22': 'Zhang San',
+    'B7': 'ACME Ltd', 'H22': '2026-11-01', 'K22': '2026-11-05',
+    'J8': '2026-10-16', 'J17': '202610160001', 'J9': 'guest@example.com',
+    'J10': 'Late arrival', 'M22': 'Classic Queen', 'R22': 1, 'T22': 4,
+    'V22': 98000, 'AA1': 'Company: ACME Ltd', 'AA2': 'Email: guest@example.com',
+    'AA3': 'Generated: 2026-10-16 12:00:00', 'AA4': 'Document ID: 202610160001',
+}
+
+
+def fill(ws):
+    for addr, value in CELLS.items():
+        ws[addr] = value
+
+
+def render_legacy(out_dir, i):
+    temp_template = out_dir / 'visa_booking_template_temp.xlsx'
+    shutil.copy2(str(TEMPLATE_PATH), str(temp_template))
+    wb = load_workbook(str(temp_template))
+    fill(wb.active)
+    wb.save(str(out_dir / f'legacy_{i}.xlsx'))
+
+
+def render_cached(cache, out_dir, i):
+    wb = cache.new_workbook()
+    fill(wb.active)
+    wb.save(str(out_dir / f'cached_{i}.xlsx'))
+
+
+def render_xml(renderer, out_dir, i):
+    renderer.render_to_file(str(out_dir / f'xml_{i}.xlsx'), CELLS)
+
+
+def measure(label, fn, n):
+    start = time.perf_counter()
+    for i in range(n):
+        fn(i)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<28} {n / elapsed:8.1f} docs/s  ({elapsed / n * 1000:6.1f} ms/doc)")
+    return n / elapsed
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    with tempfile.TemporaryDirectory() as tmp:
+        out_dir = Path(tmp)
+        cache = TemplateCache(TEMPLATE_PATH)
+        cache.preload()
+        before = measure('copy2 + load_workbook', lambda i: render_legacy(out_dir, i), n)
+        cached = measure('TemplateCache', lambda i: render_cached(cache, out_dir, i), n)
+        renderer = XlsxPatchRenderer(TEMPLATE_PATH, CELLS)
+        renderer.preload()
+        xml = measure('XlsxPatchRenderer', lambda i: render_xml(renderer, out_dir, i), n)
+    print(f"speedup: TemplateCache {cached / before:.1f}x, XlsxPatchRenderer {xml / before:.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,605 @@
+"""Load test for the Flask endpoints, in-process, behind gunicorn and behind uvicorn (ASGI)
+
+用法:
+  python benchmarks/load_test.py [选项]                 测试当前工作目录的代码
+  python benchmarks/load_test.py --compare A B [选项]   比较两个 git 版本（'.' 为工作目录）
+
+场景:
+  generate    POST /generate-document，按 --concurrency 中的每个并发数
+  documents   GET /documents（首页、按公司过滤、全部导出），登记表预先写入
+              --registry-sizes 中的文档数
+  download    GET /download/<id>，以及带 If-None-Match 的条件请求
+  counter     多线程同时分配确认号（只在进程内测试）
+  idle        保持 --idle-connections 个没有发完请求头的慢连接，同时测试下载
+              （只在 gunicorn / asgi 下测试，--idle-connections 为 0 时跳过）
+
+模式 (--modes): inprocess 为 Flask 测试客户端，gunicorn 为 --workers 个 sync
+worker，asgi 为一个 uvicorn 进程（asgi.py，渲染在进程池中）。
+
+每个结果包括吞吐量、p50/p95/p99 延迟和峰值 RSS。每次运行都在临时目录里的
+代码副本上进行，不会写入项目目录；--output 保存 JSON 结果。比较两个版本时
+吞吐量下降或 p95 延迟上升超过 --threshold 的项标记为回退，并以状态 1 退出。
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import os
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+SCENARIOS = ['generate', 'documents', 'download', 'counter', 'idle']
+COPY_IGNORE = shutil.ignore_patterns('.git', '__pycache__', 'generated_documents', 'uploads', 'profiles',
+                                     'benchmarks', '*.db', '*.db-*', 'daily_counters.json*')
+# 全部导出只在登记表不超过这个大小时测试
+EXPORT_MAX_DOCUMENTS = 100000
+# 版本没有 registry 模块时写入登记表的子进程的退出状态
+SEED_UNSUPPORTED = 3
+# 进程内测试的子进程输出结果的行前缀，其余输出（旧版本的 print）忽略
+RESULT_PREFIX = 'RESULT '
+# idle 场景中单个请求的超时（秒）：worker 被慢连接占满时记为错误，不等到 gunicorn 的超时
+IDLE_REQUEST_TIMEOUT = 10
+# 压测从同一个 IP 发出大量请求，关闭 /generate-document 的限流
+UNLIMITED = {'RATE_LIMIT_IP': '0', 'RATE_LIMIT_EMAIL': '0', 'RATE_LIMIT_COMPANY': '0'}
+
+
+def booking(i):
+    # 每个请求的内容都不同，不会被幂等记录直接返回
+    return {
+        'guestName': f'Guest {i}',
+        'email': f'guest{i}@example.com',
+        'company': f'Company {i % 50}',
+        'arrivalDate': '2026-11-01',
+        'departureDate': '2026-11-05',
+        'quantity': 1,
+    }
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def summarize(mode, name, concurrency, latencies, errors, elapsed, rss_mb):
+    latencies = sorted(latencies)
+    return {
+        'mode': mode,
+        'name': name,
+        'concurrency': concurrency,
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / elapsed, 1) if elapsed else None,
+        'p50_ms': round(percentile(latencies, 0.50) * 1000, 2) if latencies else None,
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 0.99) * 1000, 2) if latencies else None,
+        'peak_rss_mb': rss_mb,
+    }
+
+
+def drive(call, total, concurrency):
+    """Run ``call(i)`` ``total`` times from ``concurrency`` threads
+
+    call 返回 HTTP 状态码；返回 (延迟列表, 错误数, 总耗时)。
+    """
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    counter = iter(range(total))
+
+    def worker():
+        while True:
+            with lock:
+                i = next(counter, None)
+            if i is None:
+                return
+            start = time.perf_counter()
+            try:
+                ok = call(i) < 400
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+                if not ok:
+                    errors[0] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        for _ in range(concurrency):
+            pool.submit(worker)
+    return latencies, errors[0], time.perf_counter() - start
+
+
+# ---------------------------------------------------------------------------
+# 客户端：进程内的 Flask 测试客户端，或者连接 gunicorn / uvicorn 的 HTTP 客户端
+# ---------------------------------------------------------------------------
+
+class InProcessClient:
+    mode = 'inprocess'
+
+    def __init__(self, flask_app):
+        self.app = flask_app
+        self._local = threading.local()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        return client
+
+    def request(self, method, path, body=None, headers=None):
+        response = self._client().open(path, method=method, json=body, headers=headers or {})
+        data = b''.join(response.response)
+        response.close()
+        return response.status_code, response.headers, data
+
+    def peak_rss_mb(self):
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class GunicornClient:
+    mode = 'gunicorn'
+
+    def __init__(self, tree, workers):
+        self.tree = tree
+        with socket.socket() as s:
+            s.bind(('127.0.0.1', 0))
+            self.port = s.getsockname()[1]
+        env = dict(os.environ, LOG_LEVEL='WARNING', **UNLIMITED)
+        self.log = open(tree / f'{self.mode}.log', 'w')
+        self.process = subprocess.Popen(
+            self.command(workers), cwd=str(tree), env=env, stdout=self.log, stderr=subprocess.STDOUT)
+        deadline = time.time() + 60
+        while True:
+            try:
+                if self.request('GET', '/')[0] == 200:
+                    break
+            except OSError:
+                pass
+            if self.process.poll() is not None or time.time() > deadline:
+                self.close()
+                raise RuntimeError(f'{self.mode} did not start, see {tree / (self.mode + ".log")}')
+            time.sleep(0.2)
+
+    def command(self, workers):
+        # 有 gunicorn.conf.py 的版本由配置文件指定应用（create_app() 和 preload）
+        app_args = [] if (self.tree / 'gunicorn.conf.py').exists() else ['app:app']
+        return [sys.executable, '-m', 'gunicorn', '--workers', str(workers), '--bind',
+                f'127.0.0.1:{self.port}', '--timeout', '120'] + app_args
+
+    def request(self, method, path, body=None, headers=None, timeout=120):
+        # sync worker 不支持 keep-alive，每个请求一个连接
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=timeout)
+        try:
+            headers = dict(headers or {})
+            payload = None
+            if body is not None:
+                payload = json.dumps(body).encode('utf-8')
+                headers['Content-Type'] = 'application/json'
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.headers, response.read()
+        finally:
+            conn.close()
+
+    def open_idle_connections(self, count):
+        """Connections that send a partial request header and then wait, like slow clients"""
+        connections = []
+        for _ in range(count):
+            conn = socket.create_connection(('127.0.0.1', self.port))
+            conn.sendall(b'GET / HTTP/1.1\r\nHost: 127.0.0.1\r\n')
+            connections.append(conn)
+        return connections
+
+    def _pids(self):
+        pids = [self.process.pid]
+        for entry in Path('/proc').iterdir():
+            if entry.name.isdigit():
+                try:
+                    stat = (entry / 'stat').read_text()
+                except OSError:
+                    continue
+                if int(stat.rsplit(')', 1)[1].split()[1]) == self.process.pid:
+                    pids.append(int(entry.name))
+        return pids
+
+    def peak_rss_mb(self):
+        """Sum of VmHWM over the master and its workers (Linux only)"""
+        total = 0
+        for pid in self._pids():
+            try:
+                for line in Path(f'/proc/{pid}/status').read_text().splitlines():
+                    if line.startswith('VmHWM:'):
+                        total += int(line.split()[1])
+            except OSError:
+                continue
+        return round(total / 1024, 1) if total else None
+
+    def close(self):
+        self.process.terminate()
+        try:
+            self.process.wait(10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+class AsgiClient(GunicornClient):
+    """One uvicorn process serving asgi.py; rendering uses its process pool"""
+
+    mode = 'asgi'
+
+    def command(self, workers):
+        return [sys.executable, '-m', 'uvicorn', '--host', '127.0.0.1', '--port', str(self.port),
+                '--log-level', 'warning', 'asgi:app']
+
+
+# ---------------------------------------------------------------------------
+# 场景
+# ---------------------------------------------------------------------------
+
+def scenario_generate(client, options, offset):
+    results = []
+    for concurrency in options.concurrency:
+        latencies, errors, elapsed = drive(
+            lambda i: client.request('POST', '/generate-document', booking(offset + concurrency * 100000 + i))[0],
+            options.requests, concurrency)
+        results.append(summarize(client.mode, 'generate', concurrency, latencies, errors, elapsed,
+                                 client.peak_rss_mb()))
+    return results
+
+
+def seed_registry(tree, size):
+    """Fill the tree's registry with ``size`` documents; False if the revision has none
+
+    在子进程中导入这个版本的 registry 模块，比较两个版本时不会用到另一个版本的模块。
+    """
+    child = subprocess.run([sys.executable, __file__, '--seed-tree', str(tree), '--seed-size', str(size)])
+    if child.returncode == SEED_UNSUPPORTED:
+        return False
+    child.check_returncode()
+    return True
+
+
+def _seed_registry_here(tree, size):
+    sys.path.insert(0, str(tree))
+    try:
+        from registry import COLUMNS, DocumentRegistry
+    except ImportError:
+        sys.exit(SEED_UNSUPPORTED)
+    registry = DocumentRegistry(tree / 'visa_booking.db')
+    existing = registry.count()
+    chunk = 50000
+    for start in range(existing, size, chunk):
+        docs = []
+        for i in range(start, min(size, start + chunk)):
+            doc = {column: '' for column in COLUMNS}
+            doc.update({
+                'id': f'BENCH{i:09d}',
+                'filename': f'Visa_Booking_BENCH{i:09d}.xlsx',
+                'company': f'Company {i % 50}',
+                'email': f'guest{i}@example.com',
+                'guest_name': f'Guest {i}',
+                'arrival_date': '2026-11-01',
+                'departure_date': '2026-11-05',
+                'nights': 4,
+                'total_amount': 392000,
+                'generated_date': f'2026-10-{1 + i % 28:02d} 12:00:00',
+                'filepath': str(tree / 'generated_documents' / f'BENCH{i:09d}.xlsx'),
+                'purpose': 'VISA_APPLICATION_ONLY',
+            })
+            docs.append(doc)
+        registry.add_many(docs)
+
+
+def scenario_documents(client, options, size):
+    queries = [
+        ('documents_page', '/documents?limit=50'),
+        ('documents_company', '/documents?company=Company%207&limit=50'),
+    ]
+    if size <= EXPORT_MAX_DOCUMENTS:
+        queries.append(('documents_export', '/documents'))
+    results = []
+    for name, path in queries:
+        total = options.requests if name != 'documents_export' else max(3, options.requests // 20)
+        concurrency = max(options.concurrency)
+        latencies, errors, elapsed = drive(lambda i: client.request('GET', path)[0], total, concurrency)
+        result = summarize(client.mode, f'{name}[{size}]', concurrency, latencies, errors, elapsed,
+                           client.peak_rss_mb())
+        results.append(result)
+    return results
+
+
+def scenario_download(client, options):
+    status, _, body = client.request('POST', '/generate-document', booking(999999))
+    if status != 200:
+        raise RuntimeError(f'could not generate a document to download: {status}')
+    document_id = json.loads(body)['document']['id']
+    path = f'/download/{document_id}'
+    _, headers, _ = client.request('GET', path)
+    etag = headers.get('ETag')
+    results = []
+    concurrency = max(options.concurrency)
+    latencies, errors, elapsed = drive(lambda i: client.request('GET', path)[0], options.requests, concurrency)
+    results.append(summarize(client.mode, 'download', concurrency, latencies, errors, elapsed,
+                             client.peak_rss_mb()))
+    if etag:
+        latencies, errors, elapsed = drive(
+            lambda i: client.request('GET', path, headers={'If-None-Match': etag})[0],
+            options.requests, concurrency)
+        results.append(summarize(client.mode, 'download_304', concurrency, latencies, errors, elapsed,
+                                 client.peak_rss_mb()))
+    return results
+
+
+def scenario_idle(client, options):
+    status, _, body = client.request('POST', '/generate-document', booking(999998))
+    if status != 200:
+        raise RuntimeError(f'could not generate a document to download: {status}')
+    path = f"/download/{json.loads(body)['document']['id']}"
+    connections = client.open_idle_connections(options.idle_connections)
+    try:
+        time.sleep(0.5)
+        concurrency = max(options.concurrency)
+        latencies, errors, elapsed = drive(
+            lambda i: client.request('GET', path, timeout=IDLE_REQUEST_TIMEOUT)[0], options.requests, concurrency)
+        return [summarize(client.mode, f'download_idle[{options.idle_connections}]', concurrency,
+                          latencies, errors, elapsed, client.peak_rss_mb())]
+    finally:
+        for conn in connections:
+            conn.close()
+
+
+def scenario_counter(visa_app, options):
+    results = []
+    total = options.requests * 10
+    for concurrency in options.concurrency:
+        latencies, errors, elapsed = drive(
+            lambda i: (visa_app.generate_confirmation_number(), 200)[1], total, concurrency)
+        results.append(summarize('inprocess', 'counter', concurrency, latencies, errors, elapsed,
+                                 round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)))
+    return results
+
+
+# ---------------------------------------------------------------------------
+# 运行一个版本
+# ---------------------------------------------------------------------------
+
+def prepare_tree(source, destination):
+    """Copy a working tree (or extract a git revision) without runtime data"""
+    if source == '.':
+        shutil.copytree(ROOT, destination, ignore=COPY_IGNORE)
+    else:
+        destination.mkdir(parents=True)
+        archive = subprocess.run(['git', '-C', str(ROOT), 'archive', source],
+                                 check=True, capture_output=True).stdout
+        subprocess.run(['tar', '-x', '-C', str(destination)], input=archive, check=True)
+        for name in ('generated_documents', 'uploads'):
+            shutil.rmtree(destination / name, ignore_errors=True)
+    (destination / 'generated_documents').mkdir(exist_ok=True)
+
+
+def describe(source):
+    if source == '.':
+        head = subprocess.run(['git', '-C', str(ROOT), 'rev-parse', '--short', 'HEAD'],
+                              capture_output=True, text=True).stdout.strip()
+        return f'{head}+worktree'
+    return subprocess.run(['git', '-C', str(ROOT), 'rev-parse', '--short', source],
+                          capture_output=True, text=True).stdout.strip() or source
+
+
+def attempt(results, notes, name, fn, *args):
+    """Run one scenario; a failure (e.g. an endpoint an old revision lacks) becomes a note"""
+    try:
+        outcome = fn(*args)
+    except Exception as e:
+        notes.append(f'{name} failed: {e}')
+        return
+    if isinstance(outcome, list):
+        results.extend(outcome)
+
+
+def run_inprocess(tree, options, results, notes):
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.update(UNLIMITED)
+    os.chdir(tree)
+    sys.path.insert(0, str(tree))
+    import app as visa_app
+    # 有 create_app() 的版本导入时不初始化，旧版本导入时就已经初始化
+    client = InProcessClient(visa_app.create_app() if hasattr(visa_app, 'create_app') else visa_app.app)
+
+    def quiet(name, fn, *args):
+        # 旧版本每个请求都 print 大量信息，丢弃
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return attempt(results, notes, name, fn, *args)
+
+    quiet('warm-up', client.request, 'POST', '/generate-document', booking(0))
+    if 'generate' in options.scenarios:
+        quiet('generate', scenario_generate, client, options, 0)
+    if 'download' in options.scenarios:
+        quiet('download', scenario_download, client, options)
+    if 'counter' in options.scenarios:
+        quiet('counter', scenario_counter, visa_app, options)
+    if 'documents' in options.scenarios:
+        for size in options.registry_sizes:
+            if not hasattr(visa_app, 'document_registry'):
+                # 旧版本的文档列表只在进程内存中
+                store = getattr(visa_app, 'documents_store', None)
+                if store is None:
+                    notes.append('documents: revision has no document store, skipped')
+                    break
+                store.extend({
+                    'id': f'BENCH{i:09d}', 'filename': f'BENCH{i:09d}.xlsx',
+                    'company': f'Company {i % 50}', 'email': f'guest{i}@example.com',
+                    'guest_name': f'Guest {i}', 'arrival_date': '2026-11-01',
+                    'departure_date': '2026-11-05', 'nights': 4, 'total_amount': 392000,
+                    'generated_date': '2026-10-01 12:00:00', 'filepath': '',
+                    'download_url': f'/download/BENCH{i:09d}', 'print_url': f'/print/BENCH{i:09d}',
+                } for i in range(len(store), size))
+            else:
+                seed_registry(tree, size)
+            quiet('documents', scenario_documents, client, options, size)
+
+
+def run_server(client_class, tree, options, results, notes):
+    client = client_class(tree, options.workers)
+    try:
+        attempt(results, notes, 'warm-up', client.request, 'POST', '/generate-document', booking(0))
+        if 'generate' in options.scenarios:
+            attempt(results, notes, 'generate', scenario_generate, client, options, 5000000)
+        if 'download' in options.scenarios:
+            attempt(results, notes, 'download', scenario_download, client, options)
+        if 'documents' in options.scenarios:
+            for size in options.registry_sizes:
+                # 登记表是共享的 SQLite 数据库，可以在 gunicorn 运行时写入
+                if not seed_registry(tree, size):
+                    notes.append(f'documents: revision has no shared registry, skipped under {client.mode}')
+                    break
+                attempt(results, notes, 'documents', scenario_documents, client, options, size)
+        if 'idle' in options.scenarios and options.idle_connections:
+            attempt(results, notes, 'idle', scenario_idle, client, options)
+    finally:
+        client.close()
+
+
+def run_once(source, options):
+    """Benchmark one revision in a throwaway copy and return the report"""
+    results, notes = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        tree = Path(tmp) / 'tree'
+        prepare_tree(source, tree)
+        if 'inprocess' in options.modes:
+            # 进程内测试需要全新的解释器来导入这个版本的 app 模块
+            child = subprocess.run(
+                [sys.executable, __file__, '--run-tree', str(tree), '--modes', 'inprocess',
+                 '--scenarios', ','.join(options.scenarios),
+                 '--concurrency', ','.join(map(str, options.concurrency)),
+                 '--requests', str(options.requests),
+                 '--registry-sizes', ','.join(map(str, options.registry_sizes))],
+                capture_output=True, text=True)
+            if child.returncode != 0:
+                notes.append(f'inprocess run failed: {child.stderr.strip().splitlines()[-1:]}')
+            else:
+                line = [line for line in child.stdout.splitlines() if line.startswith(RESULT_PREFIX)][-1]
+                report = json.loads(line[len(RESULT_PREFIX):])
+                results.extend(report['results'])
+                notes.extend(report['notes'])
+        for mode, client_class in (('gunicorn', GunicornClient), ('asgi', AsgiClient)):
+            if mode not in options.modes:
+                continue
+            if mode == 'asgi' and not (tree / 'asgi.py').exists():
+                notes.append('asgi: revision has no asgi.py, skipped')
+                continue
+            try:
+                run_server(client_class, tree, options, results, notes)
+            except Exception as e:
+                notes.append(f'{mode} run failed: {e}')
+    return {'revision': describe(source), 'python': sys.version.split()[0], 'cpus': os.cpu_count(),
+            'results': results, 'notes': notes}
+
+
+# ---------------------------------------------------------------------------
+# 输出
+# ---------------------------------------------------------------------------
+
+def format_report(report):
+    lines = [f"revision {report['revision']}  python {report['python']}  cpus {report['cpus']}",
+             f"{'mode':<10} {'scenario':<28} {'conc':>4} {'reqs':>6} {'err':>4} {'req/s':>9} "
+             f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'RSS MB':>7}"]
+    for r in report['results']:
+        lines.append(f"{r['mode']:<10} {r['name']:<28} {r['concurrency']:>4} {r['requests']:>6} "
+                     f"{r['errors']:>4} {r['throughput'] or 0:>9.1f} {r['p50_ms'] or 0:>8.2f} "
+                     f"{r['p95_ms'] or 0:>8.2f} {r['p99_ms'] or 0:>8.2f} {r['peak_rss_mb'] or 0:>7.1f}")
+    lines.extend(f'note: {note}' for note in report['notes'])
+    return '\n'.join(lines)
+
+
+def compare(base, head, threshold):
+    """Side-by-side table; returns (text, number of regressions)"""
+    key = lambda r: (r['mode'], r['name'], r['concurrency'])  # noqa: E731
+    base_results = {key(r): r for r in base['results']}
+    lines = [f"{base['revision']} -> {head['revision']}  (regression threshold {threshold:.0%})",
+             f"{'mode':<10} {'scenario':<28} {'conc':>4} {'req/s':>19} {'p95 ms':>19}  status"]
+    regressions = 0
+    for r in head['results']:
+        b = base_results.get(key(r))
+        if b is None or not b['throughput'] or not r['throughput']:
+            continue
+        throughput_change = r['throughput'] / b['throughput'] - 1
+        p95_change = r['p95_ms'] / b['p95_ms'] - 1 if b['p95_ms'] else 0
+        regressed = (throughput_change < -threshold or p95_change > threshold
+                     or r['errors'] > b['errors'])
+        regressions += regressed
+        lines.append(f"{r['mode']:<10} {r['name']:<28} {r['concurrency']:>4} "
+                     f"{b['throughput']:>8.1f}->{r['throughput']:<8.1f}{throughput_change:+4.0%} "
+                     f"{b['p95_ms']:>8.2f}->{r['p95_ms']:<8.2f}{p95_change:+4.0%}  "
+                     f"{'REGRESSION' if regressed else 'ok'}")
+    return '\n'.join(lines), regressions
+
+
+def parse_list(value, cast=str):
+    return [cast(item) for item in value.split(',') if item]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--compare', nargs=2, metavar=('BASE', 'HEAD'),
+                        help="two git revisions to compare ('.' is the working tree)")
+    parser.add_argument('--modes', type=parse_list, default=['inprocess', 'gunicorn', 'asgi'])
+    parser.add_argument('--scenarios', type=parse_list, default=SCENARIOS)
+    parser.add_argument('--concurrency', type=lambda v: parse_list(v, int), default=[1, 4, 16])
+    parser.add_argument('--requests', type=int, default=200, help='requests per measurement')
+    parser.add_argument('--registry-sizes', type=lambda v: parse_list(v, int), default=[10000, 100000])
+    parser.add_argument('--workers', type=int, default=max(2, os.cpu_count() or 1),
+                        help='gunicorn workers')
+    parser.add_argument('--idle-connections', type=int, default=0,
+                        help='slow connections held open in the idle scenario')
+    parser.add_argument('--threshold', type=float, default=0.10)
+    parser.add_argument('--output', help='write the JSON report(s) to this file')
+    parser.add_argument('--run-tree', help=argparse.SUPPRESS)
+    parser.add_argument('--seed-tree', help=argparse.SUPPRESS)
+    parser.add_argument('--seed-size', type=int, help=argparse.SUPPRESS)
+    options = parser.parse_args()
+
+    if options.seed_tree:
+        _seed_registry_here(Path(options.seed_tree), options.seed_size)
+        return
+
+    if options.run_tree:
+        results, notes = [], []
+        run_inprocess(Path(options.run_tree), options, results, notes)
+        print(RESULT_PREFIX + json.dumps({'results': results, 'notes': notes}))
+        sys.stdout.flush()
+        os._exit(0)  # 不等待 app 的后台线程和进程池
+
+    if options.compare:
+        base, head = (run_once(source, options) for source in options.compare)
+        print(format_report(base))
+        print()
+        print(format_report(head))
+        print()
+        text, regressions = compare(base, head, options.threshold)
+        print(text)
+        if options.output:
+            Path(options.output).write_text(json.dumps([base, head], indent=2))
+        sys.exit(1 if regressions else 0)
+
+    report = run_once('.', options)
+    print(format_report(report))
+    if options.output:
+        Path(options.output).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,66 @@
+"""Stress the confirmation number counter from many processes and threads
+
+用法: python benchmarks/stress_counter.py [进程数] [每进程线程数] [每线程分配次数]
+
+所有分配的号码必须唯一且连续，否则以非零状态退出。
+"""
+import sys
+import tempfile
+import threading
+import time
+from multiprocessing import Pool
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+from counters import DailyCounter  # noqa: E402
+
+DAY = '20260101'
+
+
+def worker(args):
+    db_path, threads, per_thread = args
+    counter = DailyCounter(db_path)
+    results = [[] for _ in range(threads)]
+
+    def run(bucket):
+        for _ in range(per_thread):
+            bucket.append(counter.next(DAY))
+
+    pool = [threading.Thread(target=run, args=(bucket,)) for bucket in results]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    return [n for bucket in results for n in bucket]
+
+
+def main():
+    processes = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    threads = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    per_thread = int(sys.argv[3]) if len(sys.argv) > 3 else 250
+    total = processes * threads * per_thread
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = str(Path(tmp) / 'counters.db')
+        DailyCounter(db_path).current(DAY)  # 先建表，避免计时包含初始化
+        start = time.perf_counter()
+        with Pool(processes) as pool:
+            chunks = pool.map(worker, [(db_path, threads, per_thread)] * processes)
+        elapsed = time.perf_counter() - start
+        final = DailyCounter(db_path).current(DAY)
+
+    numbers = [n for chunk in chunks for n in chunk]
+    unique = len(set(numbers))
+    print(f"{processes} processes x {threads} threads x {per_thread} = {total} allocations")
+    print(f"elapsed {elapsed:.2f}s, {total / elapsed:,.0f} allocations/s")
+    print(f"unique {unique}/{len(numbers)}, counter value {final}")
+    if unique != total or sorted(numbers) != list(range(1, total + 1)) or final != total:
+        print("FAILED: duplicate or missing confirmation numbers")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
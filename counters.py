@@ -0,0 +1,59 @@
+"""每日确认号计数器 - SQLite 实现
+
+原来的 daily_counters.json 每次都读取并重写整个文件，多个 gunicorn worker
+同时写入时会生成重复的确认号。这里每天只有一行，递增在 BEGIN IMMEDIATE
+事务中完成，SQLite 的写锁保证跨线程、跨进程的原子性，每次分配都是 O(1)。
+"""
+from datetime import datetime, timedelta
+
+from db import ThreadLocalConnection
+
+
+class DailyCounter:
+    """Atomic per-day counter shared by every thread and process using the same database"""
+
+    def __init__(self, db_path, keep_days=30, timeout=30.0):
+        self.keep_days = keep_days
+        self.db = ThreadLocalConnection(db_path, schema=[
+            'CREATE TABLE IF NOT EXISTS daily_counters ('
+            ' day TEXT PRIMARY KEY,'
+            ' value INTEGER NOT NULL)',
+        ], timeout=timeout)
+
+    def seed(self, counters):
+        """Import existing {day: value} counters, keeping whichever value is higher"""
+        with self.db.transaction() as conn:
+            conn.executemany(
+                'INSERT INTO daily_counters (day, value) VALUES (?, ?) '
+                'ON CONFLICT(day) DO UPDATE SET value = MAX(value, excluded.value)',
+                [(day, int(value)) for day, value in counters.items()],
+            )
+
+    def allocate(self, count=1, day=None):
+        """Reserve ``count`` consecutive numbers for ``day`` and return them as a range"""
+        if count < 1:
+            raise ValueError('count must be at least 1')
+        day = day or datetime.now().strftime('%Y%m%d')
+        with self.db.transaction() as conn:
+            row = conn.execute('SELECT value FROM daily_counters WHERE day = ?', (day,)).fetchone()
+            if row is None:
+                start = 1
+                conn.execute('INSERT INTO daily_counters (day, value) VALUES (?, ?)', (day, count))
+                # 新的一天：顺便清理过期的计数器
+                self._prune(conn, day)
+            else:
+                start = row[0] + 1
+                conn.execute('UPDATE daily_counters SET value = ? WHERE day = ?', (row[0] + count, day))
+        return range(start, start + count)
+
+    def next(self, day=None):
+        return self.allocate(1, day)[0]
+
+    def current(self, day=None):
+        day = day or datetime.now().strftime('%Y%m%d')
+        row = self.db.get().execute('SELECT value FROM daily_counters WHERE day = ?', (day,)).fetchone()
+        return row[0] if row else 0
+
+    def _prune(self, conn, today):
+        cutoff = datetime.strptime(today, '%Y%m%d') - timedelta(days=self.keep_days)
+        conn.execute('DELETE FROM daily_counters WHERE day < ?', (cutoff.strftime('%Y%m%d'),))
@@ -0,0 +1,56 @@
+"""SQLite 连接管理 - 计数器、文档登记等模块共用同一个数据库文件
+
+sqlite3 连接不能跨线程使用，fork 之后也不能在子进程里继续使用父进程的
+连接，所以每个线程、每个进程各自打开一个连接。
+"""
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+
+
+class ThreadLocalConnection:
+    """Per-thread, fork-safe SQLite connection with WAL enabled"""
+
+    def __init__(self, db_path, schema=(), timeout=30.0):
+        self.db_path = Path(db_path)
+        self.schema = list(schema)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._schema_ready = False
+
+    def get(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(str(self.db_path), timeout=self.timeout, isolation_level=None)
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        if not self._schema_ready:
+            for statement in self.schema:
+                # 字符串为 SQL 语句，函数为需要检查现有表结构的迁移
+                if callable(statement):
+                    statement(conn)
+                else:
+                    conn.execute(statement)
+            self._schema_ready = True
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        """BEGIN IMMEDIATE ... COMMIT, rolled back if the block raises"""
+        conn = self.get()
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # 其它连接修改过表结构（另一个模块第一次建表、迁移）时，在持有写锁后先
+            # 用一条简单语句重新加载；SQLite 3.40 在重新编译触发器写入 FTS5 表的
+            # 语句时会报 "no such table"
+            conn.execute('SELECT 1 FROM sqlite_master LIMIT 0')
+            yield conn
+        except BaseException:
+            conn.execute('ROLLBACK')
+            raise
+        conn.execute('COMMIT')
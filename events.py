@@ -0,0 +1,244 @@
+"""文档事件推送 - /documents/stream 的进程内发布 / 订阅
+
+管理页面原来每 30 秒拉取一次文档列表。现在登记表的触发器把每次增删写入
+document_events（所有 worker、批量生成和清理任务都经过同一个数据库），
+每个进程只有一个线程按 id 顺序读取新事件，每个事件只编码一次，再分发给
+本进程的所有订阅者，订阅者再多也只是多几次入队。
+
+订阅者分两种：Subscription 给在线程中阻塞等待的 WSGI 响应使用，
+AsyncSubscription 给 asgi.py 事件循环中的连接使用（响应体为
+AsyncEventStream）。订阅者的队列有上限，
+处理不过来（例如一次清理删除上千个文档）时改为发送一个 reset 事件并结束，
+客户端重新加载整个列表。
+"""
+import asyncio
+import json
+import logging
+import os
+import threading
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# 每次从数据库读取的事件数
+FETCH_SIZE = 500
+
+RESET_FRAME = b'event: reset\ndata: {}\n\n'
+KEEPALIVE_FRAME = b': keepalive\n\n'
+
+
+def sse_frame(event, data, event_id=None):
+    """One server-sent event, encoded"""
+    lines = [f'id: {event_id}'] if event_id is not None else []
+    lines.append(f'event: {event}')
+    lines.append(f'data: {json.dumps(data, ensure_ascii=False)}')
+    return ('\n'.join(lines) + '\n\n').encode('utf-8')
+
+
+class Subscription:
+    """Frames for one subscriber, consumed by a thread"""
+
+    def __init__(self, hub, max_queue):
+        self.hub = hub
+        self.max_queue = max_queue
+        self.closed = False
+        self._frames = deque()
+        self._condition = threading.Condition()
+
+    def push(self, frames):
+        with self._condition:
+            if self.closed:
+                return
+            if len(self._frames) + len(frames) > self.max_queue:
+                # 跟不上：丢掉排队的事件，让客户端重新加载
+                self._frames.clear()
+                self._frames.append(RESET_FRAME)
+                self.closed = True
+            else:
+                self._frames.extend(frames)
+            self._condition.notify()
+
+    def get(self, timeout):
+        """Queued frames, or an empty list after ``timeout`` seconds"""
+        with self._condition:
+            if not self._frames and not self.closed:
+                self._condition.wait(timeout)
+            frames = list(self._frames)
+            self._frames.clear()
+            return frames
+
+    def close(self):
+        self.hub.unsubscribe(self)
+        with self._condition:
+            self.closed = True
+            self._condition.notify()
+
+
+class AsyncSubscription(Subscription):
+    """Frames for one subscriber, consumed by a coroutine on ``loop``"""
+
+    def __init__(self, hub, max_queue, loop):
+        super().__init__(hub, max_queue)
+        self.loop = loop
+        self._ready = asyncio.Event()
+
+    def push(self, frames):
+        super().push(frames)
+        self.loop.call_soon_threadsafe(self._ready.set)
+
+    async def get_async(self, timeout):
+        try:
+            await asyncio.wait_for(self._ready.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._ready.clear()
+        return self.get(0)
+
+    def close(self):
+        super().close()
+        self.loop.call_soon_threadsafe(self._ready.set)
+
+
+class AsyncEventStream:
+    """Response body that asgi.py sends from the event loop instead of iterating it in a thread
+
+    Flask 路由返回这个响应体（direct_passthrough），请求仍然经过 CORS、
+    请求 id、访问日志和指标；asgi.py 识别它后在事件循环中逐块发送。
+    """
+
+    def __init__(self, subscription, keepalive_seconds, preamble=b''):
+        self.subscription = subscription
+        self.keepalive_seconds = keepalive_seconds
+        self._preamble = preamble
+
+    def __iter__(self):
+        raise TypeError('AsyncEventStream can only be sent by the ASGI server (asgi.py)')
+
+    async def next_chunk(self):
+        """The next bytes to send, or None when the stream has ended"""
+        if self._preamble:
+            chunk, self._preamble = self._preamble, b''
+            return chunk
+        if self.subscription.closed:
+            # 关闭前排队的事件（例如 reset）仍然发送
+            frames = self.subscription.get(0)
+            return b''.join(frames) if frames else None
+        frames = await self.subscription.get_async(self.keepalive_seconds)
+        return b''.join(frames) or KEEPALIVE_FRAME
+
+    def close(self):
+        self.subscription.close()
+
+
+class EventHub:
+    """Fan the registry's document events out to this process's subscribers
+
+    ``encode(event)`` 把 registry.events_after() 返回的事件编码成 SSE 字节，
+    返回 None 时跳过。读取线程在第一个订阅者出现时启动（fork 之后每个进程
+    各自启动），没有订阅者时不查询数据库。旧事件由登记表在写入时清理
+    （DocumentRegistry.event_log_size），与是否有订阅者无关。
+    """
+
+    def __init__(self, registry, encode, poll_interval=1.0, max_queue=1000):
+        self.registry = registry
+        self.encode = encode
+        self.poll_interval = poll_interval
+        self.max_queue = max_queue
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._position = None
+        self._thread = None
+        self._thread_pid = None
+        self.delivered = 0
+
+    @property
+    def subscriber_count(self):
+        return len(self._subscribers)
+
+    def position(self):
+        """Id of the newest event; a subscriber starting here misses nothing after it"""
+        return self.registry.event_range()[1]
+
+    def subscribe(self, last_event_id=None, initial=(), loop=None):
+        """New subscription receiving ``initial`` and then every event after ``last_event_id``
+
+        last_event_id 为 None 时从当前位置开始；比保留的最旧事件还早、或者
+        需要补发的事件超过队列上限时，订阅者收到 reset。
+        """
+        if loop is not None:
+            subscription = AsyncSubscription(self, self.max_queue, loop)
+        else:
+            subscription = Subscription(self, self.max_queue)
+        self._ensure_thread()
+        with self._lock:
+            if self._position is None:
+                self._position = self.position()
+            frames = list(initial)
+            if last_event_id is not None and last_event_id < self._position:
+                oldest, _ = self.registry.event_range()
+                missed = self.registry.events_after(last_event_id, self.max_queue + 1)
+                if last_event_id + 1 < oldest or len(missed) > self.max_queue:
+                    frames = [RESET_FRAME]
+                else:
+                    frames.extend(self._encode(event for event in missed
+                                               if event['event_id'] <= self._position))
+            if frames:
+                subscription.push(frames)
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+    def notify(self):
+        """Check for new events now instead of at the next poll"""
+        self._wake.set()
+
+    def _encode(self, events):
+        frames = []
+        for event in events:
+            frame = self.encode(event)
+            if frame is not None:
+                frames.append(frame)
+        return frames
+
+    def _ensure_thread(self):
+        with self._lock:
+            if self._thread is not None and self._thread_pid == os.getpid() and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, name='document-events', daemon=True)
+            self._thread_pid = os.getpid()
+            self._subscribers = set()
+            self._position = None
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.poll_interval)
+            self._wake.clear()
+            try:
+                self._poll()
+            except Exception as e:
+                logger.warning(f"读取文档事件失败: {e}")
+
+    def _poll(self):
+        while True:
+            with self._lock:
+                if not self._subscribers:
+                    # 没有订阅者时不跟踪位置，下一个订阅者从当时的最新事件开始
+                    self._position = None
+                    return
+                events = self.registry.events_after(self._position, FETCH_SIZE)
+                if not events:
+                    break
+                frames = self._encode(events)
+                self._position = events[-1]['event_id']
+                subscribers = list(self._subscribers)
+                if frames:
+                    for subscription in subscribers:
+                        subscription.push(frames)
+                    self.delivered += len(frames) * len(subscribers)
+            if len(events) < FETCH_SIZE:
+                break
@@ -0,0 +1,22 @@
+"""gunicorn 配置 - gunicorn 启动时自动读取工作目录中的这个文件
+
+preload_app 在主进程中调用一次 create_app()：导入模块、编译模板映射、解析
+模板和 PDF 版式都只做一次，fork 出的 worker 以写时复制的方式共享这些内存，
+worker 启动时不需要重复导入和编译。主进程不处理请求，后台线程（定时清理）
+在每个 worker 启动后由 post_worker_init 启动。
+"""
+import gc
+
+wsgi_app = 'app:create_app()'
+preload_app = True
+
+
+def when_ready(server):
+    # 预加载的对象不再被垃圾回收扫描；否则 worker 中的 GC 会修改这些对象的
+    # 引用计数页，触发写时复制，共享的内存逐渐变成每个 worker 一份
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    import app as visa_app
+    visa_app.start_background_tasks()
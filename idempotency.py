@@ -0,0 +1,123 @@
+"""幂等生成 - 重试同一个请求时返回之前生成的文档
+
+客户端网络中断后重试 /generate-document，每次重试都会消耗一个新的确认号
+并重新渲染。这里按 Idempotency-Key 请求头（或规范化后的请求内容的哈希）
+记录生成结果，在有效期内重复的请求直接返回之前的文档。同一个
+Idempotency-Key 用于内容不同的请求时拒绝，不返回别人的文档。
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+from db import ThreadLocalConnection
+
+# 参与哈希的请求字段
+PAYLOAD_FIELDS = ['guestName', 'email', 'company', 'arrivalDate', 'departureDate',
+                  'quantity', 'roomType', 'remark', 'purpose', 'templateId']
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS idempotency_keys ('
+    ' key TEXT PRIMARY KEY,'
+    ' status TEXT NOT NULL,'
+    ' document_id TEXT,'
+    ' job_id TEXT,'
+    ' created_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS idx_idempotency_created_at ON idempotency_keys (created_at)',
+]
+
+
+def _add_payload_column(conn):
+    """Schema step adding the request hash column to databases created before it existed"""
+    columns = [row[1] for row in conn.execute('PRAGMA table_info(idempotency_keys)')]
+    if 'payload' not in columns:
+        try:
+            conn.execute('ALTER TABLE idempotency_keys ADD COLUMN payload TEXT')
+        except sqlite3.OperationalError:
+            pass  # 另一个 worker 已经添加
+
+
+SCHEMA.append(_add_payload_column)
+
+
+def payload_key(data):
+    """Hash of the normalized booking fields"""
+    normalized = {}
+    for field in PAYLOAD_FIELDS:
+        value = data.get(field)
+        if isinstance(value, str):
+            value = ' '.join(value.split())
+            if field == 'email':
+                value = value.lower()
+        if value in (None, ''):
+            continue
+        normalized[field] = value
+    raw = json.dumps(normalized, sort_keys=True, ensure_ascii=False, separators=(',', ':'))
+    return 'payload:' + hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+
+class IdempotencyStore:
+    """Claims request keys so that retries within ``window_seconds`` reuse the first result"""
+
+    def __init__(self, db_path, window_seconds=900, pending_timeout=60):
+        self.db = ThreadLocalConnection(db_path, schema=SCHEMA)
+        self.window_seconds = window_seconds
+        # 处理中的请求超过这个时间仍未完成（进程崩溃等），允许重新生成
+        self.pending_timeout = pending_timeout
+        self._claims = 0
+
+    def claim(self, key, payload=None):
+        """Return ('new', None) if the caller should generate, else the earlier entry
+
+        已有记录时返回 (status, {'document_id', 'job_id', 'created_at'})；status 为
+        'pending' 表示同一个请求正在处理中，'conflict' 表示这个 key 已用于
+        payload（payload_key() 的结果）不同的请求。
+        """
+        now = time.time()
+        with self.db.transaction() as conn:
+            self._claims += 1
+            if self._claims % 100 == 1:
+                conn.execute('DELETE FROM idempotency_keys WHERE created_at < ?',
+                             (now - self.window_seconds,))
+            row = conn.execute(
+                'SELECT status, document_id, job_id, created_at, payload FROM idempotency_keys WHERE key = ?',
+                (key,)
+            ).fetchone()
+            if row is not None:
+                status, document_id, job_id, created_at, stored_payload = row
+                timeout = self.pending_timeout if status == 'pending' else self.window_seconds
+                if created_at >= now - timeout:
+                    if payload and stored_payload and payload != stored_payload:
+                        return 'conflict', None
+                    return status, {'document_id': document_id, 'job_id': job_id, 'created_at': created_at}
+            conn.execute(
+                'INSERT OR REPLACE INTO idempotency_keys (key, status, created_at, payload) '
+                "VALUES (?, 'pending', ?, ?)", (key, now, payload)
+            )
+        return 'new', None
+
+    def reclaim(self, key, entry, payload=None):
+        """Claim again a finished key whose result is gone; False if another request did first
+
+        ``entry`` 为 claim() 返回的记录。只有记录仍是这一条时才替换为处理中，
+        同时到达的两个重试只有一个会重新生成。
+        """
+        with self.db.transaction() as conn:
+            replaced = conn.execute(
+                "UPDATE idempotency_keys SET status = 'pending', document_id = NULL, job_id = NULL,"
+                " created_at = ?, payload = COALESCE(?, payload)"
+                " WHERE key = ? AND status = 'done' AND created_at = ?",
+                (time.time(), payload, key, entry['created_at'])
+            ).rowcount
+        return replaced == 1
+
+    def complete(self, key, document_id, job_id=None):
+        self.db.get().execute(
+            "UPDATE idempotency_keys SET status = 'done', document_id = ?, job_id = ? WHERE key = ?",
+            (document_id, job_id, key)
+        )
+
+    def release(self, key):
+        """Forget a claim whose request failed, so a retry can generate again"""
+        self.db.get().execute("DELETE FROM idempotency_keys WHERE key = ? AND status = 'pending'", (key,))
+
@@ -0,0 +1,164 @@
+"""异步文档生成任务队列
+
+请求线程只做校验和分配确认号，渲染交给本进程的线程池执行，立即返回 202
+和任务 id。任务状态写入共享的 SQLite 数据库，所以任何 worker 都能回答
+/jobs/<id> 的查询。排队的任务数达到上限时拒绝新任务（429 + Retry-After）。
+"""
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from db import ThreadLocalConnection
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS jobs ('
+    ' id TEXT PRIMARY KEY,'
+    ' status TEXT NOT NULL,'
+    ' document_id TEXT,'
+    ' result TEXT,'
+    ' error TEXT,'
+    ' pid INTEGER NOT NULL,'
+    ' created_at TEXT NOT NULL,'
+    ' updated_at TEXT NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS idx_jobs_created_at ON jobs (created_at)',
+]
+
+
+class QueueFull(Exception):
+    """Raised when the queue is at its pending-job limit"""
+
+    def __init__(self, retry_after):
+        super().__init__(f'Job queue is full, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+def _now():
+    return datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class JobQueue:
+    """In-process worker pool with job status persisted in SQLite"""
+
+    def __init__(self, db_path, max_workers=2, max_pending=50, keep_hours=24):
+        self.db = ThreadLocalConnection(db_path, schema=SCHEMA)
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.keep_hours = keep_hours
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._avg_seconds = 0.5
+        self._submitted = 0
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def _get_executor(self):
+        # fork 之后线程池不能继续使用，每个进程各自创建
+        if self._executor is None or self._executor_pid != os.getpid():
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers,
+                                                thread_name_prefix='document-job')
+            self._executor_pid = os.getpid()
+            self._pending = 0
+        return self._executor
+
+    def retry_after(self):
+        """Rough number of seconds until a queue slot frees up"""
+        return max(1, int(self._pending * self._avg_seconds / self.max_workers + 0.999))
+
+    def reserve(self):
+        """Claim a queue slot or raise QueueFull, before any work is done for the job"""
+        with self._lock:
+            self._get_executor()
+            if self._pending >= self.max_pending:
+                raise QueueFull(self.retry_after())
+            self._pending += 1
+
+    def release(self):
+        with self._lock:
+            self._pending = max(0, self._pending - 1)
+
+    def submit(self, fn, *args, document_id=None):
+        """Queue ``fn(*args)`` in a slot obtained from reserve(), return the job id
+
+        fn 的返回值（dict）会作为任务结果保存。
+        """
+        job_id = uuid.uuid4().hex
+        now = _now()
+        self.db.get().execute(
+            'INSERT INTO jobs (id, status, document_id, pid, created_at, updated_at) '
+            "VALUES (?, 'queued', ?, ?, ?, ?)",
+            (job_id, document_id, os.getpid(), now, now),
+        )
+        with self._lock:
+            executor = self._get_executor()
+            self._submitted += 1
+            prune = self._submitted % 100 == 1
+        # 任务在线程池中运行时沿用提交请求的上下文（日志中的 request_id）
+        executor.submit(contextvars.copy_context().run, self._run, job_id, fn, args)
+        if prune:
+            self._prune()
+        return job_id
+
+    def _update(self, job_id, status, result=None, error=None):
+        self.db.get().execute(
+            'UPDATE jobs SET status = ?, result = ?, error = ?, updated_at = ? WHERE id = ?',
+            (status, json.dumps(result) if result is not None else None, error, _now(), job_id),
+        )
+
+    def _run(self, job_id, fn, args):
+        started = time.perf_counter()
+        try:
+            self._update(job_id, 'running')
+            result = fn(*args)
+            self._update(job_id, 'done', result=result)
+        except Exception as e:
+            logger.exception(f"任务失败 {job_id}: {e}")
+            self._update(job_id, 'failed', error=str(e))
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                # 指数移动平均，用于估算 Retry-After
+                self._avg_seconds = self._avg_seconds * 0.8 + elapsed * 0.2
+            self.release()
+
+    def get(self, job_id):
+        row = self.db.get().execute(
+            'SELECT id, status, document_id, result, error, pid, created_at, updated_at '
+            'FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        job = dict(zip(['id', 'status', 'document_id', 'result', 'error', 'pid',
+                        'created_at', 'updated_at'], row))
+        job['result'] = json.loads(job['result']) if job['result'] else None
+        # 处理任务的进程已经退出（重启、崩溃），任务不会再完成
+        if job['status'] in ('queued', 'running') and not _pid_alive(job['pid']):
+            job['status'] = 'failed'
+            job['error'] = 'Worker process exited before the job finished'
+        del job['pid']
+        return job
+
+    def _prune(self):
+        cutoff = (datetime.now() - timedelta(hours=self.keep_hours)).strftime('%Y-%m-%d %H:%M:%S')
+        self.db.get().execute('DELETE FROM jobs WHERE created_at < ?', (cutoff,))
@@ -0,0 +1,209 @@
+"""日志配置 - 分级、JSON 输出、队列写出、个人信息脱敏、请求关联 id
+
+原来每个请求都把完整的请求数据、横幅和文件大小 print 到 stdout：同步写
+stdout 拖慢请求，日志里也满是客户的邮箱和姓名。这里统一使用 logging：
+
+- 日志记录放进有界队列，由后台线程写出，请求线程不等待 I/O；队列满时丢弃
+- LOG_FORMAT=json（默认）每条日志一行 JSON，text 为便于本地查看的文本格式
+- 默认隐去日志中的邮箱，姓名用 mask_name() / redact() 处理后再记录
+- 每条日志带上当前请求的 request_id（X-Request-ID）
+"""
+import atexit
+import copy
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import uuid
+from contextvars import ContextVar
+from datetime import datetime
+
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')
+LOG_REDACT_PII = os.environ.get('LOG_REDACT_PII', '1') == '1'
+# 等待写出的日志条数上限
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+
+# 当前请求的关联 id；不在请求中时为 '-'
+request_id_var = ContextVar('request_id', default='-')
+
+EMAIL_PATTERN = re.compile(r'([A-Za-z0-9._%+-])[A-Za-z0-9._%+-]*@([A-Za-z0-9.-]+\.[A-Za-z]{2,})')
+REQUEST_ID_PATTERN = re.compile(r'^[A-Za-z0-9._-]{1,64}$')
+
+# redact() 会隐去的字段（请求数据和文档记录中的写法）
+PII_FIELDS = {'email', 'guestName', 'guest_name'}
+# 内容为 JSON 字符串的字段（文档记录中的预订数据），解析后递归处理
+JSON_FIELDS = {'booking'}
+
+# LogRecord 自带的属性，其余属性（logger.info(..., extra={...})）作为 JSON 字段输出
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {'message', 'request_id'}
+
+
+def new_request_id(header=None):
+    """Use a well-formed incoming X-Request-ID, otherwise generate one"""
+    if header and REQUEST_ID_PATTERN.match(header):
+        return header
+    return uuid.uuid4().hex[:16]
+
+
+def mask_email(value):
+    return EMAIL_PATTERN.sub(r'\1***@\2', value)
+
+
+def mask_name(value):
+    """'Zhang San' -> 'Z*** S***'"""
+    if not LOG_REDACT_PII or not value:
+        return value
+    return ' '.join(part[0] + '***' for part in str(value).split())
+
+
+def redact(data):
+    """Copy of a booking or document dict that is safe to log
+
+    嵌套的字典和列表递归处理，其它字符串中的邮箱也会隐去。JSON_FIELDS 中的
+    字段解析后处理；无法解析时整个隐去。
+    """
+    if not LOG_REDACT_PII:
+        return data
+    if isinstance(data, list):
+        return [redact(item) for item in data]
+    if isinstance(data, str):
+        return mask_email(data) if '@' in data else data
+    if not isinstance(data, dict):
+        return data
+    safe = {}
+    for field, value in data.items():
+        if field in PII_FIELDS and isinstance(value, str):
+            safe[field] = mask_email(value) if 'email' in field else mask_name(value)
+        elif field in JSON_FIELDS and isinstance(value, str) and value:
+            try:
+                safe[field] = redact(json.loads(value))
+            except ValueError:
+                safe[field] = '***'
+        else:
+            safe[field] = redact(value)
+    return safe
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach request_id and scrub e-mail addresses, in the thread that logs"""
+
+    def filter(self, record):
+        record.request_id = request_id_var.get()
+        if LOG_REDACT_PII:
+            message = record.getMessage()
+            if '@' in message:
+                record.msg = mask_email(message)
+                record.args = None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', '-'),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and not key.startswith('_'):
+                entry[key] = value
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s [%(request_id)s] %(name)s: %(message)s')
+
+    def format(self, record):
+        if not hasattr(record, 'request_id'):
+            record.request_id = '-'
+        return super().format(record)
+
+
+class AsyncQueueHandler(logging.handlers.QueueHandler):
+    """Hand records to a background writer thread without blocking the caller
+
+    写出线程在 fork 之后不存在，所以每个进程在第一次记录日志时各自启动；
+    队列满时丢弃日志并计数，而不是让请求等待。
+    """
+
+    def __init__(self, target, maxsize=LOG_QUEUE_SIZE):
+        super().__init__(queue.Queue(maxsize))
+        self.target = target
+        self.maxsize = maxsize
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_listener(self):
+        if self._pid == os.getpid():
+            return
+        with self._start_lock:
+            if self._pid != os.getpid():
+                # 父进程的队列里可能有写出线程来不及处理的记录，子进程不再处理
+                self.queue = queue.Queue(self.maxsize)
+                self._listener = logging.handlers.QueueListener(self.queue, self.target)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def prepare(self, record):
+        # 在记录日志的线程里格式化消息和异常，写出线程只负责输出
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def emit(self, record):
+        self._ensure_listener()
+        super().emit(record)
+
+    def stop(self):
+        """Flush queued records; only the process that started the writer can do this"""
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()
+            self._listener = None
+            self._pid = None
+
+
+_handler = None
+
+
+def configure_logging(level=None, fmt=None, stream=None):
+    """Install the queue-backed handler on the root logger (once per process)"""
+    global _handler
+    if _handler is not None:
+        return _handler
+    target = logging.StreamHandler(stream or sys.stdout)
+    target.setFormatter(JsonFormatter() if (fmt or LOG_FORMAT) == 'json' else TextFormatter())
+    _handler = AsyncQueueHandler(target)
+    _handler.addFilter(RequestContextFilter())
+    root = logging.getLogger()
+    root.addHandler(_handler)
+    root.setLevel(level or LOG_LEVEL)
+    atexit.register(_handler.stop)
+    return _handler
@@ -0,0 +1,199 @@
+"""进程内指标 - 生成流程各阶段的耗时直方图和计数器，以 Prometheus 文本格式输出
+
+指标保存在当前进程内；gunicorn 多 worker 时每次抓取 /metrics 看到的是
+处理这次请求的 worker 的数据。
+
+慢请求分析：RequestProfiler 对每个请求运行 cProfile，超过阈值的请求把
+统计数据保存为 .prof 文件（python -m pstats 或 snakeviz 查看）。
+"""
+import bisect
+import cProfile
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+# 秒；覆盖从缓存命中的微秒级阶段到秒级的整份文档渲染
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025,
+                   0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f'{self.name} expects labels {self.labelnames}, got {tuple(labels)}')
+        return tuple(labels[name] for name in self.labelnames)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + [f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}'
+                                for key, value in values]
+
+
+class Gauge(_Metric):
+    """Value read from a callback at scrape time"""
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, fn):
+        super().__init__(name, documentation)
+        self.fn = fn
+
+    def render(self):
+        return self.header() + [f'{self.name} {_format_value(self.fn())}']
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                # 各桶的计数（最后一个为 +Inf）、总和、次数
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the duration of the ``with`` block, also when it raises"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self):
+        with self._lock:
+            values = sorted((key, (list(counts), total, count))
+                            for key, (counts, total, count) in self._values.items())
+        lines = self.header()
+        for key, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames, key, [('le', _format_value(bound))])
+                lines.append(f'{self.name}_bucket{labels} {cumulative}')
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f'{self.name}_sum{labels} {_format_value(total)}')
+            lines.append(f'{self.name}_count{labels} {count}')
+        return lines
+
+
+class MetricsRegistry:
+    """Collection of metrics rendered together in the Prometheus text format"""
+
+    CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+    def __init__(self):
+        self._metrics = []
+
+    def _register(self, metric):
+        if any(existing.name == metric.name for existing in self._metrics):
+            raise ValueError(f'Metric already registered: {metric.name}')
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def gauge(self, name, documentation, fn):
+        return self._register(Gauge(name, documentation, fn))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+class RequestProfiler:
+    """Run cProfile per request and keep the stats of requests slower than ``threshold_ms``
+
+    threshold_ms 为 0 时不启用，不产生任何开销。
+    """
+
+    def __init__(self, threshold_ms, output_dir):
+        self.threshold_ms = threshold_ms
+        self.output_dir = Path(output_dir)
+        self.dumped = 0
+
+    @property
+    def enabled(self):
+        return self.threshold_ms > 0
+
+    def start(self):
+        if not self.enabled:
+            return None
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # Python 3.12+ 同一时间只能有一个 profiler，其它线程正在分析时跳过
+            return None
+        return profiler
+
+    def finish(self, profiler, elapsed_seconds, name):
+        """Stop profiling; return the .prof path if the request was slow enough to keep"""
+        if profiler is None:
+            return None
+        profiler.disable()
+        if elapsed_seconds * 1000 < self.threshold_ms:
+            return None
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        safe_name = ''.join(c if c.isalnum() or c in '-_' else '_' for c in name)[:80]
+        path = self.output_dir / (f"{time.strftime('%Y%m%d%H%M%S')}_{int(elapsed_seconds * 1000)}ms_"
+                                  f"{safe_name}_{os.getpid()}.prof")
+        profiler.dump_stats(str(path))
+        self.dumped += 1
+        return path
@@ -0,0 +1,490 @@
+"""PDF 渲染 - 按 visa_booking_template.xlsx 的版式直接生成预订确认单 PDF
+
+不依赖 LibreOffice：启动时用 openpyxl 读取一次模板的列宽、行高、合并区域、
+边框、对齐和字号，把版式编译成 PDF 内容流。模板中固定的文字和边框压缩成
+一个静态内容流，每个请求只排版数据单元格和公式单元格，再把预先序列化好的
+PDF 对象和这一小段内容流拼接起来。
+
+字体使用 PDF 标准字体，不嵌入字体文件：拉丁字符用 Helvetica
+（WinAnsiEncoding），其它字符（中文、全角标点等）用 Adobe 标准 CID 字体
+STSong-Light，由阅读器提供字形。
+"""
+import ast
+import operator
+import re
+import unicodedata
+import zlib
+from datetime import date, datetime
+
+from storage import atomic_write
+from template_engine import _FileBackedCache
+
+# 纸张尺寸（点），按 openpyxl 的 paperSize 编号
+PAPER_SIZES = {1: (612, 792), 5: (612, 1008), 8: (842, 1191), 9: (595, 842), 11: (420, 595)}
+DEFAULT_PAPER = PAPER_SIZES[9]
+
+# 边框线宽（点）
+BORDER_WIDTHS = {'hair': 0.25, 'thin': 0.5, 'dotted': 0.5, 'dashed': 0.5, 'dashDot': 0.5,
+                 'dashDotDot': 0.5, 'slantDashDot': 1.0, 'medium': 1.0, 'mediumDashed': 1.0,
+                 'mediumDashDot': 1.0, 'mediumDashDotDot': 1.0, 'thick': 1.5, 'double': 1.5}
+
+# 单元格内文字与边框的间距（点）
+CELL_PADDING = 2
+LINE_SPACING = 1.2
+
+# Helvetica / Helvetica-Bold 字符宽度（1/1000 字号），字符 32..126
+_HELVETICA_WIDTHS = [
+    278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+    1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+    333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+    556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+]
+_HELVETICA_BOLD_WIDTHS = [
+    278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+    556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+    975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+    667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+    333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+    611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+]
+
+_FONT_OBJECTS = {
+    5: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>',
+    6: b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding /WinAnsiEncoding >>',
+    7: (b'<< /Type /Font /Subtype /Type0 /BaseFont /STSong-Light /Encoding /UniGB-UCS2-H '
+        b'/DescendantFonts [8 0 R] >>'),
+    8: (b'<< /Type /Font /Subtype /CIDFontType0 /BaseFont /STSong-Light '
+        b'/CIDSystemInfo << /Registry (Adobe) /Ordering (GB1) /Supplement 4 >> '
+        b'/FontDescriptor 9 0 R /DW 1000 >>'),
+    9: (b'<< /Type /FontDescriptor /FontName /STSong-Light /Flags 6 '
+        b'/FontBBox [-25 -254 1000 880] /ItalicAngle 0 /Ascent 880 /Descent -120 '
+        b'/CapHeight 880 /StemV 93 >>'),
+}
+_PDF_HEADER = b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'
+
+# 换行时的最小单位：连续空白、单个中日韩字符或全角字符、其它连续字符
+_TOKEN = re.compile(r'\s+|[\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef]|[^\s\u2e80-\u9fff\uf900-\ufaff\uff00-\uffef]+')
+_CELL_REF = re.compile(r'\$?([A-Z]{1,3})\$?([0-9]+)')
+_OPERATORS = {ast.Add: operator.add, ast.Sub: operator.sub, ast.Mult: operator.mul,
+              ast.Div: operator.truediv, ast.Pow: operator.pow}
+
+
+def _column_width_points(width):
+    """Excel column width (characters) -> points, for the default 7px digit width"""
+    pixels = int((256 * width + int(128 / 7)) / 256 * 7)
+    return pixels * 0.75
+
+
+def _color(color, default=(0, 0, 0)):
+    rgb = getattr(color, 'rgb', None) if getattr(color, 'type', None) == 'rgb' else None
+    if not isinstance(rgb, str) or len(rgb) not in (6, 8):
+        return default
+    rgb = rgb[-6:]
+    return tuple(int(rgb[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+def _is_latin(char):
+    try:
+        char.encode('cp1252')
+        return True
+    except UnicodeEncodeError:
+        return False
+
+
+def _char_width(char, bold):
+    """Advance width of one character in 1/1000 of the font size"""
+    if _is_latin(char):
+        table = _HELVETICA_BOLD_WIDTHS if bold else _HELVETICA_WIDTHS
+        code = ord(char)
+        if not 32 <= code <= 126:
+            # 带重音的字母按基本字母的宽度计算
+            code = ord(unicodedata.normalize('NFD', char)[0])
+        return table[code - 32] if 32 <= code <= 126 else 556
+    return 1000 if unicodedata.east_asian_width(char) in ('W', 'F') else 500
+
+
+def _text_width(text, size, bold):
+    return sum(_char_width(char, bold) for char in text) * size / 1000
+
+
+def _wrap(text, max_width, size, bold):
+    """Greedy line breaking at spaces; CJK characters can break anywhere"""
+    lines = []
+    for paragraph in str(text).split('\n'):
+        tokens = _TOKEN.findall(paragraph)
+        line, width = '', 0
+        for token in tokens:
+            token_width = _text_width(token, size, bold)
+            if line and not token.isspace() and width + token_width > max_width:
+                lines.append(line.rstrip())
+                line, width = '', 0
+            if not line and token.isspace():
+                continue
+            line += token
+            width += token_width
+        lines.append(line.rstrip())
+    return lines
+
+
+def _pdf_string(text):
+    """Text operators for one line, switching between Helvetica and STSong runs"""
+    runs = []
+    for char in text:
+        latin = _is_latin(char)
+        if runs and runs[-1][0] == latin:
+            runs[-1][1].append(char)
+        else:
+            runs.append((latin, [char]))
+    parts = []
+    for latin, chars in runs:
+        run = ''.join(chars)
+        if latin:
+            encoded = run.encode('cp1252')
+            encoded = encoded.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)')
+            parts.append((True, b'(' + encoded + b') Tj'))
+        else:
+            # UniGB-UCS2-H 只覆盖基本多文种平面，其它字符显示为问号
+            hex_text = ''.join(f'{ord(c):04X}' if ord(c) <= 0xFFFF else '003F' for c in run)
+            parts.append((False, b'<' + hex_text.encode('ascii') + b'> Tj'))
+    return parts
+
+
+def _format_value(value, number_format):
+    """Display text of a cell value under its Excel number format (common formats only)"""
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    fmt = (number_format or 'General').replace('\\', '').replace('"', '')
+    if isinstance(value, (datetime, date)):
+        pattern = fmt.lower()
+        for token, directive in (('yyyy', '%Y'), ('yy', '%y'), ('mm', '%m'), ('dd', '%d')):
+            pattern = pattern.replace(token, directive)
+        return value.strftime(pattern if '%' in pattern else '%Y-%m-%d')
+    if isinstance(value, (int, float)):
+        decimals = re.search(r'0\.(0+)', fmt)
+        places = len(decimals.group(1)) if decimals else 0
+        if '#,##0' in fmt:
+            return f'{value:,.{places}f}'
+        if fmt != 'General' and re.search(r'0', fmt):
+            return f'{value:.{places}f}'
+        if isinstance(value, float):
+            return str(int(value)) if value.is_integer() else f'{value:.10g}'
+        return str(value)
+    return str(value)
+
+
+def _evaluate(node):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in _OPERATORS:
+        return _OPERATORS[type(node.op)](_evaluate(node.left), _evaluate(node.right))
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.USub, ast.UAdd)):
+        value = _evaluate(node.operand)
+        return -value if isinstance(node.op, ast.USub) else value
+    raise ValueError('Unsupported formula')
+
+
+class PdfRenderer(_FileBackedCache):
+    """Render bookings to single-page PDFs laid out like the xlsx template
+
+    cells 为写入数据的单元格；模板中的其它单元格作为固定内容只排版一次。
+    公式单元格支持单元格引用和 + - * / ^ 运算，其它公式显示为空。
+    """
+
+    def __init__(self, template_path, cells, compress_level=6):
+        super().__init__(template_path)
+        self.cells = list(cells)
+        self.compress_level = compress_level
+
+    # -- 编译模板 ----------------------------------------------------------
+
+    def _build(self):
+        from openpyxl import load_workbook  # 导入很慢，只在编译版式时才需要
+
+        wb = load_workbook(str(self.template_path))
+        try:
+            return self._compile(wb.active)
+        finally:
+            wb.close()
+
+    def _compile(self, ws):
+        max_row, max_col = ws.max_row, ws.max_column
+        sheet_format = ws.sheet_format
+        default_width = _column_width_points(sheet_format.defaultColWidth or (sheet_format.baseColWidth or 8) + 5)
+        default_height = sheet_format.defaultRowHeight or 15
+
+        widths = [default_width] * (max_col + 1)
+        for dimension in ws.column_dimensions.values():
+            if not dimension.min:
+                continue
+            width = 0 if dimension.hidden else (
+                _column_width_points(dimension.width) if dimension.width else default_width)
+            for col in range(dimension.min, min(dimension.max or dimension.min, max_col) + 1):
+                widths[col] = width
+        heights = [default_height] * (max_row + 1)
+        for row, dimension in ws.row_dimensions.items():
+            if row <= max_row:
+                heights[row] = 0 if dimension.hidden else (
+                    dimension.height if dimension.height is not None else default_height)
+
+        col_x = [0.0] * (max_col + 2)
+        for col in range(1, max_col + 1):
+            col_x[col + 1] = col_x[col] + widths[col]
+        row_y = [0.0] * (max_row + 2)
+        for row in range(1, max_row + 1):
+            row_y[row + 1] = row_y[row] + heights[row]
+        sheet_width, sheet_height = col_x[max_col + 1], row_y[max_row + 1]
+
+        merges = {}
+        covered = {}
+        for merged in ws.merged_cells.ranges:
+            merges[(merged.min_row, merged.min_col)] = merged
+            for row in range(merged.min_row, merged.max_row + 1):
+                for col in range(merged.min_col, merged.max_col + 1):
+                    covered[(row, col)] = merged
+
+        def rect(row, col):
+            merged = merges.get((row, col))
+            last_row, last_col = (merged.max_row, merged.max_col) if merged else (row, col)
+            last_row, last_col = min(last_row, max_row), min(last_col, max_col)
+            return (col_x[col], row_y[row],
+                    col_x[last_col + 1] - col_x[col], row_y[last_row + 1] - row_y[row])
+
+        data_cells = set(self.cells)
+        fills, lines, static_text = [], {}, []
+        layouts, formulas, constants = {}, {}, {}
+        for (row, col), cell in sorted(ws._cells.items()):
+            if row > max_row or col > max_col:
+                continue
+            merged = covered.get((row, col))
+            anchor = merged is None or (merged.min_row, merged.min_col) == (row, col)
+
+            fill = cell.fill
+            if anchor and fill is not None and fill.fill_type == 'solid':
+                color = _color(fill.fgColor, default=None)
+                if color is not None and color != (1.0, 1.0, 1.0):
+                    fills.append((rect(row, col), color))
+
+            x0, y0 = col_x[col], row_y[row]
+            x1, y1 = col_x[col + 1], row_y[row + 1]
+            # 合并区域内部的边框不显示，只画区域外沿上的边
+            edges = (
+                ('left', merged is None or col == merged.min_col, (x0, y0, x0, y1)),
+                ('right', merged is None or col == merged.max_col, (x1, y0, x1, y1)),
+                ('top', merged is None or row == merged.min_row, (x0, y0, x1, y0)),
+                ('bottom', merged is None or row == merged.max_row, (x0, y1, x1, y1)),
+            )
+            for side_name, visible, line in edges:
+                side = getattr(cell.border, side_name, None)
+                if visible and side is not None and side.style and line[0:2] != line[2:4]:
+                    width = BORDER_WIDTHS.get(side.style, 0.5)
+                    key = tuple(round(v, 2) for v in line)
+                    if lines.get(key, (0,))[0] < width:
+                        lines[key] = (width, _color(side.color))
+
+            if not anchor:
+                continue
+            value = cell.value
+            is_formula = isinstance(value, str) and value.startswith('=')
+            if cell.coordinate in data_cells or is_formula:
+                layouts[cell.coordinate] = (rect(row, col), self._style(cell))
+                if is_formula:
+                    formulas[cell.coordinate] = value[1:]
+            elif value is not None:
+                constants[cell.coordinate] = value
+                text = _format_value(value, cell.number_format)
+                if text:
+                    static_text.append(self._text_ops(text, rect(row, col), self._style(cell),
+                                                      isinstance(value, (int, float))))
+
+        paper_width, paper_height = PAPER_SIZES.get(ws.page_setup.paperSize or 9, DEFAULT_PAPER)
+        if ws.page_setup.orientation == 'landscape':
+            paper_width, paper_height = paper_height, paper_width
+        margins = ws.page_margins
+        left, top = margins.left * 72, margins.top * 72
+        available_width = paper_width - left - margins.right * 72
+        available_height = paper_height - top - margins.bottom * 72
+        # 与 Excel 的“调整为一页”一致：版面放不下时整体缩小，不放大
+        scale = min(1.0, available_width / sheet_width, available_height / sheet_height)
+
+        ops = [f'q {scale:.4f} 0 0 {scale:.4f} {left:.2f} {paper_height - top - sheet_height * scale:.2f} cm'
+               .encode('ascii'),
+               # 以下坐标以工作表左上角为原点、向下为正
+               f'1 0 0 -1 0 {sheet_height:.2f} cm'.encode('ascii')]
+        for (x, y, w, h), (r, g, b) in fills:
+            ops.append(f'{r:.3f} {g:.3f} {b:.3f} rg {x:.2f} {y:.2f} {w:.2f} {h:.2f} re f'.encode('ascii'))
+        current = None
+        for (x0, y0, x1, y1), (width, color) in sorted(lines.items(), key=lambda item: item[1]):
+            if (width, color) != current:
+                ops.append(f'{width} w {color[0]:.3f} {color[1]:.3f} {color[2]:.3f} RG'.encode('ascii'))
+                current = (width, color)
+            ops.append(f'{x0:.2f} {y0:.2f} m {x1:.2f} {y1:.2f} l S'.encode('ascii'))
+        ops.extend(static_text)
+        ops.append(b'Q')
+        static_stream = zlib.compress(b'\n'.join(ops), self.compress_level)
+
+        objects = {
+            1: b'<< /Type /Catalog /Pages 2 0 R >>',
+            2: b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>',
+            3: (f'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {paper_width} {paper_height}] '
+                f'/Resources << /Font << /F1 5 0 R /F2 6 0 R /F3 7 0 R >> >> '
+                f'/Contents [4 0 R 10 0 R] >>').encode('ascii'),
+            4: (f'<< /Length {len(static_stream)} /Filter /FlateDecode >>\nstream\n'.encode('ascii')
+                + static_stream + b'\nendstream'),
+            **_FONT_OBJECTS,
+        }
+        prefix = bytearray(_PDF_HEADER)
+        offsets = []
+        for number in sorted(objects):
+            offsets.append(len(prefix))
+            prefix += f'{number} 0 obj\n'.encode('ascii') + objects[number] + b'\nendobj\n'
+        return {
+            'prefix': bytes(prefix),
+            'offsets': offsets,
+            'transform': (scale, left, paper_height - top - sheet_height * scale, sheet_height),
+            'layouts': layouts,
+            'formulas': formulas,
+            'constants': constants,
+        }
+
+    @staticmethod
+    def _style(cell):
+        font, alignment = cell.font, cell.alignment
+        return {
+            'size': float(font.sz or 11),
+            'bold': bool(font.b),
+            'color': _color(font.color),
+            'horizontal': alignment.horizontal or 'general',
+            'vertical': alignment.vertical or 'bottom',
+            'wrap': bool(alignment.wrap_text),
+            'number_format': cell.number_format,
+        }
+
+    @staticmethod
+    def _text_ops(text, cell_rect, style, numeric=False):
+        """Content stream operators drawing ``text`` inside a cell rectangle"""
+        x, y, w, h = cell_rect
+        size, bold = style['size'], style['bold']
+        inner_width = max(w - 2 * CELL_PADDING, 0)
+        if style['wrap']:
+            # 换行后超出单元格高度时逐步缩小字号（最小约为原字号的 65%）
+            for _ in range(5):
+                lines = _wrap(text, inner_width, size, bold)
+                if len(lines) == 1 or len(lines) * size * LINE_SPACING <= h:
+                    break
+                size *= 0.9
+        else:
+            lines = str(text).split('\n')
+        line_height = size * LINE_SPACING
+        block_height = line_height * len(lines)
+        vertical = style['vertical']
+        if vertical == 'top':
+            top = y + 1
+        elif vertical in ('center', 'justify', 'distributed'):
+            top = y + (h - block_height) / 2
+        else:
+            top = y + h - block_height - 1
+        horizontal = style['horizontal']
+        if horizontal == 'general':
+            horizontal = 'right' if numeric else 'left'
+        elif horizontal == 'centerContinuous':
+            horizontal = 'center'
+
+        font = b'/F2' if bold else b'/F1'
+        ops = [b'q']
+        if style['wrap']:
+            # 自动换行的文字不超出单元格
+            ops.append(f'{x:.2f} {y:.2f} {w:.2f} {h:.2f} re W n'.encode('ascii'))
+        r, g, b = style['color']
+        ops.append(f'BT {r:.3f} {g:.3f} {b:.3f} rg'.encode('ascii'))
+        for index, line in enumerate(lines):
+            if not line:
+                continue
+            line_width = _text_width(line, size, bold)
+            if horizontal == 'center':
+                left = x + (w - line_width) / 2
+            elif horizontal == 'right':
+                left = x + w - CELL_PADDING - line_width
+            else:
+                left = x + CELL_PADDING
+            baseline = top + index * line_height + size * 0.95
+            # 内容流的坐标系 y 轴向下，文字矩阵再翻转一次
+            ops.append(f'1 0 0 -1 {left:.2f} {baseline:.2f} Tm'.encode('ascii'))
+            for latin, operation in _pdf_string(line):
+                ops.append((font if latin else b'/F3') + f' {size:g} Tf '.encode('ascii') + operation)
+        ops.append(b'ET Q')
+        return b'\n'.join(ops)
+
+    # -- 渲染 ----------------------------------------------------------------
+
+    def _cell_value(self, compiled, values, addr, depth=0):
+        if depth > 20:
+            raise ValueError('Formula nesting too deep')
+        if addr in compiled['formulas']:
+            return self._formula_value(compiled, values, addr, depth + 1)
+        value = values.get(addr) if addr in self.cells else compiled['constants'].get(addr)
+        if value in (None, ''):
+            return 0
+        if isinstance(value, bool):
+            return int(value)
+        if isinstance(value, (int, float)):
+            return value
+        return float(value)  # 非数字文本参与运算时报错，公式显示为空
+
+    def _formula_value(self, compiled, values, addr, depth=0):
+        expression = _CELL_REF.sub(
+            lambda m: f'({self._cell_value(compiled, values, m.group(1) + m.group(2), depth)!r})',
+            compiled['formulas'][addr])
+        return _evaluate(ast.parse(expression, mode='eval'))
+
+    def render_content(self, values):
+        """Uncompressed content stream for the data and formula cells"""
+        compiled = self._ensure_loaded()
+        scale, left, bottom, sheet_height = compiled['transform']
+        ops = [f'q {scale:.4f} 0 0 {scale:.4f} {left:.2f} {bottom:.2f} cm 1 0 0 -1 0 {sheet_height:.2f} cm'
+               .encode('ascii')]
+        for addr, (cell_rect, style) in compiled['layouts'].items():
+            if addr in compiled['formulas']:
+                try:
+                    value = self._formula_value(compiled, values, addr)
+                except (ValueError, TypeError, ZeroDivisionError, OverflowError, SyntaxError):
+                    value = None
+            else:
+                value = values.get(addr)
+            text = _format_value(value, style['number_format'])
+            if text:
+                ops.append(self._text_ops(text, cell_rect, style, isinstance(value, (int, float))))
+        ops.append(b'Q')
+        return b'\n'.join(ops)
+
+    def render_bytes(self, values, title=None):
+        compiled = self._ensure_loaded()
+        content = zlib.compress(self.render_content(values), self.compress_level)
+        info = f'/Producer (Visa Booking System) /CreationDate (D:{datetime.now():%Y%m%d%H%M%S})'
+        if title:
+            info += f' /Title <FEFF{str(title).encode("utf-16-be").hex().upper()}>'
+        tail_objects = [
+            f'<< /Length {len(content)} /Filter /FlateDecode >>\nstream\n'.encode('ascii')
+            + content + b'\nendstream',
+            f'<< {info} >>'.encode('ascii'),
+        ]
+        output = bytearray(compiled['prefix'])
+        offsets = list(compiled['offsets'])
+        for number, body in zip((10, 11), tail_objects):
+            offsets.append(len(output))
+            output += f'{number} 0 obj\n'.encode('ascii') + body + b'\nendobj\n'
+        xref_offset = len(output)
+        output += f'xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n'.encode('ascii')
+        output += b''.join(f'{offset:010d} 00000 n \n'.encode('ascii') for offset in offsets)
+        output += (f'trailer\n<< /Size {len(offsets) + 1} /Root 1 0 R /Info 11 0 R >>\n'
+                   f'startxref\n{xref_offset}\n%%EOF\n').encode('ascii')
+        return bytes(output)
+
+    def render_to_file(self, filepath, values, title=None):
+        """Write the PDF atomically so concurrent readers never see a partial file"""
+        return atomic_write(filepath, self.render_bytes(values, title))
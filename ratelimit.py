@@ -0,0 +1,132 @@
+"""生成请求限流 - 按 IP、邮箱、公司的令牌桶
+
+每次 /generate-document 都会消耗一个确认号、渲染一个 xlsx 并占用磁盘，
+接口又允许任何来源跨域调用，一个脚本就能占满所有 worker。这里给每个
+IP、邮箱和公司各一个令牌桶：桶的容量为允许的突发请求数，按配额匀速补充。
+
+桶保存在共享的 SQLite 数据库中（与确认号计数器相同），所有 gunicorn worker
+看到同一个桶。一次检查在一个 BEGIN IMMEDIATE 事务中按主键读取并更新最多
+三行，与请求数和桶的数量无关。只有所有桶都有令牌时才扣除，被拒绝的请求
+不消耗任何桶。
+
+批量生成一次消耗多个令牌（每个文档一个）。消耗超过桶容量的请求等多久都
+不会通过，直接抛出 QuotaExceeded，调用方应拆成较小的批量；桶不会透支。
+"""
+import math
+import time
+
+from db import ThreadLocalConnection
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS rate_buckets ('
+    ' key TEXT PRIMARY KEY,'
+    ' tokens REAL NOT NULL,'
+    ' updated_at REAL NOT NULL)',
+    'CREATE INDEX IF NOT EXISTS idx_rate_buckets_updated_at ON rate_buckets (updated_at)',
+]
+
+
+def parse_quota(value):
+    """'30/60' -> (30, 60.0): bursts of up to 30 requests, refilled at 30 per 60 seconds
+
+    空字符串或 0 表示不限制，返回 None。
+    """
+    value = (value or '').strip()
+    if value in ('', '0'):
+        return None
+    try:
+        capacity, period = value.split('/', 1)
+        capacity, period = int(capacity), float(period)
+    except ValueError:
+        raise ValueError(f'Invalid rate limit quota: {value} (expected <requests>/<seconds>)')
+    if capacity < 1 or period <= 0:
+        raise ValueError(f'Invalid rate limit quota: {value} (expected <requests>/<seconds>)')
+    return capacity, period
+
+
+class RateLimited(Exception):
+    """Raised when a bucket has too few tokens for the request"""
+
+    def __init__(self, scope, retry_after):
+        super().__init__(f'Rate limit exceeded for {scope}, retry after {retry_after}s')
+        self.scope = scope
+        self.retry_after = retry_after
+
+
+class QuotaExceeded(RateLimited):
+    """Raised when one request needs more tokens than the bucket can ever hold"""
+
+    def __init__(self, scope, cost, capacity):
+        super().__init__(scope, None)
+        self.args = (f'Request needs {cost} tokens of the {scope} quota, which allows at most {capacity}',)
+        self.cost = cost
+        self.capacity = capacity
+
+
+class RateLimiter:
+    """Token buckets per scope value, shared by every process using the same database
+
+    ``quotas`` 为 {scope: (容量, 秒数)}，值为 None 的 scope 不限制。
+    """
+
+    def __init__(self, db_path, quotas, timeout=30.0):
+        self.quotas = {scope: quota for scope, quota in quotas.items() if quota is not None}
+        self.db = ThreadLocalConnection(db_path, schema=SCHEMA, timeout=timeout)
+        self._checks = 0
+
+    @property
+    def enabled(self):
+        return bool(self.quotas)
+
+    def check(self, values, cost=1, now=None):
+        """Take ``cost`` tokens from the bucket of every {scope: value}; raises RateLimited
+
+        没有配额的 scope 和空值忽略。桶不存在时视为满的。
+        """
+        self.check_many({(scope, value): cost for scope, value in values.items()}, now=now)
+
+    def check_many(self, costs, now=None):
+        """Take tokens from several buckets at once: {(scope, value): cost}; raises RateLimited
+
+        规范化后相同的值合并计算。任何一个桶不够时都不扣除；消耗超过某个桶的
+        容量时抛出 QuotaExceeded。
+        """
+        merged = {}
+        for (scope, value), cost in costs.items():
+            value = ' '.join(str(value or '').split()).lower()
+            if scope in self.quotas and value and cost > 0:
+                key = f'{scope}:{value}'
+                merged[key] = (scope, merged.get(key, (scope, 0))[1] + cost)
+        if not merged:
+            return
+        buckets = [(scope, key, cost, self.quotas[scope]) for key, (scope, cost) in merged.items()]
+        for scope, key, cost, (capacity, period) in buckets:
+            if cost > capacity:
+                raise QuotaExceeded(scope, cost, capacity)
+        now = time.time() if now is None else now
+        with self.db.transaction() as conn:
+            self._checks += 1
+            if self._checks % 1000 == 1:
+                # 一个周期没有更新的桶已经补满，与不存在的桶等价，可以删除
+                for scope, (capacity, period) in self.quotas.items():
+                    conn.execute(
+                        'DELETE FROM rate_buckets WHERE key >= ? AND key < ? AND updated_at < ?',
+                        (f'{scope}:', f'{scope};', now - period))
+            updates = []
+            limited = None
+            for scope, key, cost, (capacity, period) in buckets:
+                rate = capacity / period
+                row = conn.execute('SELECT tokens, updated_at FROM rate_buckets WHERE key = ?', (key,)).fetchone()
+                tokens = capacity if row is None else min(capacity, row[0] + max(0.0, now - row[1]) * rate)
+                if tokens < cost:
+                    wait = math.ceil((cost - tokens) / rate)
+                    if limited is None or wait > limited[1]:
+                        limited = (scope, wait)
+                updates.append((key, tokens - cost, now))
+            if limited is not None:
+                raise RateLimited(*limited)
+            conn.executemany(
+                'INSERT INTO rate_buckets (key, tokens, updated_at) VALUES (?, ?, ?) '
+                'ON CONFLICT(key) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at',
+                updates,
+            )
@@ -0,0 +1,551 @@
+"""已生成文档的登记表 - SQLite 持久化，按 id 直接查找
+
+原来的 documents_store 是每个进程自己的列表：按 id 查找要线性扫描，重启
+后数据丢失，不同 gunicorn worker 看到的文档也不一样。这里把文档信息写入
+共享的 SQLite 数据库（id 为主键，company / email / generated_date 建索引），
+并在进程内用一个 LRU 缓存加速重复查找。
+"""
+import base64
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from pathlib import Path
+
+from db import ThreadLocalConnection
+from search import SCHEMA as SEARCH_SCHEMA, create_search_index, document_terms, index_terms, prune_terms
+
+# 文档表的列，顺序与 INSERT 语句一致
+COLUMNS = ['id', 'filename', 'company', 'email', 'guest_name', 'arrival_date',
+           'departure_date', 'nights', 'total_amount', 'generated_date', 'filepath', 'purpose',
+           'size', 'booking']
+# 文档信息中缺少某列时写入的值
+COLUMN_DEFAULTS = {'nights': 0, 'total_amount': 0, 'size': 0, 'booking': ''}
+
+# 可以排序的列；seq 为写入顺序，同时作为所有排序的第二排序键
+SORTABLE_COLUMNS = {'seq', 'id', 'company', 'email', 'guest_name', 'arrival_date',
+                    'departure_date', 'nights', 'total_amount', 'generated_date'}
+
+def _column_migration(name, definition):
+    """Schema step adding a column to databases created before it existed"""
+    def add_column(conn):
+        columns = [row[1] for row in conn.execute('PRAGMA table_info(documents)')]
+        if name not in columns:
+            try:
+                conn.execute(f'ALTER TABLE documents ADD COLUMN {name} {definition}')
+            except sqlite3.OperationalError:
+                pass  # 另一个 worker 已经添加
+    return add_column
+
+
+# 报表汇总表（见 reports.py）：表名 -> (分组列及其取值表达式, 累加的列)。
+# {row} 为文档行：触发器中的 NEW / OLD，或者回填时的 documents
+ROLLUPS = {
+    'report_day_totals': ({'day': 'substr({row}.generated_date, 1, 10)'}, ['nights', 'total_amount']),
+    'report_month_totals': ({'month': 'substr({row}.generated_date, 1, 7)'}, ['nights', 'total_amount']),
+    'report_companies': ({'company': '{row}.company'}, ['nights', 'total_amount']),
+    'report_daily': ({'day': 'substr({row}.generated_date, 1, 10)', 'company': '{row}.company'},
+                     ['nights', 'total_amount']),
+    'report_monthly': ({'month': 'substr({row}.generated_date, 1, 7)', 'company': '{row}.company'},
+                       ['nights', 'total_amount']),
+    'report_guests': ({'email': '{row}.email', 'guest_name': '{row}.guest_name'},
+                      ['nights', 'total_amount']),
+    'report_arrivals': ({'arrival_date': '{row}.arrival_date'}, ['nights', 'total_amount']),
+}
+# 汇总表上的额外索引，用于按公司过滤和取排名前几位
+ROLLUP_INDEXES = [
+    'CREATE INDEX IF NOT EXISTS idx_report_companies_documents ON report_companies (documents)',
+    'CREATE INDEX IF NOT EXISTS idx_report_companies_nights ON report_companies (nights)',
+    'CREATE INDEX IF NOT EXISTS idx_report_companies_total_amount ON report_companies (total_amount)',
+    'CREATE INDEX IF NOT EXISTS idx_report_daily_company ON report_daily (company, day)',
+    'CREATE INDEX IF NOT EXISTS idx_report_monthly_company ON report_monthly (company, month)',
+    'CREATE INDEX IF NOT EXISTS idx_report_guests_total_amount ON report_guests (total_amount)',
+    'CREATE INDEX IF NOT EXISTS idx_report_guests_documents ON report_guests (documents)',
+]
+
+
+def _rollup_statements(table, keys, values):
+    """Table, backfill and triggers adding every document written to ``table``
+
+    汇总表只增不减：清理任务删除过期文档后，报表仍然包含它们。只有
+    INSERT OR REPLACE 替换同一个确认号时才减去旧记录，避免重复计算。
+    """
+    key_columns = list(keys)
+    totals = ['documents'] + values
+
+    def key_values(row):
+        return ', '.join(keys[column].format(row=row) for column in key_columns)
+
+    def subtract(old):
+        # 减去一个文档，计数为 0 的分组直接删除；old(表达式) 为被替换文档的值
+        where = ' AND '.join(f'{column} = {old(keys[column])}' for column in key_columns)
+        changes = ', '.join(['documents = documents - 1'] +
+                            [f'{column} = {column} - {old("{row}." + column)}' for column in values])
+        return (f'UPDATE {table} SET {changes} WHERE {where};'
+                f' DELETE FROM {table} WHERE {where} AND documents <= 0;')
+
+    additions = ', '.join(['documents = documents + 1'] +
+                          [f'{column} = {column} + excluded.{column}' for column in values])
+    return [
+        f"CREATE TABLE IF NOT EXISTS {table} ("
+        + ''.join(f' {column} TEXT NOT NULL,' for column in key_columns)
+        + ''.join(f' {column} INTEGER NOT NULL DEFAULT 0,' for column in totals)
+        + f" PRIMARY KEY ({', '.join(key_columns)}))",
+        f"INSERT INTO {table} ({', '.join(key_columns + totals)})"
+        f" SELECT {key_values('documents')}, COUNT(*), "
+        + ', '.join(f'SUM({column})' for column in values)
+        + f" FROM documents GROUP BY {key_values('documents')}",
+        f'CREATE TRIGGER IF NOT EXISTS {table}_insert AFTER INSERT ON documents BEGIN'
+        f" INSERT INTO {table} ({', '.join(key_columns + totals)})"
+        f" VALUES ({key_values('NEW')}, 1, {', '.join('NEW.' + column for column in values)})"
+        f" ON CONFLICT ({', '.join(key_columns)}) DO UPDATE SET {additions}; END",
+        # INSERT OR REPLACE 不触发 DELETE 触发器，插入前先减去被替换的记录
+        f'CREATE TRIGGER IF NOT EXISTS {table}_replace BEFORE INSERT ON documents'
+        f' WHEN EXISTS (SELECT 1 FROM documents WHERE id = NEW.id) BEGIN'
+        f" {subtract(lambda expression: '(SELECT ' + expression.format(row='documents') + ' FROM documents WHERE id = NEW.id)')} END",
+    ]
+
+
+def _create_rollups(conn):
+    """Create the report rollup tables once, filled from the existing documents
+
+    建表、回填和创建触发器在同一个事务中完成，其它 worker 同时写入的文档
+    不会重复计算或遗漏。
+    """
+    done = "SELECT 1 FROM registry_meta WHERE key = 'report_rollups'"
+    if conn.execute(done).fetchone():
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if not conn.execute(done).fetchone():
+            for table, (keys, values) in ROLLUPS.items():
+                for statement in _rollup_statements(table, keys, values):
+                    conn.execute(statement)
+            for statement in ROLLUP_INDEXES:
+                conn.execute(statement)
+            conn.execute("INSERT INTO registry_meta (key, value) VALUES ('report_rollups', 1)")
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS documents ('
+    ' seq INTEGER PRIMARY KEY AUTOINCREMENT,'
+    ' id TEXT NOT NULL UNIQUE,'
+    ' filename TEXT NOT NULL,'
+    ' company TEXT NOT NULL,'
+    ' email TEXT NOT NULL,'
+    ' guest_name TEXT NOT NULL,'
+    ' arrival_date TEXT NOT NULL,'
+    ' departure_date TEXT NOT NULL,'
+    ' nights INTEGER NOT NULL,'
+    ' total_amount INTEGER NOT NULL,'
+    ' generated_date TEXT NOT NULL,'
+    ' filepath TEXT NOT NULL,'
+    ' purpose TEXT NOT NULL,'
+    ' size INTEGER NOT NULL DEFAULT 0,'
+    # 生成文档时的预订数据（JSON），文件丢失时用来重新生成；旧记录为空
+    " booking TEXT NOT NULL DEFAULT '')",
+    _column_migration('size', 'INTEGER NOT NULL DEFAULT 0'),
+    _column_migration('booking', "TEXT NOT NULL DEFAULT ''"),
+    'CREATE INDEX IF NOT EXISTS idx_documents_company ON documents (company)',
+    'CREATE INDEX IF NOT EXISTS idx_documents_email ON documents (email)',
+    'CREATE INDEX IF NOT EXISTS idx_documents_generated_date ON documents (generated_date)',
+    'CREATE INDEX IF NOT EXISTS idx_documents_guest_name ON documents (guest_name)',
+    # 每次增删文档时递增的版本号，用于 ETag，不需要扫描文档表
+    'CREATE TABLE IF NOT EXISTS registry_meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL)',
+    "INSERT OR IGNORE INTO registry_meta (key, value) VALUES ('version', 0)",
+    'CREATE TRIGGER IF NOT EXISTS documents_version_insert AFTER INSERT ON documents BEGIN'
+    " UPDATE registry_meta SET value = value + 1 WHERE key = 'version'; END",
+    'CREATE TRIGGER IF NOT EXISTS documents_version_delete AFTER DELETE ON documents BEGIN'
+    " UPDATE registry_meta SET value = value + 1 WHERE key = 'version'; END",
+    # 删除或替换文档时递增，各进程据此清空自己的 LRU 缓存（新增文档不影响已缓存的记录）
+    "INSERT OR IGNORE INTO registry_meta (key, value) VALUES ('removals', 0)",
+    'CREATE TRIGGER IF NOT EXISTS documents_removals_delete AFTER DELETE ON documents BEGIN'
+    " UPDATE registry_meta SET value = value + 1 WHERE key = 'removals'; END",
+    'CREATE TRIGGER IF NOT EXISTS documents_removals_replace BEFORE INSERT ON documents'
+    ' WHEN EXISTS (SELECT 1 FROM documents WHERE id = NEW.id) BEGIN'
+    " UPDATE registry_meta SET value = value + 1 WHERE key = 'removals'; END",
+    # 文档数和文件总大小随增删维护，/debug 不需要扫描文档表或生成文件夹。
+    # INSERT OR REPLACE 替换旧记录时不触发 DELETE 触发器，所以插入前先减去旧记录。
+    "INSERT OR IGNORE INTO registry_meta (key, value) SELECT 'document_count', COUNT(*) FROM documents",
+    "INSERT OR IGNORE INTO registry_meta (key, value) SELECT 'document_bytes', COALESCE(SUM(size), 0) FROM documents",
+    'CREATE TRIGGER IF NOT EXISTS documents_stats_replace BEFORE INSERT ON documents BEGIN'
+    " UPDATE registry_meta SET value = value - (SELECT COUNT(*) FROM documents WHERE id = NEW.id)"
+    " WHERE key = 'document_count';"
+    " UPDATE registry_meta SET value = value - COALESCE((SELECT size FROM documents WHERE id = NEW.id), 0)"
+    " WHERE key = 'document_bytes'; END",
+    'CREATE TRIGGER IF NOT EXISTS documents_stats_insert AFTER INSERT ON documents BEGIN'
+    " UPDATE registry_meta SET value = value + 1 WHERE key = 'document_count';"
+    " UPDATE registry_meta SET value = value + NEW.size WHERE key = 'document_bytes'; END",
+    'CREATE TRIGGER IF NOT EXISTS documents_stats_delete AFTER DELETE ON documents BEGIN'
+    " UPDATE registry_meta SET value = value - 1 WHERE key = 'document_count';"
+    " UPDATE registry_meta SET value = value - OLD.size WHERE key = 'document_bytes'; END",
+    # 文档增删记录，按 id 顺序推送给 /documents/stream 的订阅者（见 events.py）。
+    # 所有 worker 和清理任务的写入都经过触发器，不会漏掉
+    'CREATE TABLE IF NOT EXISTS document_events ('
+    ' id INTEGER PRIMARY KEY AUTOINCREMENT,'
+    ' kind TEXT NOT NULL,'
+    ' document_id TEXT NOT NULL)',
+    'CREATE TRIGGER IF NOT EXISTS documents_event_insert AFTER INSERT ON documents BEGIN'
+    " INSERT INTO document_events (kind, document_id) VALUES ('added', NEW.id); END",
+    'CREATE TRIGGER IF NOT EXISTS documents_event_delete AFTER DELETE ON documents BEGIN'
+    " INSERT INTO document_events (kind, document_id) VALUES ('removed', OLD.id); END",
+    _create_rollups,
+    # 之前创建的数据库中删除文档时会减去汇总的触发器
+    *[f'DROP TRIGGER IF EXISTS {table}_delete' for table in ROLLUPS],
+    # 全文索引（见 search.py）
+    *SEARCH_SCHEMA,
+    create_search_index,
+]
+
+# 每多少次写入（add / add_many / remove / remove_many）清理一次旧事件
+EVENT_PRUNE_WRITES = 100
+
+# get() 最多每隔多少秒读一次 removals 计数；期间命中缓存不访问数据库
+CACHE_CHECK_SECONDS = 1.0
+
+FILENAME_PATTERN = re.compile(r'^Visa_Booking_(\d+)_(.*)\.xlsx$')
+
+
+def _row_values(doc):
+    return [doc.get(column, COLUMN_DEFAULTS.get(column, '')) for column in COLUMNS]
+
+
+def _row_to_document(row, columns=COLUMNS):
+    doc = dict(zip(columns, row))
+    doc['download_url'] = f"/download/{doc['id']}"
+    doc['pdf_url'] = f"/download/{doc['id']}.pdf"
+    doc['print_url'] = f"/print/{doc['id']}"
+    return doc
+
+
+def encode_cursor(sort_value, seq):
+    """Opaque pagination cursor pointing just after (sort_value, seq)"""
+    raw = json.dumps([sort_value, seq], separators=(',', ':')).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        sort_value, seq = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except Exception:
+        raise ValueError('Invalid cursor')
+    return sort_value, int(seq)
+
+
+class DocumentRegistry:
+    """Persistent document index shared by all workers, with an in-process LRU cache
+
+    其它 worker 或清理任务删除、替换文档后，缓存最多 cache_check_seconds 秒后
+    整体清空（按 registry_meta 中的 removals 计数判断）。这段时间内 get() 可能
+    返回刚被删除的文档，下载路径用 exists() 再确认。
+    """
+
+    def __init__(self, db_path, cache_size=1024, event_log_size=10000,
+                 cache_check_seconds=CACHE_CHECK_SECONDS):
+        self.db = ThreadLocalConnection(db_path, schema=SCHEMA)
+        self.cache_size = cache_size
+        self.cache_check_seconds = cache_check_seconds
+        # document_events 保留的事件数；每 EVENT_PRUNE_WRITES 次写入清理一次
+        self.event_log_size = event_log_size
+        self._writes = 0
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_removals = None
+        self._cache_checked = None
+
+    def _after_write(self):
+        """Keep the event log bounded whether or not anyone is subscribed to it"""
+        self._writes += 1
+        if self._writes % EVENT_PRUNE_WRITES == 1:
+            self.prune_events(self.event_log_size)
+
+    def _cache_validate(self):
+        """Drop the cache when any process has removed or replaced a document since it was filled"""
+        now = time.monotonic()
+        checked = self._cache_checked
+        if checked is not None and now - checked < self.cache_check_seconds:
+            return
+        self._cache_checked = now
+        removals = self.db.get().execute(
+            "SELECT value FROM registry_meta WHERE key = 'removals'").fetchone()[0]
+        with self._cache_lock:
+            if removals != self._cache_removals:
+                self._cache.clear()
+                self._cache_removals = removals
+
+    def _cache_put(self, doc):
+        with self._cache_lock:
+            self._cache[doc['id']] = doc
+            self._cache.move_to_end(doc['id'])
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_get(self, document_id):
+        with self._cache_lock:
+            doc = self._cache.get(document_id)
+            if doc is not None:
+                self._cache.move_to_end(document_id)
+            return doc
+
+    def _cache_discard(self, document_id):
+        with self._cache_lock:
+            self._cache.pop(document_id, None)
+
+    def add(self, doc):
+        """Insert or replace a document record"""
+        # 与 add_many 一样，文档和拼写容错词表在同一个事务中写入
+        with self.db.transaction() as conn:
+            conn.execute(
+                f"INSERT OR REPLACE INTO documents ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                _row_values(doc),
+            )
+            index_terms(conn, [doc])
+        self._cache_put(_row_to_document(_row_values(doc)))
+        self._after_write()
+
+    def add_many(self, docs):
+        with self.db.transaction() as conn:
+            conn.executemany(
+                f"INSERT OR REPLACE INTO documents ({', '.join(COLUMNS)}) "
+                f"VALUES ({', '.join('?' * len(COLUMNS))})",
+                [_row_values(doc) for doc in docs],
+            )
+            index_terms(conn, docs)
+        self._after_write()
+
+    def get(self, document_id):
+        """Look a document up by id, or return None"""
+        self._cache_validate()
+        doc = self._cache_get(document_id)
+        if doc is not None:
+            return dict(doc)
+        row = self.db.get().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM documents WHERE id = ?", (document_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        doc = _row_to_document(row)
+        self._cache_put(doc)
+        return dict(doc)
+
+    def exists(self, document_id):
+        """Whether the document is in the database, bypassing the cache"""
+        return self.db.get().execute(
+            'SELECT 1 FROM documents WHERE id = ?', (document_id,)).fetchone() is not None
+
+    def get_by_seq(self, seqs):
+        """{seq: document} for the given write sequence numbers"""
+        if not seqs:
+            return {}
+        rows = self.db.get().execute(
+            f"SELECT seq, {', '.join(COLUMNS)} FROM documents WHERE seq IN ({', '.join('?' * len(seqs))})",
+            list(seqs))
+        return {row[0]: _row_to_document(row[1:]) for row in rows}
+
+    def remove(self, document_id):
+        self.remove_many([document_id])
+
+    def remove_many(self, document_ids):
+        """Delete documents, and the typo-tolerant words only they contained"""
+        if not document_ids:
+            return
+        with self.db.transaction() as conn:
+            terms = set()
+            for document_id in document_ids:
+                row = conn.execute('SELECT guest_name, company, email, booking FROM documents WHERE id = ?',
+                                   (document_id,)).fetchone()
+                if row is not None:
+                    terms.update(document_terms(dict(zip(('guest_name', 'company', 'email', 'booking'), row))))
+            conn.executemany('DELETE FROM documents WHERE id = ?', [(i,) for i in document_ids])
+            prune_terms(conn, terms)
+        for document_id in document_ids:
+            self._cache_discard(document_id)
+        self._after_write()
+
+    def expired(self, cutoff, limit, after=None):
+        """Oldest documents generated before ``cutoff``, using the generated_date index
+
+        ``after`` 为上一批最后一个文档的 (generated_date, seq)，用于跳过未删除的文档。
+        """
+        sql = 'SELECT id, filename, filepath, generated_date, seq FROM documents WHERE generated_date < ?'
+        params = [cutoff]
+        if after is not None:
+            sql += ' AND (generated_date > ? OR (generated_date = ? AND seq > ?))'
+            params.extend([after[0], after[0], after[1]])
+        sql += ' ORDER BY generated_date, seq LIMIT ?'
+        params.append(limit)
+        rows = self.db.get().execute(sql, params).fetchall()
+        return [dict(zip(['id', 'filename', 'filepath', 'generated_date', 'seq'], row)) for row in rows]
+
+    def version(self):
+        """Number that changes whenever a document is added or removed"""
+        return self.db.get().execute(
+            "SELECT value FROM registry_meta WHERE key = 'version'").fetchone()[0]
+
+    def max_seq(self):
+        return self.db.get().execute('SELECT COALESCE(MAX(seq), 0) FROM documents').fetchone()[0]
+
+    def event_range(self):
+        """(oldest, newest) id in the document event log, (0, 0) when it is empty"""
+        return self.db.get().execute(
+            'SELECT COALESCE(MIN(id), 0), COALESCE(MAX(id), 0) FROM document_events').fetchone()
+
+    def events_after(self, event_id, limit=500):
+        """Document events after ``event_id``, oldest first
+
+        'added' 事件带上文档的当前记录；文档之后又被删除时 document 为 None，
+        后面会有对应的 'removed' 事件。
+        """
+        rows = self.db.get().execute(
+            f"SELECT e.id, e.kind, e.document_id, {', '.join('d.' + column for column in COLUMNS)} "
+            "FROM document_events e LEFT JOIN documents d ON e.kind = 'added' AND d.id = e.document_id "
+            "WHERE e.id > ? ORDER BY e.id LIMIT ?", (event_id, limit)
+        ).fetchall()
+        return [{
+            'event_id': row[0],
+            'kind': row[1],
+            'document_id': row[2],
+            'document': _row_to_document(row[3:]) if row[3] is not None else None,
+        } for row in rows]
+
+    def removed_after(self, event_id, limit=1000):
+        """Ids of documents removed after event ``event_id``, oldest first
+
+        需要的事件已被清理、或者超过 ``limit`` 个时返回 None，调用方应重新
+        加载整个列表。
+        """
+        oldest, newest = self.event_range()
+        if event_id >= newest:
+            return []
+        if event_id + 1 < oldest:
+            return None
+        rows = self.db.get().execute(
+            "SELECT document_id FROM document_events WHERE id > ? AND id <= ? AND kind = 'removed'"
+            " ORDER BY id LIMIT ?", (event_id, newest, limit + 1)).fetchall()
+        if len(rows) > limit:
+            return None
+        return [row[0] for row in rows]
+
+    def prune_events(self, keep):
+        """Drop all but the newest ``keep`` events"""
+        return self.db.get().execute(
+            'DELETE FROM document_events WHERE id <= (SELECT MAX(id) FROM document_events) - ?',
+            (keep,)).rowcount
+
+    def query(self, company=None, email=None, guest_prefix=None, date_from=None, date_to=None,
+              since=None, sort='seq', descending=False, after=None, limit=None):
+        """Iterate over matching documents, each with its ``seq``
+
+        过滤条件都走索引；分页使用 (排序列, seq) 游标，不使用 OFFSET，
+        所以翻到第几页的代价都一样。``after`` 为 decode_cursor 的结果。
+        """
+        if sort not in SORTABLE_COLUMNS:
+            raise ValueError(f'Cannot sort by {sort}')
+        where, params = [], []
+        if company:
+            where.append('company = ?')
+            params.append(company)
+        if email:
+            where.append('email = ?')
+            params.append(email)
+        if guest_prefix:
+            escaped = guest_prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            where.append("guest_name LIKE ? ESCAPE '\\'")
+            params.append(escaped + '%')
+        if date_from:
+            where.append('generated_date >= ?')
+            params.append(date_from)
+        if date_to:
+            # 只给日期时包含当天全天
+            where.append('generated_date <= ?')
+            params.append(date_to + ' 23:59:59' if len(date_to) == 10 else date_to)
+        if since is not None:
+            where.append('seq > ?')
+            params.append(int(since))
+        if after is not None:
+            sort_value, seq = after
+            op = '<' if descending else '>'
+            if sort == 'seq':
+                where.append(f'seq {op} ?')
+                params.append(seq)
+            else:
+                where.append(f'({sort} {op} ? OR ({sort} = ? AND seq {op} ?))')
+                params.extend([sort_value, sort_value, seq])
+
+        direction = 'DESC' if descending else 'ASC'
+        order = f'seq {direction}' if sort == 'seq' else f'{sort} {direction}, seq {direction}'
+        sql = f"SELECT seq, {', '.join(COLUMNS)} FROM documents"
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += f' ORDER BY {order}'
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        rows = self.db.get().execute(sql, params)
+        return (_row_to_document(row, ['seq'] + COLUMNS) for row in rows)
+
+    def count(self):
+        return self.db.get().execute(
+            "SELECT value FROM registry_meta WHERE key = 'document_count'").fetchone()[0]
+
+    def stats(self):
+        """Document count, total file size and date range without scanning the table"""
+        conn = self.db.get()
+        meta = dict(conn.execute(
+            "SELECT key, value FROM registry_meta WHERE key IN ('document_count', 'document_bytes')"))
+        # generated_date 有索引，MIN / MAX 只读取索引的两端
+        oldest = conn.execute('SELECT MIN(generated_date) FROM documents').fetchone()[0]
+        newest = conn.execute('SELECT MAX(generated_date) FROM documents').fetchone()[0]
+        return {
+            'count': meta['document_count'],
+            'bytes': meta['document_bytes'],
+            'oldest': oldest,
+            'newest': newest,
+        }
+
+    def all(self):
+        """Every document, oldest first"""
+        rows = self.db.get().execute(
+            f"SELECT {', '.join(COLUMNS)} FROM documents ORDER BY seq"
+        )
+        return [_row_to_document(row) for row in rows]
+
+    def rebuild_from_folder(self, folder):
+        """Recreate records from Visa_Booking_<id>_<company>.xlsx file names
+
+        文件名里只有确认号和公司名，其它字段无法恢复，留空。
+        """
+        docs = []
+        for path in Path(folder).glob('Visa_Booking_*.xlsx'):
+            match = FILENAME_PATTERN.match(path.name)
+            if not match:
+                continue
+            stat = path.stat()
+            generated = datetime.fromtimestamp(stat.st_mtime)
+            docs.append({
+                'id': match.group(1),
+                'filename': path.name,
+                'company': match.group(2).replace('_', ' '),
+                'email': '',
+                'guest_name': '',
+                'arrival_date': '',
+                'departure_date': '',
+                'nights': 0,
+                'total_amount': 0,
+                'generated_date': generated.strftime('%Y-%m-%d %H:%M:%S'),
+                'filepath': str(path),
+                'purpose': 'VISA_APPLICATION_ONLY',
+                'size': stat.st_size,
+            })
+        if docs:
+            self.add_many(docs)
+        return len(docs)
@@ -0,0 +1,74 @@
+"""进程池渲染 - 把单个文档的 xlsx / PDF 渲染交给子进程
+
+默认在处理请求的线程里渲染，渲染时持有 GIL，同一进程的其它请求（管理页面
+轮询、下载）都要等待。ASGI 模式（asgi.py）下一个进程要同时服务大量连接，
+渲染改为提交到有上限的进程池，请求线程只等待结果。
+
+子进程按模板路径缓存渲染器，模板文件修改后和主进程一样自动重新加载；
+渲染器抛出的异常（例如模板不兼容时的 ValueError）原样传回调用方。
+"""
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from pdf_renderer import PdfRenderer
+from template_engine import XlsxPatchRenderer
+
+# 子进程中的渲染器：(类型, 模板路径, 单元格) -> 渲染器
+_worker_renderers = {}
+
+
+def _worker_renderer(kind, template_path, cells):
+    key = (kind, template_path, cells)
+    renderer = _worker_renderers.get(key)
+    if renderer is None:
+        renderer_class = XlsxPatchRenderer if kind == 'xlsx' else PdfRenderer
+        renderer = _worker_renderers[key] = renderer_class(template_path, cells)
+    return renderer
+
+
+def _render_xlsx(template_path, cells, values):
+    return _worker_renderer('xlsx', template_path, cells).render_bytes(values)
+
+
+def _render_pdf(template_path, cells, values, title):
+    return _worker_renderer('pdf', template_path, cells).render_bytes(values, title=title)
+
+
+class RenderOffload:
+    """Render single documents in a pool of ``max_workers`` processes
+
+    进程池在第一次渲染时才创建；等待结果的调用方数量由调用它的线程池
+    （ASGI 的请求线程、异步任务队列）限制。
+    """
+
+    def __init__(self, max_workers):
+        self.max_workers = max_workers
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # 服务进程中已经有其它线程在运行，fork 出的子进程可能继承被占用的锁，
+                # 这里用 spawn 启动全新的解释器
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def render_xlsx(self, template, values):
+        """xlsx bytes for ``values`` rendered with the template's XML patch renderer"""
+        return self._get_executor().submit(
+            _render_xlsx, str(template.template_path), tuple(template.cells), values).result()
+
+    def render_pdf(self, template, values, title=None):
+        """PDF bytes for ``values`` laid out like the template"""
+        renderer = template.pdf_renderer
+        return self._get_executor().submit(
+            _render_pdf, str(template.template_path), tuple(renderer.cells), values, title).result()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
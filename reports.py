@@ -0,0 +1,209 @@
+"""预订报表 - /reports 的汇总查询
+
+财务原来下载 /documents 再用表格统计夜数和金额。这里的查询都读取
+registry.py 中由触发器维护的汇总表（生成、替换文档时在同一个事务中更新；
+保留期限过后被清理的文档仍然计入），不扫描文档表：
+
+- report_day_totals / report_month_totals   按生成日 / 生成月汇总
+- report_daily / report_monthly             按生成日 / 生成月和公司汇总
+- report_companies                          按公司汇总（全部时间）
+- report_guests                             按客人（邮箱 + 姓名）汇总
+- report_arrivals                           按入住日期汇总
+
+日期范围按生成日期过滤：整月的部分读取月汇总，首尾不满一个月的部分读取
+日汇总。不按公司分组的报表读取不含公司的汇总表，一年只有几十行；按公司
+分组的报表读取的行数为公司数乘以月数（加上首尾的天数）。
+"""
+from datetime import datetime, timedelta
+
+# 汇总的数值列
+TOTAL_COLUMNS = ['documents', 'nights', 'total_amount']
+
+
+def parse_date(value, name):
+    """YYYY-MM-DD query parameter as a date, None when empty"""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    except ValueError:
+        raise ValueError(f'Invalid {name}: {value} (expected YYYY-MM-DD)')
+
+
+def _month_end(day):
+    following = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return following - timedelta(days=1)
+
+
+def split_range(date_from, date_to):
+    """Cover [date_from, date_to] with whole months and the partial months at either end
+
+    返回 (日期范围列表, 月份范围)。日期范围为 (开始, 结束) 的 date，月份范围为
+    (开始月, 结束月) 的 'YYYY-MM'，None 表示不限；没有整月时月份范围为 None。
+    """
+    days = []
+    start, end = date_from, date_to
+    if start is not None and start.day != 1:
+        head_end = _month_end(start)
+        if end is not None and end <= head_end:
+            return [(start, end)], None
+        days.append((start, head_end))
+        start = head_end + timedelta(days=1)
+    if end is not None and end != _month_end(end):
+        tail_start = end.replace(day=1)
+        days.append((tail_start, end))
+        end = tail_start - timedelta(days=1)
+    if start is not None and end is not None and start > end:
+        return days, None
+    return days, (start.strftime('%Y-%m') if start else None, end.strftime('%Y-%m') if end else None)
+
+
+class BookingReports:
+    """Aggregate queries over the registry's rollup tables"""
+
+    def __init__(self, registry):
+        self.db = registry.db
+
+    def _execute(self, sql, params):
+        return self.db.get().execute(sql, params)
+
+    def _generated_rows(self, date_from, date_to, company=None, by_company=False):
+        """UNION ALL over the rollups covering the range: (period, [company,] documents, nights, total_amount)
+
+        period 为 'YYYY-MM-DD'（日汇总）或 'YYYY-MM'（月汇总）。按公司过滤或分组时
+        读取带公司的汇总表。
+        """
+        days, months = split_range(date_from, date_to)
+        per_company = bool(company) or by_company
+        daily, monthly = ('report_daily', 'report_monthly') if per_company else \
+            ('report_day_totals', 'report_month_totals')
+        columns = ('company, ' if per_company else '') + ', '.join(TOTAL_COLUMNS)
+        company_filter = ' AND company = ?' if company else ''
+        company_params = [company] if company else []
+        parts, params = [], []
+        for start, end in days:
+            parts.append(f'SELECT day AS period, {columns} FROM {daily} WHERE day BETWEEN ? AND ?{company_filter}')
+            params.extend([start.isoformat(), end.isoformat()] + company_params)
+        if months is not None:
+            where, month_params = ['1'], []
+            if months[0]:
+                where.append('month >= ?')
+                month_params.append(months[0])
+            if months[1]:
+                where.append('month <= ?')
+                month_params.append(months[1])
+            parts.append(f"SELECT month AS period, {columns} FROM {monthly}"
+                         f" WHERE {' AND '.join(where)}{company_filter}")
+            params.extend(month_params + company_params)
+        return ' UNION ALL '.join(parts), params
+
+    def _company_count(self, date_from, date_to):
+        """Companies with documents in the range, one index lookup per company"""
+        if date_from is None and date_to is None:
+            return self._execute('SELECT COUNT(*) FROM report_companies', []).fetchone()[0]
+        where, params = [], []
+        if date_from:
+            where.append('d.day >= ?')
+            params.append(date_from.isoformat())
+        if date_to:
+            where.append('d.day <= ?')
+            params.append(date_to.isoformat())
+        return self._execute(
+            'SELECT COUNT(*) FROM report_companies c WHERE EXISTS (SELECT 1 FROM report_daily d'
+            f" WHERE d.company = c.company AND {' AND '.join(where)})", params).fetchone()[0]
+
+    def summary(self, date_from=None, date_to=None, company=None):
+        """Totals for the range: documents, nights, total_amount and the number of companies"""
+        rows, params = self._generated_rows(date_from, date_to, company)
+        documents, nights, total_amount = self._execute(
+            'SELECT COALESCE(SUM(documents), 0), COALESCE(SUM(nights), 0), COALESCE(SUM(total_amount), 0)'
+            f' FROM ({rows})', params).fetchone()
+        if company:
+            companies = 1 if documents else 0
+        else:
+            companies = self._company_count(date_from, date_to)
+        return {
+            'from': date_from.isoformat() if date_from else None,
+            'to': date_to.isoformat() if date_to else None,
+            'company': company,
+            'documents': documents,
+            'nights': nights,
+            'total_amount': total_amount,
+            'companies': companies,
+        }
+
+    def by_period(self, bucket='day', date_from=None, date_to=None, company=None):
+        """Documents, nights and total_amount per generated day or month, oldest first"""
+        if bucket == 'day':
+            where, params = [], []
+            if date_from:
+                where.append('day >= ?')
+                params.append(date_from.isoformat())
+            if date_to:
+                where.append('day <= ?')
+                params.append(date_to.isoformat())
+            if company:
+                where.append('company = ?')
+                params.append(company)
+            table = 'report_daily' if company else 'report_day_totals'
+            sql = (f'SELECT day, SUM(documents), SUM(nights), SUM(total_amount) FROM {table}'
+                   + (' WHERE ' + ' AND '.join(where) if where else '') + ' GROUP BY day ORDER BY day')
+        elif bucket == 'month':
+            rows, params = self._generated_rows(date_from, date_to, company)
+            sql = (f'SELECT substr(period, 1, 7) AS month, SUM(documents), SUM(nights), SUM(total_amount)'
+                   f' FROM ({rows}) GROUP BY month ORDER BY month')
+        else:
+            raise ValueError(f'Unknown bucket: {bucket} (use day or month)')
+        return ({'period': row[0], **dict(zip(TOTAL_COLUMNS, row[1:]))}
+                for row in self._execute(sql, params))
+
+    def companies(self, date_from=None, date_to=None, sort='total_amount', limit=None):
+        """Totals per company, largest first"""
+        if sort not in TOTAL_COLUMNS:
+            raise ValueError(f"Cannot sort by {sort} (use {', '.join(TOTAL_COLUMNS)})")
+        if date_from is None and date_to is None:
+            # 全部时间：倒序读取 sort 列的索引
+            sql = f"SELECT company, {', '.join(TOTAL_COLUMNS)} FROM report_companies ORDER BY {sort} DESC"
+            params = []
+        else:
+            rows, params = self._generated_rows(date_from, date_to, by_company=True)
+            sql = (f'SELECT company, SUM(documents) AS documents, SUM(nights) AS nights,'
+                   f' SUM(total_amount) AS total_amount FROM ({rows}) GROUP BY company'
+                   f' ORDER BY {sort} DESC, company')
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return ({'company': row[0], **dict(zip(TOTAL_COLUMNS, row[1:]))}
+                for row in self._execute(sql, params))
+
+    def guests(self, sort='total_amount', limit=None):
+        """Top guests since the registry was created, by total_amount or documents"""
+        if sort not in ('documents', 'total_amount'):
+            raise ValueError(f'Cannot sort guests by {sort} (use documents or total_amount)')
+        # 倒序读取 sort 列的索引，取到 limit 个即停止
+        sql = (f"SELECT guest_name, email, {', '.join(TOTAL_COLUMNS)} FROM report_guests"
+               f" WHERE guest_name != '' ORDER BY {sort} DESC")
+        params = []
+        if limit is not None:
+            sql += ' LIMIT ?'
+            params.append(int(limit))
+        return ({'guest_name': row[0], 'email': row[1], **dict(zip(TOTAL_COLUMNS, row[2:]))}
+                for row in self._execute(sql, params))
+
+    def arrivals(self, bucket='day', date_from=None, date_to=None):
+        """Histogram of arrival dates; ``date_from`` / ``date_to`` filter the arrival date"""
+        if bucket not in ('day', 'month'):
+            raise ValueError(f'Unknown bucket: {bucket} (use day or month)')
+        period = 'arrival_date' if bucket == 'day' else 'substr(arrival_date, 1, 7)'
+        # 从文件名恢复的旧记录没有入住日期
+        where, params = ["arrival_date != ''"], []
+        if date_from:
+            where.append('arrival_date >= ?')
+            params.append(date_from.isoformat())
+        if date_to:
+            where.append('arrival_date <= ?')
+            params.append(date_to.isoformat())
+        sql = (f"SELECT {period} AS period, SUM(documents), SUM(nights), SUM(total_amount)"
+               f" FROM report_arrivals WHERE {' AND '.join(where)} GROUP BY period ORDER BY period")
+        return ({'period': row[0], **dict(zip(TOTAL_COLUMNS, row[1:]))}
+                for row in self._execute(sql, params))
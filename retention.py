@@ -0,0 +1,186 @@
+"""文档保留策略 - 删除超过保留期限的文档文件和登记记录
+
+过期文档通过登记表 generated_date 上的索引按批查找，不扫描生成文件夹；
+每批最多处理 batch_size 个文档，一次清理的工作量是有上限的。文档从
+storage.py 中的存储后端删除。
+
+按天归档的存储（deletes_documents 为 False）不能删除单个文档：截止时间
+取整到当天零点，只有整天都过期的文档才删除登记记录，全部批次处理完后
+由 purge_before() 删除这些天的压缩包。
+"""
+import logging
+import threading
+from datetime import datetime, timedelta
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows：不做跨进程互斥
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionSweeper:
+    """Incrementally delete documents older than ``ttl_hours``"""
+
+    def __init__(self, registry, storage, ttl_hours=48, batch_size=500, lock_path=None,
+                 companion_suffixes=()):
+        self.registry = registry
+        self.storage = storage
+        # 与文档一起删除的派生文件（例如同名的 .pdf 缓存）
+        self.companion_suffixes = tuple(companion_suffixes)
+        self.ttl_hours = ttl_hours
+        self.batch_size = batch_size
+        self.lock_path = Path(lock_path) if lock_path else None
+        self._lock = threading.Lock()
+        self._scheduler = None
+        self._stop = threading.Event()
+        self.metrics = {
+            'runs': 0,
+            'files_deleted': 0,
+            'bytes_reclaimed': 0,
+            'records_removed': 0,
+            'missing_files': 0,
+            'errors': 0,
+            'last_run': None,
+        }
+
+    def _acquire_process_lock(self):
+        """Non-blocking lock so only one gunicorn worker sweeps at a time"""
+        if fcntl is None or self.lock_path is None:
+            return None
+        handle = open(self.lock_path, 'a')
+        try:
+            fcntl.flock(handle, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            handle.close()
+            return False
+        return handle
+
+    def _remove_companions(self, doc, dry_run):
+        """Delete the document's derived files; return the bytes they used"""
+        reclaimed = 0
+        for suffix in self.companion_suffixes:
+            try:
+                size = self.storage.size(doc, suffix)
+                if size is None:
+                    continue
+                if not dry_run:
+                    self.storage.delete(doc, suffix)
+            except OSError:
+                continue
+            reclaimed += size
+        return reclaimed
+
+    def sweep(self, dry_run=False, ttl_hours=None, max_batches=None):
+        """Delete expired documents in batches and return what was (or would be) reclaimed"""
+        ttl_hours = self.ttl_hours if ttl_hours is None else ttl_hours
+        cutoff = (datetime.now() - timedelta(hours=ttl_hours)).strftime('%Y-%m-%d %H:%M:%S')
+        per_document = self.storage.deletes_documents
+        if not per_document:
+            cutoff = cutoff[:10] + ' 00:00:00'
+        stats = {
+            'dry_run': dry_run,
+            'cutoff': cutoff,
+            'files_deleted': 0,
+            'bytes_reclaimed': 0,
+            'records_removed': 0,
+            'missing_files': 0,
+            'errors': 0,
+            'batches': 0,
+            'skipped': False,
+        }
+        if not self._lock.acquire(blocking=False):
+            stats['skipped'] = True
+            return stats
+        process_lock = None
+        try:
+            process_lock = self._acquire_process_lock()
+            if process_lock is False:
+                stats['skipped'] = True
+                return stats
+            after = None
+            finished = False
+            while max_batches is None or stats['batches'] < max_batches:
+                batch = self.registry.expired(cutoff, self.batch_size, after=after)
+                if not batch:
+                    finished = True
+                    break
+                stats['batches'] += 1
+                removed = []
+                for doc in batch:
+                    if not per_document:
+                        # 文件随整天的压缩包一起删除
+                        removed.append(doc['id'])
+                        continue
+                    try:
+                        size = self.storage.size(doc)
+                    except OSError:
+                        stats['errors'] += 1
+                        continue
+                    if size is None:
+                        stats['missing_files'] += 1
+                        stats['bytes_reclaimed'] += self._remove_companions(doc, dry_run)
+                        removed.append(doc['id'])
+                        continue
+                    if not dry_run:
+                        try:
+                            self.storage.delete(doc)
+                        except OSError as e:
+                            logger.warning(f"删除文件失败 {doc['filename']}: {e}")
+                            stats['errors'] += 1
+                            continue
+                    stats['files_deleted'] += 1
+                    stats['bytes_reclaimed'] += size + self._remove_companions(doc, dry_run)
+                    removed.append(doc['id'])
+                if dry_run:
+                    # 不删除记录，下一批从这一批之后继续
+                    after = (batch[-1]['generated_date'], batch[-1]['seq'])
+                    stats['records_removed'] += len(removed)
+                else:
+                    self.registry.remove_many(removed)
+                    stats['records_removed'] += len(removed)
+                    if len(removed) < len(batch):
+                        # 有删除失败的文档留在登记表中，跳过它们继续
+                        after = (batch[-1]['generated_date'], batch[-1]['seq'])
+                if len(batch) < self.batch_size:
+                    finished = True
+                    break
+            if finished:
+                # 按天归档的存储只能删除整天的压缩包；还有过期记录没处理完时
+                # 保留压缩包，否则这些记录的下载会把旧的一天重新写回
+                stats['bytes_reclaimed'] += self.storage.purge_before(cutoff[:10], dry_run=dry_run)
+        finally:
+            if process_lock:
+                process_lock.close()
+            self._lock.release()
+
+        if not dry_run:
+            self.metrics['runs'] += 1
+            for key in ('files_deleted', 'bytes_reclaimed', 'records_removed', 'missing_files', 'errors'):
+                self.metrics[key] += stats[key]
+            self.metrics['last_run'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        return stats
+
+    def start_scheduler(self, interval_seconds):
+        """Run sweep() every ``interval_seconds`` in a daemon thread"""
+        if self._scheduler is not None and self._scheduler.is_alive():
+            return
+
+        def run():
+            while not self._stop.wait(interval_seconds):
+                try:
+                    stats = self.sweep()
+                    if stats['records_removed']:
+                        logger.info(f"定时清理: 删除 {stats['files_deleted']} 个文件, "
+                                    f"释放 {stats['bytes_reclaimed']} bytes")
+                except Exception as e:
+                    logger.exception(f"定时清理失败: {e}")
+
+        self._stop.clear()
+        self._scheduler = threading.Thread(target=run, name='retention-sweeper', daemon=True)
+        self._scheduler.start()
+
+    def stop_scheduler(self):
+        self._stop.set()
@@ -0,0 +1,267 @@
+"""文档搜索 - /documents/search 的全文索引和拼写容错
+
+客服原来要在管理页面里翻表格或者猜确认号。这里用 SQLite FTS5 给确认号、
+客人姓名、公司、邮箱和备注建全文索引（documents_search，rowid 为文档的
+seq），由 documents 表上的触发器维护，所有 worker、批量生成和清理任务的
+写入都会同步。
+
+- 依次按整词、前缀（"joh" 找到 John，2 到 4 个字母的前缀使用 FTS5 的
+  前缀索引）、拼写容错匹配，前一级的结果够数时不再查询下一级
+- 拼写容错：姓名、公司、邮箱、备注中的字母词登记在 search_terms 中，
+  连同去掉一个字母后的形式（search_fuzzy），查询词去掉一个字母后查表
+  就能找到编辑距离为 1 的词（插入、删除、替换、相邻交换）。删除文档时
+  （包括清理任务）不再出现在任何文档中的词从词表中删除
+- 排序：每一级取最新的 SEARCH_CANDIDATES 个匹配文档，按每个词匹配的列
+  （确认号、姓名、公司、邮箱、备注的权重依次降低）和匹配方式（整词、前缀、
+  容错）计分。FTS5 的 bm25 要遍历每个词的全部文档来统计词频，常见词
+  （例如邮箱域名）会让查询变慢，所以不使用
+"""
+import json
+import re
+import unicodedata
+
+# FTS5 表的列及其排序权重
+SEARCH_COLUMNS = ['id', 'guest_name', 'company', 'email', 'remark']
+COLUMN_WEIGHTS = [10.0, 5.0, 3.0, 3.0, 1.0]
+# 词的匹配方式的得分
+MATCH_QUALITY = {'exact': 1.0, 'prefix': 0.6, 'fuzzy': 0.4}
+# 每一级匹配中参与排序的最新文档数
+SEARCH_CANDIDATES = 500
+# 参与拼写容错的最短词长，以及每个查询词最多扩展的相似词数
+FUZZY_MIN_LENGTH = 4
+FUZZY_MAX_TERMS = 20
+# 一次查询最多使用的词数
+MAX_QUERY_TERMS = 8
+
+_TOKEN = re.compile(r'[^\W_]+')
+_REMARK_SQL = "CASE WHEN json_valid({row}.booking) THEN json_extract({row}.booking, '$.remark') END"
+
+
+def _fts_values(row):
+    return ', '.join([f'{row}.seq'] + [f'{row}.{column}' for column in SEARCH_COLUMNS[:-1]]
+                     + [_REMARK_SQL.format(row=row)])
+
+
+SCHEMA = [
+    # unicode61 与 tokenize() 的分词方式一致：字母和数字组成词，忽略大小写和重音
+    "CREATE VIRTUAL TABLE IF NOT EXISTS documents_search USING fts5("
+    f"{', '.join(SEARCH_COLUMNS)}, tokenize='unicode61 remove_diacritics 2', prefix='2 3 4')",
+    'CREATE TABLE IF NOT EXISTS search_terms (term TEXT PRIMARY KEY) WITHOUT ROWID',
+    'CREATE TABLE IF NOT EXISTS search_fuzzy ('
+    ' key TEXT NOT NULL,'
+    ' term TEXT NOT NULL,'
+    ' PRIMARY KEY (key, term)) WITHOUT ROWID',
+    'CREATE TRIGGER IF NOT EXISTS documents_search_insert AFTER INSERT ON documents BEGIN'
+    f" INSERT INTO documents_search (rowid, {', '.join(SEARCH_COLUMNS)}) VALUES ({_fts_values('NEW')}); END",
+    'CREATE TRIGGER IF NOT EXISTS documents_search_delete AFTER DELETE ON documents BEGIN'
+    ' DELETE FROM documents_search WHERE rowid = OLD.seq; END',
+    # INSERT OR REPLACE 不触发 DELETE 触发器，插入前先删除被替换的记录
+    'CREATE TRIGGER IF NOT EXISTS documents_search_replace BEFORE INSERT ON documents'
+    ' WHEN EXISTS (SELECT 1 FROM documents WHERE id = NEW.id) BEGIN'
+    ' DELETE FROM documents_search WHERE rowid = (SELECT seq FROM documents WHERE id = NEW.id); END',
+]
+
+
+def tokenize(text):
+    """Lower-case words without accents, split like the FTS5 unicode61 tokenizer"""
+    if not text:
+        return []
+    text = str(text).lower()
+    if not text.isascii():
+        decomposed = unicodedata.normalize('NFKD', text)
+        text = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return _TOKEN.findall(text)
+
+
+def document_terms(doc):
+    """Words of a document that take part in typo-tolerant matching
+
+    只登记纯字母的词：确认号、邮箱里的数字等按前缀匹配就够了，
+    也不会让词表随文档数一起增长。
+    """
+    remark = ''
+    if doc.get('booking'):
+        try:
+            remark = json.loads(doc['booking']).get('remark', '')
+        except (TypeError, ValueError, AttributeError):
+            remark = ''
+    terms = set()
+    for value in (doc.get('guest_name'), doc.get('company'), doc.get('email'), remark):
+        terms.update(term for term in tokenize(value) if len(term) >= FUZZY_MIN_LENGTH and term.isalpha())
+    return terms
+
+
+def fuzzy_keys(term):
+    """The term and every form of it with one letter removed"""
+    return {term} | {term[:i] + term[i + 1:] for i in range(len(term))}
+
+
+def edit_distance(a, b, limit=1):
+    """Optimal string alignment distance (adjacent swaps count as one edit), capped at limit + 1"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous2, previous = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], previous2[j - 2] + 1)
+        if min(current) > limit:
+            return limit + 1
+        previous2, previous = previous, current
+    return previous[-1]
+
+
+def index_terms(conn, docs):
+    """Register the typo-tolerant words of ``docs``; words already known are skipped"""
+    terms = set()
+    for doc in docs:
+        terms.update(document_terms(doc))
+    if not terms:
+        return
+    placeholders = ', '.join('?' * len(terms))
+    known = {row[0] for row in conn.execute(
+        f'SELECT term FROM search_terms WHERE term IN ({placeholders})', list(terms))}
+    new_terms = terms - known
+    if not new_terms:
+        return
+    conn.executemany('INSERT OR IGNORE INTO search_terms (term) VALUES (?)', [(term,) for term in new_terms])
+    conn.executemany('INSERT OR IGNORE INTO search_fuzzy (key, term) VALUES (?, ?)',
+                     [(key, term) for term in new_terms for key in fuzzy_keys(term)])
+
+
+def prune_terms(conn, terms):
+    """Forget the typo-tolerant words in ``terms`` that no remaining document contains
+
+    在删除文档的事务中、删除之后调用，``terms`` 为被删除文档的词
+    （document_terms）。每个词用全文索引查一次是否还有文档包含它。
+    """
+    columns = '{' + ' '.join(SEARCH_COLUMNS[1:]) + '}'
+    unused = [term for term in terms if conn.execute(
+        'SELECT 1 FROM documents_search WHERE documents_search MATCH ? LIMIT 1',
+        (f'{columns} : {_phrase(term)}',)).fetchone() is None]
+    conn.executemany('DELETE FROM search_terms WHERE term = ?', [(term,) for term in unused])
+    conn.executemany('DELETE FROM search_fuzzy WHERE key = ? AND term = ?',
+                     [(key, term) for term in unused for key in fuzzy_keys(term)])
+    return len(unused)
+
+
+def create_search_index(conn):
+    """Fill the search index from the existing documents once
+
+    与汇总表一样在一个事务中回填（见 registry._create_rollups），
+    之后由触发器和 index_terms() 维护。
+    """
+    done = "SELECT 1 FROM registry_meta WHERE key = 'search_index'"
+    if conn.execute(done).fetchone():
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if not conn.execute(done).fetchone():
+            conn.execute('DELETE FROM documents_search')
+            conn.execute(f"INSERT INTO documents_search (rowid, {', '.join(SEARCH_COLUMNS)})"
+                         f" SELECT {_fts_values('documents')} FROM documents")
+            rows = conn.execute('SELECT guest_name, company, email, booking FROM documents')
+            while True:
+                batch = rows.fetchmany(5000)
+                if not batch:
+                    break
+                index_terms(conn, [dict(zip(['guest_name', 'company', 'email', 'booking'], row))
+                                   for row in batch])
+            conn.execute("INSERT INTO registry_meta (key, value) VALUES ('search_index', 1)")
+    except BaseException:
+        conn.execute('ROLLBACK')
+        raise
+    conn.execute('COMMIT')
+
+
+def _phrase(term):
+    return '"' + term.replace('"', '""') + '"'
+
+
+class DocumentSearch:
+    """Ranked prefix and typo-tolerant search over the registry's FTS5 index"""
+
+    def __init__(self, registry):
+        self.registry = registry
+        self.db = registry.db
+
+    def similar_terms(self, term):
+        """Known words within one edit of ``term``, not counting the term itself"""
+        keys = sorted(fuzzy_keys(term))
+        rows = self.db.get().execute(
+            f"SELECT DISTINCT term FROM search_fuzzy WHERE key IN ({', '.join('?' * len(keys))})", keys)
+        similar = [row[0] for row in rows if row[0] != term and edit_distance(row[0], term) <= 1]
+        return sorted(similar)[:FUZZY_MAX_TERMS]
+
+    def _candidates(self, expression):
+        """(seq, column values) of the newest SEARCH_CANDIDATES documents matching ``expression``"""
+        rows = self.db.get().execute(
+            f"SELECT rowid, {', '.join(SEARCH_COLUMNS)} FROM documents_search"
+            " WHERE documents_search MATCH ? ORDER BY rowid DESC LIMIT ?",
+            (expression, SEARCH_CANDIDATES))
+        return [(row[0], row[1:]) for row in rows]
+
+    @staticmethod
+    def _score(terms, similar, values):
+        """Sum over the query words of the best column weight times match quality"""
+        columns = [(weight, tokenize(value)) for weight, value in zip(COLUMN_WEIGHTS, values) if value]
+        score = 0.0
+        for term in terms:
+            best = 0.0
+            for weight, tokens in columns:
+                for token in tokens:
+                    if token == term:
+                        quality = MATCH_QUALITY['exact']
+                    elif token.startswith(term):
+                        quality = MATCH_QUALITY['prefix']
+                    elif token in similar.get(term, ()):
+                        quality = MATCH_QUALITY['fuzzy']
+                    else:
+                        continue
+                    best = max(best, weight * quality)
+            score += best
+        return score
+
+    def search(self, query, limit=20):
+        """Documents matching every word of ``query``, best first
+
+        每个结果带上 score（越大越相关）和 match（'exact'、'prefix' 或 'fuzzy'，
+        为找到它的那一级匹配）。
+        """
+        terms = tokenize(query)[:MAX_QUERY_TERMS]
+        if not terms:
+            return []
+        similar = {}
+        matches, found = [], set()
+        for level in ('exact', 'prefix', 'fuzzy'):
+            if len(matches) >= limit:
+                break
+            if level == 'exact':
+                expression = ' AND '.join(_phrase(term) for term in terms)
+            elif level == 'prefix':
+                expression = ' AND '.join(_phrase(term) + '*' for term in terms)
+            else:
+                similar = {term: self.similar_terms(term) for term in terms
+                           if len(term) >= FUZZY_MIN_LENGTH and term.isalpha()}
+                if not any(similar.values()):
+                    break
+                expression = ' AND '.join(
+                    '(' + ' OR '.join([_phrase(term) + '*'] + [_phrase(word) for word in similar.get(term, [])]) + ')'
+                    for term in terms)
+            scored = [(self._score(terms, similar, values), seq) for seq, values in self._candidates(expression)
+                      if seq not in found]
+            # 分数相同时新的文档在前
+            scored.sort(key=lambda item: (-item[0], -item[1]))
+            for score, seq in scored[:limit - len(matches)]:
+                matches.append((seq, score, level))
+                found.add(seq)
+        documents = self.registry.get_by_seq([seq for seq, _, _ in matches])
+        results = []
+        for seq, score, match in matches:
+            doc = documents.get(seq)
+            if doc is not None:
+                results.append({**doc, 'score': round(score, 2), 'match': match})
+        return results
@@ -0,0 +1,321 @@
+"""文档存储 - 生成的 xlsx（以及派生的 PDF）保存在哪里
+
+原来每个文档都先写入 GENERATED_FOLDER 再由 send_file 读回，磁盘 I/O 翻倍，
+多个 gunicorn worker 还必须共享同一个可写目录。这里把存储抽象成可替换的
+后端，接口相同：
+
+- DiskStorage：每个文档一个文件（原来的方式），下载时直接 send_file
+- MemoryStorage：只保存在进程内存中，按总字节数上限淘汰最久未用的文档；
+  不在当前进程中的文档由调用方按登记表中的预订记录重新生成
+- DailyArchiveStorage：每天一个 zip 压缩包，文件数不随文档数增长；压缩包
+  只能整天删除，由清理任务调用 purge_before()，不能删除单个文档
+  （deletes_documents 为 False）
+
+文档用登记表中的记录（id、filename、filepath、generated_date）定位，
+suffix 表示同一文档的派生文件（例如 '.pdf'）。
+"""
+import os
+import struct
+import tempfile
+import threading
+import zipfile
+import zlib
+from collections import OrderedDict
+from contextlib import contextmanager
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # Windows：只做进程内互斥
+    fcntl = None
+
+BACKENDS = ('disk', 'memory', 'archive')
+
+
+def atomic_write(path, data):
+    """Write ``data`` to a temp file and rename it, so readers never see a partial file"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+    return len(data)
+
+
+class DiskStorage:
+    """One file per document in ``folder`` (the original layout)"""
+
+    name = 'disk'
+    deletes_documents = True
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+
+    def path(self, doc, suffix=None):
+        path = Path(doc['filepath']) if doc.get('filepath') else self.folder / doc['filename']
+        return path.with_suffix(suffix) if suffix else path
+
+    def save(self, doc, data, suffix=None):
+        path = self.path(doc, suffix)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        return atomic_write(path, data)
+
+    def load(self, doc, suffix=None):
+        try:
+            return self.path(doc, suffix).read_bytes()
+        except FileNotFoundError:
+            return None
+
+    def local_path(self, doc, suffix=None):
+        """Path that send_file can serve directly, or None"""
+        path = self.path(doc, suffix)
+        return path if path.exists() else None
+
+    def size(self, doc, suffix=None):
+        """Stored size in bytes, or None when the document is not stored"""
+        try:
+            return self.path(doc, suffix).stat().st_size
+        except FileNotFoundError:
+            return None
+
+    def delete(self, doc, suffix=None):
+        try:
+            self.path(doc, suffix).unlink()
+        except FileNotFoundError:
+            pass
+
+    def purge_before(self, day, dry_run=False):
+        return 0
+
+    def stats(self):
+        return {'backend': self.name, 'folder': str(self.folder)}
+
+
+class MemoryStorage:
+    """Documents kept in this process only, least recently used evicted above ``max_bytes``"""
+
+    name = 'memory'
+    deletes_documents = True
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._items = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = 0
+
+    @staticmethod
+    def _key(doc, suffix):
+        return doc['id'], suffix or ''
+
+    def save(self, doc, data, suffix=None):
+        key = self._key(doc, suffix)
+        data = bytes(data)
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old is not None:
+                self._bytes -= len(old)
+            if len(data) > self.max_bytes:
+                return len(data)
+            self._items[key] = data
+            self._bytes += len(data)
+            while self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+        return len(data)
+
+    def load(self, doc, suffix=None):
+        key = self._key(doc, suffix)
+        with self._lock:
+            data = self._items.get(key)
+            if data is not None:
+                self._items.move_to_end(key)
+            return data
+
+    def local_path(self, doc, suffix=None):
+        return None
+
+    def size(self, doc, suffix=None):
+        with self._lock:
+            data = self._items.get(self._key(doc, suffix))
+        return len(data) if data is not None else None
+
+    def delete(self, doc, suffix=None):
+        with self._lock:
+            data = self._items.pop(self._key(doc, suffix), None)
+            if data is not None:
+                self._bytes -= len(data)
+
+    def purge_before(self, day, dry_run=False):
+        return 0
+
+    def stats(self):
+        with self._lock:
+            return {'backend': self.name, 'items': len(self._items), 'bytes': self._bytes,
+                    'max_bytes': self.max_bytes, 'evictions': self.evictions}
+
+
+class DailyArchiveStorage:
+    """One zip archive per generation day in ``folder``
+
+    读写压缩包时用同一个文件锁在进程之间互斥；同一文档重新生成的内容
+    相同，已经在压缩包中的文档不会重复写入。每个压缩包的成员目录缓存在
+    进程内（按文件的 mtime 和大小判断是否过期），读取、查询大小时不再
+    解析中央目录，直接从记录的偏移读出成员。
+
+    单个文档不能从压缩包中删除，delete() 抛出 NotImplementedError；过期
+    文档只能按整天由 purge_before() 删除（清理任务见 retention.py）。
+    """
+
+    name = 'archive'
+    deletes_documents = False
+
+    def __init__(self, folder, compress_level=6):
+        self.folder = Path(folder)
+        self.compress_level = compress_level
+        self._lock = threading.RLock()
+        # 压缩包路径 -> ((st_mtime_ns, st_size), {成员名: ZipInfo})
+        self._index = {}
+
+    def archive_path(self, doc):
+        day = (doc.get('generated_date') or '')[:10] or 'undated'
+        return self.folder / f'documents_{day}.zip'
+
+    @staticmethod
+    def _member(doc, suffix):
+        return str(Path(doc['filename']).with_suffix(suffix)) if suffix else doc['filename']
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with self._lock:
+            if fcntl is None:
+                yield
+                return
+            self.folder.mkdir(parents=True, exist_ok=True)
+            with open(self.folder / '.archive.lock', 'a') as handle:
+                fcntl.flock(handle, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                yield
+
+    def _cached_members(self, archive):
+        """The cached member index if the archive has not changed since, else None"""
+        try:
+            stat = archive.stat()
+        except FileNotFoundError:
+            self._index.pop(archive, None)
+            return None
+        cached = self._index.get(archive)
+        if cached is not None and cached[0] == (stat.st_mtime_ns, stat.st_size):
+            return cached[1]
+        return None
+
+    def _remember(self, archive, members):
+        stat = archive.stat()
+        self._index[archive] = ((stat.st_mtime_ns, stat.st_size), members)
+
+    def _members(self, archive):
+        """{member name: ZipInfo} of the archive, or None when it does not exist"""
+        members = self._cached_members(archive)
+        if members is None and archive.exists():
+            with zipfile.ZipFile(archive) as zf:
+                members = dict(zf.NameToInfo)
+            self._remember(archive, members)
+        return members
+
+    @staticmethod
+    def _read_member(archive, info):
+        """Read one member at its recorded offset without parsing the central directory"""
+        with open(archive, 'rb') as f:
+            f.seek(info.header_offset)
+            header = f.read(30)
+            if len(header) != 30 or header[:4] != b'PK\x03\x04':
+                raise zipfile.BadZipFile(f'Bad local header for {info.filename} in {archive}')
+            name_length, extra_length = struct.unpack('<HH', header[26:30])
+            f.seek(name_length + extra_length, os.SEEK_CUR)
+            raw = f.read(info.compress_size)
+        data = zlib.decompress(raw, -zlib.MAX_WBITS) if info.compress_type == zipfile.ZIP_DEFLATED else raw
+        if zlib.crc32(data) != info.CRC:
+            raise zipfile.BadZipFile(f'CRC mismatch for {info.filename} in {archive}')
+        return data
+
+    def save(self, doc, data, suffix=None):
+        archive = self.archive_path(doc)
+        member = self._member(doc, suffix)
+        with self._locked(exclusive=True):
+            members = self._cached_members(archive)
+            if members is not None and member in members:
+                return len(data)
+            self.folder.mkdir(parents=True, exist_ok=True)
+            with zipfile.ZipFile(archive, 'a', zipfile.ZIP_DEFLATED,
+                                 compresslevel=self.compress_level) as zf:
+                if member not in zf.NameToInfo:
+                    zf.writestr(member, data)
+                members = dict(zf.NameToInfo)
+            self._remember(archive, members)
+        return len(data)
+
+    def _info(self, doc, suffix, read):
+        archive = self.archive_path(doc)
+        with self._locked(exclusive=False):
+            try:
+                members = self._members(archive)
+                info = members.get(self._member(doc, suffix)) if members else None
+                if info is None:
+                    return None
+                return self._read_member(archive, info) if read else info.file_size
+            except FileNotFoundError:
+                return None
+
+    def load(self, doc, suffix=None):
+        return self._info(doc, suffix, read=True)
+
+    def local_path(self, doc, suffix=None):
+        return None
+
+    def size(self, doc, suffix=None):
+        return self._info(doc, suffix, read=False)
+
+    def delete(self, doc, suffix=None):
+        raise NotImplementedError('Archived documents can only be purged by whole day, see purge_before()')
+
+    def purge_before(self, day, dry_run=False):
+        """Delete the archives of days before ``day`` (YYYY-MM-DD), return bytes freed
+
+        dry_run 时只返回会释放的字节数。
+        """
+        freed = 0
+        for archive in self.folder.glob('documents_*.zip'):
+            if archive.stem[len('documents_'):] >= day:
+                continue
+            with self._locked(exclusive=True):
+                try:
+                    freed += archive.stat().st_size
+                    if not dry_run:
+                        archive.unlink()
+                        self._index.pop(archive, None)
+                except FileNotFoundError:
+                    continue
+        return freed
+
+    def stats(self):
+        archives = list(self.folder.glob('documents_*.zip'))
+        return {'backend': self.name, 'folder': str(self.folder), 'archives': len(archives),
+                'bytes': sum(archive.stat().st_size for archive in archives)}
+
+
+def create_storage(backend, folder, max_memory_bytes):
+    """Storage backend by name: 'disk', 'memory' or 'archive'"""
+    if backend == 'disk':
+        return DiskStorage(folder)
+    if backend == 'memory':
+        return MemoryStorage(max_memory_bytes)
+    if backend == 'archive':
+        return DailyArchiveStorage(Path(folder) / 'archives')
+    raise ValueError(f'Unknown storage backend: {backend} (expected one of {", ".join(BACKENDS)})')
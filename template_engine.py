@@ -0,0 +1,435 @@
+"""模板缓存 - 只解析一次 visa_booking_template.xlsx
+
+load_workbook 是生成文档时最慢的一步。这里在启动时（或模板文件 mtime
+变化时）解析一次模板：
+
+- TemplateCache 把解析好的工作簿序列化成快照，每个请求从快照反序列化
+  出一个独立的 openpyxl 副本；
+- XlsxPatchRenderer 完全跳过 openpyxl，保留模板里其它 zip 成员的压缩
+  字节，只把数据单元格拼接进工作表 XML；
+- RenderPool 在多个进程中用 XlsxPatchRenderer 批量渲染。
+
+导入 openpyxl 本身就要一百多毫秒，只有 TemplateCache 需要它，在解析模板时
+才导入；TemplateMetadata 和 XlsxPatchRenderer 直接读取压缩包中的 XML。
+"""
+import hashlib
+import io
+import logging
+import multiprocessing
+import os
+import pickle
+import re
+import struct
+import threading
+import zlib
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape, unescape
+
+logger = logging.getLogger(__name__)
+
+
+class _FileBackedCache:
+    """Base class for caches built from a file and rebuilt when its mtime changes"""
+
+    def __init__(self, template_path):
+        self.template_path = Path(template_path)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._compiled = None
+
+    def _current_mtime(self):
+        try:
+            return self.template_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _build(self):
+        raise NotImplementedError
+
+    def _ensure_loaded(self):
+        mtime = self._current_mtime()
+        if mtime is None:
+            raise FileNotFoundError(f'Template file not found at: {self.template_path}')
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._compiled = self._build()
+                    self._mtime = mtime
+                    logger.debug(f"模板已解析并缓存: {self.template_path}")
+        return self._compiled
+
+    def preload(self):
+        """Parse the template now instead of on the first request"""
+        try:
+            self._ensure_loaded()
+            return True
+        except Exception as e:
+            logger.warning(f"预加载模板失败: {e}")
+            return False
+
+    def invalidate(self):
+        with self._lock:
+            self._mtime = None
+            self._compiled = None
+
+
+class TemplateCache(_FileBackedCache):
+    """Parsed-once cache of an xlsx template, reloaded when the file changes"""
+
+    def _build(self):
+        from openpyxl import load_workbook
+
+        wb = load_workbook(str(self.template_path))
+        # copy.deepcopy 会丢失样式表，pickle 快照能完整保留工作簿
+        return pickle.dumps(wb, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def new_workbook(self):
+        """Return an independent copy of the template workbook"""
+        return pickle.loads(self._ensure_loaded())
+
+
+class TemplateMetadata(_FileBackedCache):
+    """Sheet name, key cell values, merged ranges and checksum of the template
+
+    健康检查频繁调用 /check-template，元数据只在模板文件变化后重新读取。
+    """
+
+    def __init__(self, template_path, key_cells=()):
+        super().__init__(template_path)
+        self.key_cells = list(key_cells)
+
+    def _build(self):
+        data = self.template_path.read_bytes()
+        stat = self.template_path.stat()
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            sheet_xml = zf.read(_resolve_first_sheet(zf)).decode('utf-8')
+            workbook_xml = zf.read('xl/workbook.xml').decode('utf-8')
+        sheet_name = re.search(r'<sheet\b[^>]*\bname="([^"]*)"', workbook_xml).group(1)
+        key_cells = read_cell_values(io.BytesIO(data), self.key_cells)
+        return {
+            'sheet_name': unescape(sheet_name, {'&quot;': '"'}),
+            'key_cells': {addr: key_cells.get(addr) for addr in self.key_cells},
+            'merged_ranges': sorted(re.findall(r'<mergeCell\b[^>]*\bref="([^"]+)"', sheet_xml)),
+            'checksum': 'sha256:' + hashlib.sha256(data).hexdigest(),
+            'size': len(data),
+            'modified': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+    def get(self):
+        metadata = self._ensure_loaded()
+        return {**metadata, 'key_cells': dict(metadata['key_cells']),
+                'merged_ranges': list(metadata['merged_ranges'])}
+
+
+# ---------------------------------------------------------------------------
+# 直接修改 xlsx 压缩包的渲染器
+# ---------------------------------------------------------------------------
+
+_LOCAL_HEADER = struct.Struct('<IHHHHHIIIHH')
+_CENTRAL_HEADER = struct.Struct('<IHHHHHHIIIHHHHHII')
+_END_OF_CENTRAL_DIR = struct.Struct('<IHHHHIIH')
+_UTF8_FLAG = 0x800
+
+# XML 1.0 不允许的控制字符，openpyxl 遇到会直接报错，这里直接去掉
+_ILLEGAL_XML_CHARS = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+_CACHED_FORMULA_VALUE = re.compile(r'(<f>[^<]*</f>)<v>[^<]*</v>')
+_CALC_PR = re.compile(r'<calcPr\b([^>]*?)(/?)>')
+
+
+class _ZipMember:
+    __slots__ = ('info', 'raw')
+
+    def __init__(self, info, raw):
+        self.info = info
+        self.raw = raw
+
+
+def _dos_datetime(date_time):
+    year, month, day, hour, minute, second = date_time
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    return dos_time, dos_date
+
+
+def _read_raw_members(data):
+    """Read every zip member's compressed bytes without inflating them"""
+    members = []
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        for info in zf.infolist():
+            offset = info.header_offset
+            name_len, extra_len = struct.unpack_from('<HH', data, offset + 26)
+            start = offset + 30 + name_len + extra_len
+            members.append(_ZipMember(info, data[start:start + info.compress_size]))
+    return members
+
+
+def _resolve_first_sheet(zf):
+    """Return the archive path of the workbook's first worksheet"""
+    workbook_xml = zf.read('xl/workbook.xml').decode('utf-8')
+    rels_xml = zf.read('xl/_rels/workbook.xml.rels').decode('utf-8')
+    match = re.search(r'<sheet\b[^>]*\br:id="([^"]+)"', workbook_xml)
+    if not match:
+        raise ValueError('Template workbook has no worksheets')
+    for rel in re.finditer(r'<Relationship\b[^>]*>', rels_xml):
+        tag = rel.group(0)
+        if f'Id="{match.group(1)}"' in tag:
+            target = re.search(r'Target="([^"]+)"', tag).group(1)
+            return target.lstrip('/') if target.startswith('/') else f'xl/{target}'
+    raise ValueError(f'Worksheet relationship {match.group(1)} not found')
+
+
+def _cell_xml(addr, style, value):
+    style_attr = f' s="{style}"' if style is not None else ''
+    if value is None or value == '':
+        return f'<c r="{addr}"{style_attr}/>'
+    if isinstance(value, bool):
+        return f'<c r="{addr}"{style_attr} t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c r="{addr}"{style_attr}><v>{value}</v></c>'
+    text = escape(_ILLEGAL_XML_CHARS.sub('', str(value)))
+    space = ' xml:space="preserve"' if text != text.strip() else ''
+    return f'<c r="{addr}"{style_attr} t="inlineStr"><is><t{space}>{text}</t></is></c>'
+
+
+_SHEET_NS = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+
+
+def _text_of(element):
+    """Concatenated <t> text of an <is> or <si> element, skipping phonetic runs"""
+    parts = []
+    for child in element:
+        if child.tag == _SHEET_NS + 't':
+            parts.append(child.text or '')
+        elif child.tag == _SHEET_NS + 'r':
+            parts.extend(t.text or '' for t in child.iter(_SHEET_NS + 't'))
+    return ''.join(parts)
+
+
+def read_cell_values(filepath, cells):
+    """Read the values of ``cells`` from the first worksheet of an xlsx file
+
+    用于从已生成的文档取回单元格数据（例如渲染 PDF），只解析工作表 XML，
+    不经过 openpyxl。公式单元格返回缓存的结果（没有时为 None）。
+    """
+    wanted = set(cells)
+    values = {}
+    with zipfile.ZipFile(filepath) as zf:
+        sheet_name = _resolve_first_sheet(zf)
+        shared_strings = None
+        for _, element in ElementTree.iterparse(zf.open(sheet_name)):
+            if element.tag == _SHEET_NS + 'row':
+                element.clear()
+                continue
+            if element.tag != _SHEET_NS + 'c' or element.get('r') not in wanted:
+                continue
+            cell_type = element.get('t')
+            raw = element.findtext(_SHEET_NS + 'v')
+            if cell_type == 'inlineStr':
+                inline = element.find(_SHEET_NS + 'is')
+                value = _text_of(inline) if inline is not None else ''
+            elif raw is None:
+                value = None
+            elif cell_type == 's':
+                if shared_strings is None:
+                    shared_strings = []
+                    if 'xl/sharedStrings.xml' in zf.namelist():
+                        root = ElementTree.fromstring(zf.read('xl/sharedStrings.xml'))
+                        shared_strings = [_text_of(si) for si in root.iter(_SHEET_NS + 'si')]
+                value = shared_strings[int(raw)]
+            elif cell_type == 'b':
+                value = raw == '1'
+            elif cell_type in ('str', 'e'):
+                value = raw
+            else:
+                number = float(raw)
+                value = int(number) if number.is_integer() else number
+            values[element.get('r')] = value
+    return values
+
+
+class XlsxPatchRenderer(_FileBackedCache):
+    """Render bookings by splicing cell values into the template's sheet XML
+
+    模板的其它 zip 成员（样式、主题、图片、共享字符串……）保持原样的压缩
+    字节，每个请求只重新压缩工作表 XML。字符串以 inlineStr 写入，所以不需要
+    修改 sharedStrings.xml；合并区域保持不变，不需要先取消合并再重新合并。
+    """
+
+    def __init__(self, template_path, cells, compress_level=6):
+        super().__init__(template_path)
+        self.cells = list(cells)
+        self.compress_level = compress_level
+
+    def _build(self):
+        data = self.template_path.read_bytes()
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            sheet_name = _resolve_first_sheet(zf)
+            sheet_xml = zf.read(sheet_name).decode('utf-8')
+            workbook_xml = zf.read('xl/workbook.xml').decode('utf-8')
+
+        # 公式的缓存结果在写入新数据后会过期，去掉它们并让 Excel 打开时重新计算
+        sheet_xml = _CACHED_FORMULA_VALUE.sub(r'\1', sheet_xml)
+        workbook_xml = _CALC_PR.sub(
+            lambda m: m.group(0) if 'fullCalcOnLoad' in m.group(1)
+            else f'<calcPr{m.group(1)} fullCalcOnLoad="1"{m.group(2)}>',
+            workbook_xml,
+        )
+
+        spans = []
+        for addr in self.cells:
+            match = re.search(rf'<c r="{addr}"(?:\s[^>]*?)?(?:/>|>.*?</c>)', sheet_xml)
+            if not match:
+                raise ValueError(f'Cell {addr} not found in {sheet_name}')
+            style = re.search(r'\ss="(\d+)"', match.group(0)[:match.group(0).index('>') + 1])
+            spans.append((match.start(), match.end(), addr, style.group(1) if style else None))
+        spans.sort()
+
+        segments = []
+        position = 0
+        for start, end, addr, style in spans:
+            segments.append(sheet_xml[position:start])
+            segments.append((addr, style))
+            position = end
+        segments.append(sheet_xml[position:])
+
+        members = []
+        sheet_info = None
+        for member in _read_raw_members(data):
+            if member.info.filename == sheet_name:
+                sheet_info = member.info
+                members.append(None)  # 占位：每个请求重新生成
+            elif member.info.filename == 'xl/workbook.xml':
+                members.append(self._compressed_member(member.info, workbook_xml.encode('utf-8')))
+            else:
+                members.append(member)
+        return {'segments': segments, 'members': members, 'sheet_info': sheet_info}
+
+    def _compressed_member(self, template_info, payload):
+        info = zipfile.ZipInfo(template_info.filename, date_time=template_info.date_time)
+        info.external_attr = template_info.external_attr
+        info.compress_type = zipfile.ZIP_DEFLATED
+        compressor = zlib.compressobj(self.compress_level, zlib.DEFLATED, -15)
+        raw = compressor.compress(payload) + compressor.flush()
+        info.CRC = zlib.crc32(payload)
+        info.file_size = len(payload)
+        info.compress_size = len(raw)
+        return _ZipMember(info, raw)
+
+    def render_sheet_xml(self, values):
+        compiled = self._ensure_loaded()
+        parts = []
+        for segment in compiled['segments']:
+            if isinstance(segment, tuple):
+                addr, style = segment
+                parts.append(_cell_xml(addr, style, values.get(addr)))
+            else:
+                parts.append(segment)
+        return ''.join(parts)
+
+    def write(self, fileobj, values):
+        """Write the rendered xlsx to a binary file object, return bytes written"""
+        compiled = self._ensure_loaded()
+        sheet = self._compressed_member(
+            compiled['sheet_info'], self.render_sheet_xml(values).encode('utf-8'))
+
+        offset = 0
+        central = []
+        for member in compiled['members']:
+            member = member or sheet
+            info = member.info
+            name = info.filename.encode('utf-8')
+            flags = _UTF8_FLAG if not info.filename.isascii() else 0
+            dos_time, dos_date = _dos_datetime(info.date_time)
+            header = _LOCAL_HEADER.pack(
+                0x04034b50, 20, flags, info.compress_type, dos_time, dos_date,
+                info.CRC, len(member.raw), info.file_size, len(name), 0)
+            fileobj.write(header)
+            fileobj.write(name)
+            fileobj.write(member.raw)
+            central.append(_CENTRAL_HEADER.pack(
+                0x02014b50, 20, 20, flags, info.compress_type, dos_time, dos_date,
+                info.CRC, len(member.raw), info.file_size, len(name), 0, 0, 0, 0,
+                info.external_attr, offset) + name)
+            offset += len(header) + len(name) + len(member.raw)
+
+        directory = b''.join(central)
+        fileobj.write(directory)
+        fileobj.write(_END_OF_CENTRAL_DIR.pack(
+            0x06054b50, 0, 0, len(central), len(central), len(directory), offset, 0))
+        return offset + len(directory) + _END_OF_CENTRAL_DIR.size
+
+    def render_bytes(self, values):
+        buffer = io.BytesIO()
+        self.write(buffer, values)
+        return buffer.getvalue()
+
+    def render_to_file(self, filepath, values):
+        self._ensure_loaded()  # 模板不兼容时在创建文件之前就报错
+        with open(filepath, 'wb') as f:
+            return self.write(f, values)
+
+
+# ---------------------------------------------------------------------------
+# 批量渲染用的进程池
+# ---------------------------------------------------------------------------
+
+_worker_renderer = None
+
+
+def _init_render_worker(template_path, cells):
+    global _worker_renderer
+    _worker_renderer = XlsxPatchRenderer(template_path, cells)
+    _worker_renderer.preload()
+
+
+def _render_in_worker(values):
+    return _worker_renderer.render_bytes(values)
+
+
+class RenderPool:
+    """Render many bookings with XlsxPatchRenderer, in worker processes for large batches
+
+    小批量时进程间传输的开销比渲染本身还大，直接在当前进程渲染。
+    """
+
+    def __init__(self, template_path, cells, max_workers=None, min_batch=64):
+        self.template_path = Path(template_path)
+        self.cells = list(cells)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.min_batch = min_batch
+        self._local = XlsxPatchRenderer(template_path, cells)
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # 与 render_offload.RenderOffload 相同：服务进程中已有日志、任务队列等
+                # 线程，fork 出的子进程可能继承被占用的锁，用 spawn 启动全新的解释器，
+                # 渲染器由 initializer 按模板路径重新创建
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_init_render_worker,
+                    initargs=(str(self.template_path), self.cells),
+                )
+            return self._executor
+
+    def render_many(self, values_list):
+        """Yield the rendered xlsx bytes for each cell-value dict, in order"""
+        if len(values_list) < self.min_batch or self.max_workers < 2:
+            for values in values_list:
+                yield self._local.render_bytes(values)
+            return
+        chunksize = max(1, len(values_list) // (self.max_workers * 4))
+        yield from self._get_executor().map(_render_in_worker, values_list, chunksize=chunksize)
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+                self._executor = None
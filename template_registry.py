@@ -0,0 +1,234 @@
+"""模板登记 - 多个酒店 / 房价的文档模板，每个模板带一个单元格映射文件
+
+原来单元格地址（J5、J19、D22……）和房价 98000 都写死在 app.py 中，新增一个
+酒店就要复制整个生成函数。这里每个模板由 TEMPLATES_DIR 中的一个 JSON 映射
+文件描述：
+
+    {
+      "id": "anda_malabo",
+      "name": "Hotel Anda Malabo",
+      "template": "../visa_booking_template.xlsx",
+      "default": true,
+      "rates": {"Classic Queen": 98000},
+      "default_rate": 98000,
+      "default_room_type": "Classic Queen",
+      "fields": {
+        "guestName": ["J5", "J19", "D22"],
+        "arrivalDate": {"cells": ["H22"], "format": "%Y-%m-%d"}
+      },
+      "metadata": {"AA4": "Document ID: {confirmationNumber}"},
+      "key_cells": ["C3", "B5"]
+    }
+
+fields 把预订字段（FIELDS）映射到单元格，format 为 Python 的格式说明
+（日期为 strftime 格式）；metadata 中的单元格用 str.format 模板生成，不在
+PDF 中显示。启动时把映射编译成渲染计划，并检查单元格没有落在合并区域的
+非左上角位置；每个模板的解析缓存和渲染器各自独立。
+"""
+import json
+import logging
+import re
+import string
+from pathlib import Path
+
+from pdf_renderer import PdfRenderer
+from template_engine import RenderPool, TemplateCache, TemplateMetadata, XlsxPatchRenderer
+
+logger = logging.getLogger(__name__)
+
+# 映射文件可以使用的预订字段
+FIELDS = {'guestName', 'email', 'company', 'arrivalDate', 'departureDate', 'bookingDate',
+          'generatedAt', 'confirmationNumber', 'remark', 'roomType', 'quantity', 'nights',
+          'roomRate', 'totalAmount'}
+# 日期字段没有指定 format 时的格式
+DATE_FIELDS = {'arrivalDate', 'departureDate', 'bookingDate', 'generatedAt'}
+DEFAULT_DATE_FORMAT = '%Y-%m-%d'
+
+_CELL_ADDRESS = re.compile(r'\$?([A-Z]{1,3})\$?([1-9][0-9]*)')
+
+
+class TemplateMappingError(ValueError):
+    """A mapping file that does not match the schema or its template"""
+
+
+def _cell_position(address):
+    """(row, column) of an A1-style address; openpyxl is not imported just for this"""
+    match = _CELL_ADDRESS.fullmatch(str(address))
+    if not match:
+        raise TemplateMappingError(f'Invalid cell address: {address}')
+    column = 0
+    for letter in match.group(1):
+        column = column * 26 + ord(letter) - ord('A') + 1
+    return int(match.group(2)), column
+
+
+def _range_bounds(merged_range):
+    """(min_col, min_row, max_col, max_row) of a range such as 'J5:P5'"""
+    first, _, last = merged_range.partition(':')
+    min_row, min_col = _cell_position(first)
+    max_row, max_col = _cell_position(last or first)
+    return min_col, min_row, max_col, max_row
+
+
+class DocumentTemplate:
+    """A template workbook with its compiled cell mapping and renderers"""
+
+    def __init__(self, mapping, base_dir):
+        try:
+            self.id = str(mapping['id'])
+            self.template_path = (Path(base_dir) / mapping['template']).resolve()
+            fields = mapping['fields']
+        except KeyError as e:
+            raise TemplateMappingError(f'Mapping is missing {e}')
+        self.name = mapping.get('name', self.id)
+        self.is_default = bool(mapping.get('default', False))
+        self.rates = {str(room_type): rate for room_type, rate in mapping.get('rates', {}).items()}
+        self.default_room_type = mapping.get('default_room_type') or next(iter(self.rates), '')
+        self.default_rate = mapping.get('default_rate', self.rates.get(self.default_room_type))
+        if not all(isinstance(rate, (int, float)) for rate in [self.default_rate, *self.rates.values()]):
+            raise TemplateMappingError(f'{self.id}: rates and default_rate must be numbers')
+        self.key_cells = list(mapping.get('key_cells', []))
+
+        # 渲染计划：(单元格, 字段, 格式) 和 (单元格, str.format 模板)
+        self.plan = []
+        for field, spec in fields.items():
+            if field not in FIELDS:
+                raise TemplateMappingError(f'Unknown field in {self.id}: {field}')
+            if isinstance(spec, list):
+                cells, fmt = spec, None
+            elif isinstance(spec, dict):
+                cells, fmt = spec.get('cells', []), spec.get('format')
+            else:
+                raise TemplateMappingError(f'{self.id}: {field} must map to a list of cells or an object')
+            if fmt is None and field in DATE_FIELDS:
+                fmt = DEFAULT_DATE_FORMAT
+            self.plan.extend((cell, field, fmt) for cell in cells)
+        self.metadata_plan = list(mapping.get('metadata', {}).items())
+        for cell, text in self.metadata_plan:
+            for _, field, _, _ in string.Formatter().parse(text):
+                if field is not None and field not in FIELDS:
+                    raise TemplateMappingError(f'Unknown field in {self.id} metadata {cell}: {field}')
+
+        self.field_cells = [cell for cell, _, _ in self.plan]
+        self.cells = self.field_cells + [cell for cell, _ in self.metadata_plan]
+        duplicates = sorted({cell for cell in self.cells if self.cells.count(cell) > 1})
+        if duplicates:
+            raise TemplateMappingError(f'Cells mapped more than once in {self.id}: {", ".join(duplicates)}')
+        for cell in self.cells:
+            _cell_position(cell)
+
+        self.cache = TemplateCache(self.template_path)
+        self.metadata = TemplateMetadata(self.template_path, self.key_cells)
+        self.xlsx_renderer = XlsxPatchRenderer(self.template_path, self.cells)
+        self.render_pool = RenderPool(self.template_path, self.cells)
+        # AA 列等元数据单元格在打印区域之外，PDF 只显示映射的字段
+        self.pdf_renderer = PdfRenderer(self.template_path, self.field_cells)
+        self._merged_cells = None
+
+    def validate(self):
+        """Check the mapping against the template's merged ranges
+
+        写入合并区域非左上角单元格的值不会显示，视为映射错误；写入合并区域
+        左上角的单元格记入 merged_cells（openpyxl 渲染时需要先取消合并）。
+        """
+        merged_ranges = [_range_bounds(merged) for merged in self.metadata.get()['merged_ranges']]
+        merged_cells = []
+        for cell in self.cells:
+            row, col = _cell_position(cell)
+            for min_col, min_row, max_col, max_row in merged_ranges:
+                if min_row <= row <= max_row and min_col <= col <= max_col:
+                    if (row, col) != (min_row, min_col):
+                        raise TemplateMappingError(
+                            f'{self.id}: {cell} is inside a merged range but not its top-left cell')
+                    merged_cells.append(cell)
+                    break
+        self._merged_cells = merged_cells
+
+    @property
+    def merged_cells(self):
+        """Mapped cells that are the top-left cell of a merged range"""
+        if self._merged_cells is None:
+            self.validate()
+        return self._merged_cells
+
+    def preload(self, renderer_mode):
+        """Parse the template for the renderer in use and for PDFs"""
+        if renderer_mode == 'xml':
+            self.xlsx_renderer.preload()
+        else:
+            self.cache.preload()
+        self.pdf_renderer.preload()
+
+    def rate(self, room_type):
+        return self.rates.get(room_type, self.default_rate)
+
+    def cell_values(self, context):
+        """Cell address -> value for a booking context with the FIELDS keys"""
+        values = {}
+        for cell, field, fmt in self.plan:
+            value = context[field]
+            values[cell] = format(value, fmt) if fmt else value
+        for cell, text in self.metadata_plan:
+            values[cell] = text.format_map(context)
+        return values
+
+    def describe(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'default': self.is_default,
+            'rates': dict(self.rates),
+            'default_rate': self.default_rate,
+            'default_room_type': self.default_room_type,
+            'fields': sorted({field for _, field, _ in self.plan}),
+        }
+
+
+class TemplateRegistry:
+    """All document templates described by the mapping files in ``folder``"""
+
+    def __init__(self, folder):
+        self.folder = Path(folder)
+        self.templates = {}
+        self.default_id = None
+        self.errors = {}
+
+    def load(self):
+        """Compile and validate every *.json mapping; invalid ones are skipped and recorded"""
+        templates, errors = {}, {}
+        for path in sorted(self.folder.glob('*.json')):
+            try:
+                mapping = json.loads(path.read_text(encoding='utf-8'))
+                template = DocumentTemplate(mapping, path.parent)
+                if template.id in templates:
+                    raise TemplateMappingError(f'Duplicate template id: {template.id}')
+                try:
+                    template.validate()
+                except FileNotFoundError:
+                    # 模板文件稍后才放到位时，在第一次使用时再检查
+                    logger.warning(f"模板文件不存在，暂不检查映射: {template.template_path}")
+            except (OSError, ValueError) as e:
+                # json.JSONDecodeError 和 TemplateMappingError 都是 ValueError
+                logger.error(f"模板映射无效 {path.name}: {e}")
+                errors[path.name] = str(e)
+                continue
+            templates[template.id] = template
+        self.templates = templates
+        self.errors = errors
+        defaults = [template.id for template in templates.values() if template.is_default]
+        self.default_id = defaults[0] if defaults else next(iter(templates), None)
+        return len(templates)
+
+    def get(self, template_id=None):
+        """Template by id, the default one when ``template_id`` is empty; KeyError if unknown"""
+        template_id = template_id or self.default_id
+        if not isinstance(template_id, str) or template_id not in self.templates:
+            raise KeyError(template_id)
+        return self.templates[template_id]
+
+    @property
+    def default(self):
+        return self.get()
+
+    def __iter__(self):
+        return iter(self.templates.values())
@@ -0,0 +1,49 @@
+"""测试夹具：每个测试使用临时目录中的数据库和生成文件夹"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import app as visa_app  # noqa: E402
+
+UNLIMITED = {'RATE_LIMIT_IP': '0', 'RATE_LIMIT_EMAIL': '0', 'RATE_LIMIT_COMPANY': '0'}
+
+
+def booking(i=0, **fields):
+    """A valid /generate-document body"""
+    data = {
+        'guestName': f'Guest {i}',
+        'email': f'guest{i}@example.com',
+        'company': 'ACME Travel',
+        'arrivalDate': '2026-11-01',
+        'departureDate': '2026-11-05',
+        'quantity': 1,
+    }
+    data.update(fields)
+    return data
+
+
+@pytest.fixture
+def make_client(tmp_path):
+    """create_app() on tmp_path; keyword arguments override the settings"""
+    def make(**settings):
+        options = {
+            'BASE_DIR': tmp_path,
+            'GENERATED_FOLDER': tmp_path / 'generated',
+            'UPLOAD_FOLDER': tmp_path / 'uploads',
+            'DATABASE_PATH': tmp_path / 'test.db',
+            'COUNTER_FILE': tmp_path / 'daily_counters.json',
+            'RETENTION_INTERVAL_MINUTES': 0,
+            **UNLIMITED,
+        }
+        options.update(settings)
+        return visa_app.create_app(**options).test_client()
+    return make
+
+
+@pytest.fixture
+def client(make_client):
+    return make_client()
@@ -0,0 +1,71 @@
+"""asgi.py 的 WSGI 桥接和事件流"""
+import asyncio
+
+import pytest
+
+import app as visa_app
+from conftest import booking
+
+
+@pytest.fixture
+def asgi(client, monkeypatch):
+    # 导入 asgi.py 时不要按默认配置初始化，使用 client 夹具的临时目录
+    monkeypatch.setenv('RENDER_PROCESSES', '0')
+    monkeypatch.setattr(visa_app, 'create_app', lambda **settings: visa_app.app)
+    import asgi
+    return asgi
+
+
+def scope(path, headers=(), query=b''):
+    return {'type': 'http', 'method': 'GET', 'path': path, 'query_string': query, 'http_version': '1.1',
+            'headers': [(name.encode('latin-1'), value.encode('latin-1')) for name, value in headers]}
+
+
+def test_repeated_cookie_headers_are_joined_with_semicolons(asgi):
+    environ = asgi.WsgiBridge._environ(scope('/', [('Cookie', 'a=1'), ('Cookie', 'b=2'),
+                                                   ('Accept', 'text/html'), ('Accept', '*/*')]), b'')
+    assert environ['HTTP_COOKIE'] == 'a=1; b=2'
+    assert environ['HTTP_ACCEPT'] == 'text/html,*/*'
+
+
+def test_event_stream_goes_through_the_flask_hooks(asgi, client):
+    bridge = asgi.WsgiBridge(visa_app.app, 4)
+    sent = []
+    events = asyncio.Queue()
+
+    async def run():
+        requests = [{'type': 'http.request', 'body': b'', 'more_body': False}]
+        disconnect = asyncio.Event()
+
+        async def receive():
+            if requests:
+                return requests.pop()
+            await disconnect.wait()
+            return {'type': 'http.disconnect'}
+
+        async def send(message):
+            sent.append(message)
+            if message['type'] == 'http.response.body' and b'document_added' in message['body']:
+                await events.put(message['body'])
+
+        stream = asyncio.ensure_future(bridge(scope('/documents/stream', [
+            ('Origin', 'http://example.com'), ('X-Request-ID', 'stream-1')]), receive, send))
+        loop = asyncio.get_running_loop()
+        while visa_app.document_events.subscriber_count == 0:
+            await asyncio.sleep(0.01)
+        await loop.run_in_executor(None, lambda: client.post('/generate-document', json=booking(1)))
+        body = await asyncio.wait_for(events.get(), 10)
+        disconnect.set()
+        await asyncio.wait_for(stream, 10)
+        return body
+
+    body = asyncio.run(run())
+    start = sent[0]
+    headers = dict(start['headers'])
+    assert start['status'] == 200
+    assert headers[b'content-type'].startswith(b'text/event-stream')
+    assert headers[b'x-request-id'] == b'stream-1'
+    assert headers[b'access-control-allow-origin'] == b'http://example.com'
+    assert b'Guest 1' in body
+    assert visa_app.document_events.subscriber_count == 0
+    bridge.executor.shutdown(wait=False)
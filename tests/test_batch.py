@@ -0,0 +1,39 @@
+"""POST /generate-documents/batch 和批量渲染的进程池"""
+import io
+import zipfile
+
+import app as visa_app
+from conftest import booking
+from template_engine import RenderPool
+
+
+def test_batch_json_results(client):
+    rows = [booking(i) for i in range(3)] + [{'guestName': 'Missing fields'}]
+    response = client.post('/generate-documents/batch?format=json', json=rows)
+    assert response.status_code == 200
+    data = response.get_json()
+    assert (data['generated'], data['failed']) == (3, 1)
+    ids = [result['id'] for result in data['results'][:3]]
+    assert len(set(ids)) == 3
+    assert data['results'][3]['success'] is False
+    assert all(visa_app.document_registry.get(document_id) for document_id in ids)
+
+
+def test_batch_zip_contains_every_document(client):
+    response = client.post('/generate-documents/batch', json=[booking(i) for i in range(2)])
+    assert response.status_code == 200
+    archive = zipfile.ZipFile(io.BytesIO(response.get_data()))
+    names = archive.namelist()
+    assert len(names) == 3 and 'results.json' in names
+
+
+def test_render_pool_workers_match_local_rendering(client):
+    template = visa_app.document_templates.get()
+    values = [{cell: f'value {i}' for cell in template.cells[:3]} for i in range(4)]
+    pool = RenderPool(template.template_path, template.cells, max_workers=2, min_batch=1)
+    try:
+        rendered = list(pool.render_many(values))
+    finally:
+        pool.shutdown()
+    local = RenderPool(template.template_path, template.cells, max_workers=1)
+    assert rendered == list(local.render_many(values))
@@ -0,0 +1,68 @@
+"""确认号计数器在多个进程同时分配时不重复"""
+import multiprocessing
+import threading
+
+from conftest import booking
+from counters import DailyCounter
+
+PROCESSES = 4
+PER_PROCESS = 200
+
+
+def allocate_numbers(db_path, count, queue):
+    counter = DailyCounter(db_path)
+    numbers = [counter.next(day='20260101') for _ in range(count)]
+    numbers.extend(counter.allocate(5, day='20260101'))
+    queue.put(numbers)
+
+
+def test_numbers_are_unique_across_processes(tmp_path):
+    db_path = str(tmp_path / 'counter.db')
+    DailyCounter(db_path).current()  # 先建表，子进程同时启动时不争抢建表
+    context = multiprocessing.get_context('spawn')
+    queue = context.Queue()
+    workers = [context.Process(target=allocate_numbers, args=(db_path, PER_PROCESS, queue))
+               for _ in range(PROCESSES)]
+    for worker in workers:
+        worker.start()
+    results = [queue.get(timeout=120) for _ in workers]
+    for worker in workers:
+        worker.join(timeout=30)
+        assert worker.exitcode == 0
+
+    numbers = [number for result in results for number in result]
+    total = PROCESSES * (PER_PROCESS + 5)
+    assert len(numbers) == total
+    assert sorted(numbers) == list(range(1, total + 1))
+    assert DailyCounter(db_path).current(day='20260101') == total
+
+
+def test_numbers_are_unique_across_threads(tmp_path):
+    counter = DailyCounter(tmp_path / 'counter.db')
+    numbers = []
+    lock = threading.Lock()
+
+    def work():
+        allocated = [counter.next(day='20260101') for _ in range(100)]
+        with lock:
+            numbers.extend(allocated)
+
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(numbers) == list(range(1, 801))
+
+
+def test_days_are_counted_separately(tmp_path):
+    counter = DailyCounter(tmp_path / 'counter.db')
+    assert counter.next(day='20260101') == 1
+    assert counter.next(day='20260101') == 2
+    assert counter.next(day='20260102') == 1
+    assert list(counter.allocate(3, day='20260101')) == [3, 4, 5]
+
+
+def test_generated_documents_get_distinct_ids(client):
+    ids = {client.post('/generate-document', json=booking(i)).get_json()['document']['id'] for i in range(5)}
+    assert len(ids) == 5
@@ -0,0 +1,50 @@
+"""/documents 列表、分页和增量"""
+import app as visa_app
+from conftest import booking
+
+
+def generate(client, count, start=0):
+    return [client.post('/generate-document', json=booking(i)).get_json()['document']['id']
+            for i in range(start, start + count)]
+
+
+def test_pages_cover_every_document(client):
+    ids = generate(client, 5)
+    seen, cursor = [], None
+    while True:
+        url = '/documents?limit=2' + (f'&cursor={cursor}' if cursor else '')
+        data = client.get(url).get_json()
+        seen.extend(doc['id'] for doc in data['documents'])
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+    assert seen == ids
+
+
+def test_delta_lists_added_and_removed_documents(client):
+    first, second = generate(client, 2)
+    listing = client.get('/documents').get_json()
+    assert [doc['id'] for doc in listing['documents']] == [first, second]
+
+    third, = generate(client, 1, start=2)
+    visa_app.document_registry.remove_many([first])
+    delta = client.get(f"/documents?since={listing['next_since']}&removed_after={listing['next_event']}").get_json()
+    assert [doc['id'] for doc in delta['documents']] == [third]
+    assert delta['removed'] == [first]
+    assert delta['resync'] is False
+
+    # 没有变化时返回 304
+    etag = client.get(f"/documents?since={delta['next_since']}&removed_after={delta['next_event']}").headers['ETag']
+    unchanged = client.get(f"/documents?since={delta['next_since']}&removed_after={delta['next_event']}",
+                           headers={'If-None-Match': etag})
+    assert unchanged.status_code == 304
+
+
+def test_delta_asks_for_resync_when_events_were_pruned(client):
+    generate(client, 3)
+    listing = client.get('/documents').get_json()
+    visa_app.document_registry.remove_many([doc['id'] for doc in listing['documents']])
+    visa_app.document_registry.prune_events(0)
+    generate(client, 1, start=3)
+    delta = client.get(f"/documents?since={listing['next_since']}&removed_after={listing['next_event']}").get_json()
+    assert delta['resync'] is True
@@ -0,0 +1,51 @@
+"""重复请求的幂等处理"""
+import app as visa_app
+from conftest import booking
+from idempotency import IdempotencyStore
+
+
+def test_retry_with_the_same_key_replays_the_document(client):
+    first = client.post('/generate-document', json=booking(1), headers={'Idempotency-Key': 'retry-1'})
+    retry = client.post('/generate-document', json=booking(1), headers={'Idempotency-Key': 'retry-1'})
+    assert retry.status_code == 200
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json()['document']['id'] == first.get_json()['document']['id']
+    assert visa_app.document_registry.count() == 1
+
+
+def test_identical_body_without_key_replays(client):
+    first = client.post('/generate-document', json=booking(1)).get_json()
+    retry = client.post('/generate-document', json=booking(1, guestName='  Guest   1 '))
+    assert retry.headers['Idempotent-Replayed'] == 'true'
+    assert retry.get_json()['document']['id'] == first['document']['id']
+
+
+def test_key_reused_for_a_different_booking_is_rejected(client):
+    client.post('/generate-document', json=booking(1), headers={'Idempotency-Key': 'retry-1'})
+    other = client.post('/generate-document', json=booking(2), headers={'Idempotency-Key': 'retry-1'})
+    assert other.status_code == 422
+    assert visa_app.document_registry.count() == 1
+
+
+def test_retry_after_cleanup_generates_again(client):
+    first = client.post('/generate-document', json=booking(1), headers={'Idempotency-Key': 'retry-1'})
+    first_id = first.get_json()['document']['id']
+    visa_app.document_registry.remove(first_id)
+
+    retry = client.post('/generate-document', json=booking(1), headers={'Idempotency-Key': 'retry-1'})
+    assert retry.status_code == 200
+    assert 'Idempotent-Replayed' not in retry.headers
+    assert retry.get_json()['document']['id'] != first_id
+
+
+def test_only_one_concurrent_retry_reclaims(tmp_path):
+    store = IdempotencyStore(tmp_path / 'test.db')
+    assert store.claim('key:a', 'payload:1') == ('new', None)
+    store.complete('key:a', '202610170001')
+    status, entry = store.claim('key:a', 'payload:1')
+    assert status == 'done'
+
+    # 两个重试都读到了同一条记录
+    assert store.reclaim('key:a', entry, 'payload:1') is True
+    assert store.reclaim('key:a', entry, 'payload:1') is False
+    assert store.claim('key:a', 'payload:1')[0] == 'pending'
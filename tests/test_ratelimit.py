@@ -0,0 +1,46 @@
+"""令牌桶限流，批量生成按文档数扣除"""
+import pytest
+
+import app as visa_app
+from conftest import booking
+from ratelimit import QuotaExceeded, RateLimited, RateLimiter
+
+
+def test_cost_above_capacity_is_rejected_without_taking_tokens(tmp_path):
+    limiter = RateLimiter(tmp_path / 'test.db', {'ip': (5, 60)})
+    with pytest.raises(QuotaExceeded) as error:
+        limiter.check_many({('ip', '10.0.0.1'): 6}, now=1000)
+    assert (error.value.scope, error.value.capacity) == ('ip', 5)
+
+    limiter.check_many({('ip', '10.0.0.1'): 5}, now=1000)
+    with pytest.raises(RateLimited) as error:
+        limiter.check({'ip': '10.0.0.1'}, now=1000)
+    assert error.value.retry_after == 12
+
+
+def test_batch_rows_are_charged_against_the_single_request_buckets(make_client):
+    client = make_client(RATE_LIMIT_IP='10/3600')
+    response = client.post('/generate-documents/batch?format=json', json=[booking(i) for i in range(4)])
+    assert response.status_code == 200
+
+    # 剩 6 个令牌，7 行的批量要等
+    response = client.post('/generate-documents/batch?format=json', json=[booking(i) for i in range(4, 11)])
+    assert response.status_code == 429
+    assert int(response.headers['Retry-After']) > 0
+    assert visa_app.document_registry.count() == 4
+
+    assert client.post('/generate-document', json=booking(20)).status_code == 200
+    assert visa_app.document_registry.count() == 5
+
+
+def test_batch_larger_than_the_quota_is_rejected(make_client):
+    client = make_client(RATE_LIMIT_EMAIL='3/3600')
+    rows = [booking(i, email='same@example.com') for i in range(4)]
+    response = client.post('/generate-documents/batch?format=json', json=rows)
+    assert response.status_code == 429
+    assert 'Retry-After' not in response.headers
+    assert response.get_json()['max_batch_size'] == 3
+
+    # 被拒绝的批量没有扣除令牌
+    response = client.post('/generate-documents/batch?format=json', json=rows[:3])
+    assert response.status_code == 200
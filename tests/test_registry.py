@@ -0,0 +1,46 @@
+"""DocumentRegistry 的进程内缓存"""
+import sqlite3
+
+from registry import DocumentRegistry
+
+
+def document(i):
+    return {'id': f'2026110{i}', 'filename': f'Visa_Booking_2026110{i}_Guest.xlsx',
+            'company': 'ACME Travel', 'email': f'guest{i}@example.com', 'guest_name': f'Guest {i}',
+            'generated_date': '2026-10-17 09:00:00'}
+
+
+def test_removal_in_another_process_clears_the_cache(tmp_path):
+    reader = DocumentRegistry(tmp_path / 'test.db', cache_check_seconds=0)
+    writer = DocumentRegistry(tmp_path / 'test.db')
+    writer.add(document(1))
+    assert reader.get('20261101')['guest_name'] == 'Guest 1'
+
+    writer.remove('20261101')
+    assert reader.get('20261101') is None
+
+
+def test_cache_hits_skip_the_database_between_checks(tmp_path):
+    registry = DocumentRegistry(tmp_path / 'test.db', cache_check_seconds=3600)
+    registry.add(document(1))
+    registry.get('20261101')
+
+    statements = []
+    registry.db.get().set_trace_callback(statements.append)
+    for _ in range(10):
+        assert registry.get('20261101')['id'] == '20261101'
+    assert statements == []
+
+
+def test_writes_after_another_connection_changed_the_schema(tmp_path):
+    DocumentRegistry(tmp_path / 'test.db').count()
+    # 表结构已存在，这个实例的连接从数据库文件加载表结构
+    registry = DocumentRegistry(tmp_path / 'test.db')
+    registry.max_seq()
+    other = sqlite3.connect(str(tmp_path / 'test.db'))
+    other.execute('CREATE TABLE unrelated (value)')
+    other.commit()
+
+    registry.add(document(1))
+    registry.remove('20261101')
+    assert registry.count() == 0
@@ -0,0 +1,52 @@
+"""全文搜索和拼写容错词表"""
+import pytest
+
+import registry as registry_module
+from registry import DocumentRegistry
+from search import DocumentSearch
+
+
+def document(i, guest_name, company='Acme Travel'):
+    return {'id': f'2026101700{i:02d}', 'filename': f'Visa_Booking_2026101700{i:02d}.xlsx',
+            'company': company, 'guest_name': guest_name, 'email': f'guest{i}@example.com',
+            'generated_date': '2026-10-17 09:00:00'}
+
+
+def terms(registry):
+    return {row[0] for row in registry.db.get().execute('SELECT term FROM search_terms')}
+
+
+def test_typo_finds_the_guest(tmp_path):
+    registry = DocumentRegistry(tmp_path / 'test.db')
+    registry.add_many([document(1, 'Johnson Smith'), document(2, 'Maria Garcia')])
+    results = DocumentSearch(registry).search('jonhson')
+    assert [(doc['id'], doc['match']) for doc in results] == [('202610170001', 'fuzzy')]
+
+
+def test_removing_documents_prunes_words_no_longer_used(tmp_path):
+    registry = DocumentRegistry(tmp_path / 'test.db')
+    registry.add_many([document(1, 'Johnson Smith'), document(2, 'Maria Smith')])
+    registry.remove_many(['202610170001'])
+
+    remaining = terms(registry)
+    assert 'johnson' not in remaining
+    assert {'smith', 'maria', 'acme', 'travel'} <= remaining
+    assert registry.db.get().execute(
+        "SELECT COUNT(*) FROM search_fuzzy WHERE term = 'johnson'").fetchone()[0] == 0
+    assert DocumentSearch(registry).search('jonhson') == []
+
+
+def test_document_is_not_written_when_indexing_fails(tmp_path, monkeypatch):
+    registry = DocumentRegistry(tmp_path / 'test.db')
+
+    def fail(conn, docs):
+        raise RuntimeError('index failed')
+
+    monkeypatch.setattr(registry_module, 'index_terms', fail)
+    with pytest.raises(RuntimeError):
+        registry.add(document(1, 'Johnson Smith'))
+    with pytest.raises(RuntimeError):
+        registry.add_many([document(2, 'Maria Garcia')])
+    assert registry.count() == 0
+    assert not registry.exists('202610170001')
+    assert terms(registry) == set()
@@ -0,0 +1,92 @@
+"""存储后端，按天归档的压缩包"""
+import zipfile
+from datetime import datetime, timedelta
+
+import pytest
+
+import storage
+from registry import DocumentRegistry
+from retention import RetentionSweeper
+from storage import DailyArchiveStorage
+
+
+def document(i, generated_date='2026-10-17 09:00:00'):
+    return {'id': f'2026101700{i:02d}', 'filename': f'Visa_Booking_2026101700{i:02d}_Guest.xlsx',
+            'generated_date': generated_date}
+
+
+@pytest.fixture
+def zip_opens(monkeypatch):
+    """Count how many times the storage module parses an archive"""
+    opened = []
+
+    class CountingZipFile(zipfile.ZipFile):
+        def __init__(self, *args, **kwargs):
+            opened.append(args[0])
+            super().__init__(*args, **kwargs)
+
+    monkeypatch.setattr(storage.zipfile, 'ZipFile', CountingZipFile)
+    return opened
+
+
+def test_archive_round_trip(tmp_path):
+    archive = DailyArchiveStorage(tmp_path)
+    archive.save(document(1), b'xlsx 1')
+    archive.save(document(1), b'pdf 1', '.pdf')
+    archive.save(document(2), b'xlsx 2' * 1000)
+
+    assert archive.load(document(1)) == b'xlsx 1'
+    assert archive.load(document(1), '.pdf') == b'pdf 1'
+    assert archive.load(document(2)) == b'xlsx 2' * 1000
+    assert archive.size(document(2)) == 6000
+    assert archive.load(document(3)) is None
+    assert archive.load(document(1, '2026-10-16 09:00:00')) is None
+
+
+def test_archive_index_avoids_reparsing(tmp_path, zip_opens):
+    archive = DailyArchiveStorage(tmp_path)
+    for i in range(5):
+        archive.save(document(i), b'xlsx %d' % i)
+    del zip_opens[:]
+
+    for i in range(5):
+        assert archive.load(document(i)) == b'xlsx %d' % i
+        assert archive.size(document(i)) is not None
+        archive.save(document(i), b'xlsx %d' % i)
+    assert archive.load(document(9)) is None
+    assert zip_opens == []
+
+
+def test_archive_written_by_another_process_is_reindexed(tmp_path):
+    reader = DailyArchiveStorage(tmp_path)
+    writer = DailyArchiveStorage(tmp_path)
+    writer.save(document(1), b'xlsx 1')
+    assert reader.load(document(2)) is None
+
+    writer.save(document(2), b'xlsx 2')
+    assert reader.load(document(2)) == b'xlsx 2'
+
+
+def test_archive_refuses_single_document_deletes(tmp_path):
+    archive = DailyArchiveStorage(tmp_path)
+    archive.save(document(1), b'xlsx 1')
+    with pytest.raises(NotImplementedError):
+        archive.delete(document(1))
+
+
+def test_sweep_purges_archives_by_whole_day(tmp_path):
+    registry = DocumentRegistry(tmp_path / 'test.db')
+    archive = DailyArchiveStorage(tmp_path / 'archives')
+    now = datetime.now()
+    old = document(1, (now - timedelta(days=3)).strftime('%Y-%m-%d %H:%M:%S'))
+    today = document(2, now.replace(hour=0, minute=0, second=1).strftime('%Y-%m-%d %H:%M:%S'))
+    for doc in (old, today):
+        registry.add(doc)
+        archive.save(doc, b'xlsx')
+
+    stats = RetentionSweeper(registry, archive, ttl_hours=0).sweep()
+    assert stats['records_removed'] == 1
+    assert stats['bytes_reclaimed'] > 0
+    assert registry.get(old['id']) is None
+    assert archive.load(old) is None
+    assert archive.load(today) == b'xlsx'
@@ -0,0 +1,21 @@
+"""生成的 xlsx 内容"""
+import io
+
+from openpyxl import load_workbook
+
+from conftest import booking
+
+
+def test_quantity_is_written_to_r22(client):
+    # Q22 是 M22:Q22 合并单元格的一部分，数量写在 Quantity 列 R22
+    response = client.post('/generate-document', json=booking(quantity=3, roomType='Classic Queen'))
+    assert response.status_code == 200
+    document = response.get_json()['document']
+
+    download = client.get(document['download_url'])
+    assert download.status_code == 200
+    sheet = load_workbook(io.BytesIO(download.data)).active
+    assert sheet['R22'].value == 3
+    assert sheet['M22'].value == 'Classic Queen'
+    assert sheet['T22'].value == 4
+    assert document['total_amount'] == 3 * 4 * 98000